@@ -0,0 +1,269 @@
+import os
+import json
+import math
+from datetime import datetime, timedelta, time as dtime
+from time import time
+from zoneinfo import ZoneInfo
+
+from apscheduler.jobstores.base import JobLookupError
+
+from db import db
+from dispatch import dispatcher, PRIORITY_UI
+
+# Часовой пояс бара (например, Europe/Moscow): в контейнере локальное время — UTC, и без него сутки
+# и итог смены съезжают на разницу поясов. Пусто — локальное время машины
+ANALYTICS_TZ = os.getenv("ANALYTICS_TZ", "")
+# Рабочие сутки бара начинаются не в полночь: ночная смена попадает в один день
+ANALYTICS_DAY_START_HOUR = int(os.getenv("ANALYTICS_DAY_START_HOUR", "6"))
+# Когда отправлять итог смены в general (ЧЧ:ММ в ANALYTICS_TZ)
+SHIFT_SUMMARY_TIME = os.getenv("SHIFT_SUMMARY_TIME", "06:00")
+STATS_WEEK_DAYS = 7
+TZ = ZoneInfo(ANALYTICS_TZ) if ANALYTICS_TZ else None
+# Относительная точность квантилей: ~100 корзин на диапазон от секунды до суток
+SKETCH_ACCURACY = 0.05
+
+SQL_SELECT_STATS_ROW = (
+    "SELECT count, total, sketch FROM order_stats WHERE period = ? AND bucket = ? AND zone = ? AND strength = ?"
+)
+SQL_UPSERT_STATS = (
+    "INSERT INTO order_stats (period, bucket, zone, strength, count, total, sketch) VALUES (?, ?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT(period, bucket, zone, strength) DO UPDATE SET "
+    "count = excluded.count, total = excluded.total, sketch = excluded.sketch"
+)
+SQL_SELECT_STATS = (
+    "SELECT bucket, zone, strength, count, total, sketch FROM order_stats "
+    "WHERE period = ? AND bucket >= ? AND bucket < ?"
+)
+SQL_HAS_STATS = "SELECT 1 FROM order_stats LIMIT 1"
+SQL_SELECT_ALL_COMPLETED = (
+    "SELECT zone, strength, created_at, completed_at FROM orders WHERE status = 'done' AND completed_at IS NOT NULL"
+)
+
+
+class QuantileSketch:
+    # Логарифмические корзины: квантиль с относительной ошибкой SKETCH_ACCURACY, скетчи складываются
+    gamma = (1 + SKETCH_ACCURACY) / (1 - SKETCH_ACCURACY)
+    log_gamma = math.log(gamma)
+
+    def __init__(self, bins=None):
+        self.bins = bins or {}
+
+    @classmethod
+    def loads(cls, text):
+        return cls({int(k): v for k, v in json.loads(text).items()})
+
+    def dumps(self):
+        return json.dumps(self.bins, separators=(",", ":"))
+
+    @property
+    def count(self):
+        return sum(self.bins.values())
+
+    def add(self, value, count=1):
+        key = math.ceil(math.log(max(value, 1)) / self.log_gamma)
+        self.bins[key] = self.bins.get(key, 0) + count
+
+    def merge(self, other):
+        for key, count in other.bins.items():
+            self.bins[key] = self.bins.get(key, 0) + count
+
+    def quantile(self, q):
+        total = self.count
+        if not total:
+            return None
+        rank = q * (total - 1)
+        seen = 0
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if seen > rank:
+                return 2 * self.gamma ** key / (self.gamma + 1)
+        return None
+
+
+class Rollup:
+    __slots__ = ("count", "total", "sketch")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.sketch = QuantileSketch()
+
+    def add_row(self, count, total, sketch):
+        self.count += count
+        self.total += total
+        self.sketch.merge(QuantileSketch.loads(sketch))
+
+
+def local(ts):
+    return datetime.fromtimestamp(ts, TZ)
+
+
+def hour_start(ts):
+    return int(local(ts).replace(minute=0, second=0, microsecond=0).timestamp())
+
+
+def day_start(ts):
+    shifted = local(ts) - timedelta(hours=ANALYTICS_DAY_START_HOUR)
+    start = datetime(shifted.year, shifted.month, shifted.day, tzinfo=TZ) + timedelta(hours=ANALYTICS_DAY_START_HOUR)
+    return int(start.timestamp())
+
+
+def _buckets(completed_at):
+    return (("hour", hour_start(completed_at)), ("day", day_start(completed_at)))
+
+
+async def record_completion(conn, order):
+    # Передаётся в complete_order: пишется в одной транзакции с отметкой о выдаче
+    zone, strength, created_at, completed_at = order[3], order[6] or "", order[10], order[11]
+    await _add(conn, zone, strength, max(0, completed_at - created_at), completed_at)
+
+
+async def _add(conn, zone, strength, duration, completed_at):
+    for period, bucket in _buckets(completed_at):
+        async with conn.execute(SQL_SELECT_STATS_ROW, (period, bucket, zone, strength)) as cursor:
+            row = await cursor.fetchone()
+        sketch = QuantileSketch.loads(row[2]) if row else QuantileSketch()
+        sketch.add(duration)
+        await conn.execute(SQL_UPSERT_STATS, (
+            period, bucket, zone, strength,
+            (row[0] if row else 0) + 1, (row[1] if row else 0) + duration, sketch.dumps(),
+        ))
+
+
+async def backfill():
+    # Один раз после обновления: раскладываем уже выполненные заказы по агрегатам
+    if await db.fetchone(SQL_HAS_STATS):
+        return 0
+    rows = await db.fetchall(SQL_SELECT_ALL_COMPLETED)
+    if not rows:
+        return 0
+    rollups = {}
+    for zone, strength, created_at, completed_at in rows:
+        duration = max(0, completed_at - created_at)
+        for period, bucket in _buckets(completed_at):
+            rollup = rollups.setdefault((period, bucket, zone, strength or ""), Rollup())
+            rollup.count += 1
+            rollup.total += duration
+            rollup.sketch.add(duration)
+    async with db.writer() as conn:
+        await conn.executemany(SQL_UPSERT_STATS, [
+            (*key, r.count, r.total, r.sketch.dumps()) for key, r in rollups.items()
+        ])
+    return len(rows)
+
+
+async def load_rollups(period, start, end):
+    # Строк в окне не больше (корзин × зон × крепостей): от длины истории не зависит
+    total = Rollup()
+    by_zone = {}
+    by_strength = {}
+    by_bucket = {}
+    for bucket, zone, strength, count, sum_, sketch in await db.fetchall(SQL_SELECT_STATS, (period, start, end)):
+        for rollup in (total, by_zone.setdefault(zone, Rollup()), by_strength.setdefault(strength, Rollup()),
+                       by_bucket.setdefault(bucket, Rollup())):
+            rollup.add_row(count, sum_, sketch)
+    return total, by_zone, by_strength, by_bucket
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return "—"
+    seconds = int(round(seconds))
+    mins, secs = divmod(seconds, 60)
+    hours, mins = divmod(mins, 60)
+    if hours:
+        return f"{hours}ч {mins}м"
+    if mins:
+        return f"{mins}м {secs}с"
+    return f"{secs}с"
+
+
+def format_rollup(rollup):
+    avg = rollup.total / rollup.count if rollup.count else None
+    return (f"{rollup.count} · ср. {format_duration(avg)} · "
+            f"медиана {format_duration(rollup.sketch.quantile(0.5))} · "
+            f"p90 {format_duration(rollup.sketch.quantile(0.9))}")
+
+
+def _sections(title, total, by_zone, by_strength):
+    lines = [title, f"Всего: {format_rollup(total)}"]
+    if by_zone:
+        lines.append("Зоны:")
+        lines += [f"  {zone}: {format_rollup(r)}" for zone, r in sorted(by_zone.items())]
+    if by_strength:
+        lines.append("Крепость:")
+        lines += [f"  {strength or '—'}: {format_rollup(r)}" for strength, r in sorted(by_strength.items())]
+    return lines
+
+
+async def stats_report(now=None):
+    now = int(time() if now is None else now)
+    today = day_start(now)
+    total, by_zone, by_strength, _ = await load_rollups("day", today, today + 1)
+    if total.count:
+        lines = _sections(f"📊 Выдача с {local(today):%d.%m %H:%M}", total, by_zone, by_strength)
+    else:
+        lines = ["📊 Сегодня ещё нет выданных заказов"]
+    week, _, _, _ = await load_rollups("day", today - (STATS_WEEK_DAYS - 1) * 86400 - 3600, today + 1)
+    if week.count:
+        lines.append(f"За {STATS_WEEK_DAYS} дней: {format_rollup(week)}")
+    return "\n".join(lines)
+
+
+async def shift_report(now=None):
+    # Итог только что закончившихся рабочих суток
+    now = int(time() if now is None else now)
+    start = day_start(now - 3600)
+    end = day_start(start + 30 * 3600)
+    total, by_zone, by_strength, _ = await load_rollups("day", start, start + 1)
+    if not total.count:
+        return None
+    lines = _sections(f"🌙 Итог смены {local(start):%d.%m}", total, by_zone, by_strength)
+    _, _, _, by_hour = await load_rollups("hour", start, end)
+    if by_hour:
+        peak, rollup = max(by_hour.items(), key=lambda item: item[1].count)
+        lines.append(f"Пиковый час: {local(peak):%H:00} — {format_rollup(rollup)}")
+    return "\n".join(lines)
+
+
+class ShiftSummary:
+    def __init__(self):
+        self._job = None
+        self.bot = None
+        self.chat_id = None
+        self.topic = None
+
+    def start(self, job_queue, bot, chat_id, topic):
+        # topic — функция: раскладка топиков перечитывается на лету
+        if self._job is not None or job_queue is None or not chat_id:
+            return
+        self.bot = bot
+        self.chat_id = chat_id
+        self.topic = topic
+        hour, minute = (int(part) for part in SHIFT_SUMMARY_TIME.split(":"))
+        tzinfo = TZ or datetime.now().astimezone().tzinfo
+        self._job = job_queue.run_daily(self._post, time=dtime(hour, minute, tzinfo=tzinfo), name="shift_summary")
+
+    def stop(self):
+        if self._job is None:
+            return
+        try:
+            self._job.schedule_removal()
+        except JobLookupError:
+            # Приложение останавливает JobQueue раньше post_stop, задача уже снята
+            pass
+        self._job = None
+
+    async def _post(self, context):
+        text = await shift_report()
+        if text is None:
+            return
+        topic_id = self.topic()
+        await dispatcher.submit(
+            self.chat_id,
+            lambda: self.bot.send_message(self.chat_id, text, message_thread_id=topic_id),
+            priority=PRIORITY_UI,
+        )
+
+
+shift_summary = ShiftSummary()
@@ -0,0 +1,123 @@
+import os
+import asyncio
+
+from telegram import Update
+
+import callbacks as cb
+from metrics import backlog_updates
+from updates import PerUserUpdateProcessor, serialization_key
+
+# 0 — после рестарта накопившиеся апдейты разбираются как обычно, по одному
+BACKLOG_DRAIN = os.getenv("BACKLOG_DRAIN", "1") == "1"
+# Больше getUpdates за раз не отдаёт
+BACKLOG_FETCH_LIMIT = 100
+BACKLOG_STOP_TIMEOUT = float(os.getenv("BACKLOG_STOP_TIMEOUT", "30"))
+
+# Нажатия, которые только перерисовывают меню: следующее нажатие на том же сообщении их перекрывает
+RENDER_ONLY = frozenset({cb.EDIT, cb.QUICK_MENU, cb.NOOP, cb.BOWL_MANUAL})
+# Выбор значения поля: из нескольких подряд на одном сообщении действует последний
+FIELD_CHOICES = frozenset({cb.STRENGTH, cb.DRAFT, cb.BOWL, cb.AROMA})
+# Остальное (отправка заказа, корзина, шаблоны, "кальян отдан") меняет состояние и не схлопывается никогда
+
+
+async def fetch_backlog(bot):
+    # Всё, что Telegram накопил, пока бот лежал; offset последнего запроса подтверждает полученное
+    updates = []
+    offset = None
+    while True:
+        batch = await bot.get_updates(offset=offset, limit=BACKLOG_FETCH_LIMIT, timeout=0,
+                                      allowed_updates=Update.ALL_TYPES)
+        if not batch:
+            return updates
+        updates.extend(batch)
+        offset = batch[-1].update_id + 1
+
+
+def _sender(update):
+    user = update.effective_user
+    chat = update.effective_chat
+    return (user.id if user else None, chat.id if chat else None)
+
+
+def coalesce(updates):
+    # Идём с конца по апдейтам каждого пользователя в каждом чате: нажатие выкидываем, только если
+    # позже на том же сообщении есть нажатие, которое его перекрывает, и между ними нет ничего,
+    # что опирается на его результат (текст, команда, отправка заказа)
+    keep = [True] * len(updates)
+    later = {}
+    inline_seen = set()
+    for i in range(len(updates) - 1, -1, -1):
+        update = updates[i]
+        if update.inline_query is not None:
+            # Набор в inline-режиме: ответ нужен только на последний запрос
+            user_id = update.inline_query.from_user.id
+            keep[i] = user_id not in inline_seen
+            inline_seen.add(user_id)
+            continue
+        sender = _sender(update)
+        rendered, fields = later.setdefault(sender, (set(), set()))
+        query = update.callback_query
+        action = cb.action_of(query.data) if query is not None else None
+        if action is None or query.message is None:
+            # Текст и команды читают состояние, оставленное нажатиями до них
+            rendered.clear()
+            fields.clear()
+            continue
+        message_id = query.message.message_id
+        if action in RENDER_ONLY:
+            keep[i] = message_id not in rendered
+        elif action in FIELD_CHOICES:
+            keep[i] = (message_id, action) not in fields
+            fields.add((message_id, action))
+        else:
+            fields.clear()
+        rendered.add(message_id)
+    return [update for update, kept in zip(updates, keep) if kept]
+
+
+class BacklogDrain:
+    # Запускается до старта приёма апдейтов. Сокращённый список каждого пользователя разбирается
+    # отдельной задачей по порядку, разные пользователи — параллельно; новые пользователи
+    # не ждут, пока разберут чужие старые нажатия
+    def __init__(self):
+        self.fetched = 0
+        self.coalesced = 0
+        self._tasks = set()
+
+    @property
+    def pending(self):
+        return len(self._tasks)
+
+    async def start(self, application):
+        updates = await fetch_backlog(application.bot)
+        kept = coalesce(updates)
+        self.fetched += len(updates)
+        self.coalesced += len(updates) - len(kept)
+        backlog_updates.inc("queued", amount=len(kept))
+        backlog_updates.inc("coalesced", amount=len(updates) - len(kept))
+        processor = application.update_processor
+        if not isinstance(processor, PerUserUpdateProcessor):
+            # Последовательная обработка: просто встают в очередь первыми
+            for update in kept:
+                await application.update_queue.put(update)
+            return
+        sequences = {}
+        for update in kept:
+            key = serialization_key(update)
+            sequences.setdefault(key if key is not None else ("update", update.update_id), []).append(update)
+        for key, sequence in sequences.items():
+            task = asyncio.create_task(processor.process_sequence(key, sequence, application.process_update))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def stop(self, timeout=BACKLOG_STOP_TIMEOUT):
+        # Получение апдейтов уже подтверждено Telegram: неразобранное при остановке пропадёт, поэтому ждём
+        if not self._tasks:
+            return
+        _, pending = await asyncio.wait(list(self._tasks), timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+backlog_drain = BacklogDrain()
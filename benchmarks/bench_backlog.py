@@ -0,0 +1,190 @@
+# Запуск: python -m benchmarks.bench_backlog [--staff 60] [--taps 50] [--drain 1] [--latency 30]
+# Рестарт после простоя: пока бота не было, сотрудники жали кнопки (передумывали с крепостью, листали
+# шаблоны, жали "Отправить" по два раза). Стенд кладёт эти нажатия в подделку Bot API до старта бота и
+# меряет, когда бот снова отвечает новому пользователю, сколько занимает весь разбор и сколько вызовов API.
+import os
+import sys
+import random
+import sqlite3
+import hashlib
+import asyncio
+import argparse
+import tempfile
+from time import perf_counter, time
+
+from benchmarks.fake_bot_api import FakeBotApi
+
+TOKEN = "123:bench"
+API_PORT = 18092
+GROUP_CHAT_ID = -100500
+PROBE_USER = 999999
+TABLES = ["3", "12", "20", "33", "101", "777", "VIP"]
+AROMAS = ["Мята", "Арбуз", "Двойное яблоко", "Черника с лаймом", "Манго"]
+
+
+class Backlog:
+    def __init__(self, api, rng):
+        self.api = api
+        self.rng = rng
+        self.updates = []
+        self.sends = 0
+        self.orders = 0
+
+    def _user(self, user_id):
+        return {"id": user_id, "is_bot": False, "first_name": f"staff{user_id}", "username": f"staff{user_id}"}
+
+    def message(self, user_id, text):
+        message = {
+            "message_id": self.api.new_message_id(user_id),
+            "date": int(time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id),
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        self.updates.append({"update_id": self.api.next_update_id(), "message": message})
+
+    def tap(self, user_id, menu_id, data):
+        update_id = self.api.next_update_id()
+        self.updates.append({"update_id": update_id, "callback_query": {
+            "id": str(update_id), "from": self._user(user_id), "chat_instance": str(user_id),
+            "data": data, "message": self.api.message(user_id, menu_id),
+        }})
+
+    def staff(self, user_id, taps, keyboards):
+        from callbacks import encode
+        import callbacks as cb
+
+        # Меню, открытое ещё до падения бота
+        menu_id = self.api._sendMessage({"chat_id": user_id, "text": "Главное меню:"})["message_id"]
+        rng = self.rng
+        start = len(self.updates)
+        while len(self.updates) - start < taps:
+            self.tap(user_id, menu_id, encode(cb.MAIN_ORDER))
+            self.tap(user_id, menu_id, encode(cb.EDIT, "table"))
+            self.message(user_id, rng.choice(TABLES))
+            self.tap(user_id, menu_id, encode(cb.AROMA, rng.choice(AROMAS)))
+            for field, action in (("strength", cb.STRENGTH), ("bowl", cb.BOWL), ("draft", cb.DRAFT)):
+                # Передумал: открыл поле, выбрал, открыл снова, выбрал другое
+                for _ in range(rng.randint(1, 3)):
+                    self.tap(user_id, menu_id, encode(cb.EDIT, field))
+                    self.tap(user_id, menu_id, encode(action, rng.choice(keyboards[field])))
+            if rng.random() < 0.3:
+                for page in range(rng.randint(1, 3)):
+                    self.tap(user_id, menu_id, encode(cb.QUICK_MENU, page))
+                self.tap(user_id, menu_id, encode(cb.MAIN_ORDER))
+                continue
+            # Нет ответа — жмёт "Отправить" ещё раз; заказ при этом один
+            self.orders += 1
+            for _ in range(rng.choice([1, 1, 2])):
+                self.tap(user_id, menu_id, encode(cb.SEND_ORDER))
+                self.sends += 1
+
+
+def orders_count():
+    with sqlite3.connect("templates.db") as conn:
+        return conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+
+
+def orders_digest():
+    # Состав заказов каждого сотрудника по порядку: со схлопыванием и без он должен совпадать
+    with sqlite3.connect("templates.db") as conn:
+        rows = conn.execute(
+            "SELECT user_id, table_number, aroma, strength, bowl, draft FROM orders ORDER BY user_id, id"
+        ).fetchall()
+    return hashlib.sha1(repr(rows).encode()).hexdigest()[:12]
+
+
+async def run(args):
+    import bot1
+    from telegram.ext import Application
+    from backlog import backlog_drain
+
+    api = FakeBotApi(latency=args.latency / 1000, jitter=args.jitter / 1000, seed=args.seed)
+    base_url = await api.start(port=API_PORT)
+    keyboards = {
+        "strength": [button.text for row in bot1.STRENGTH_KEYBOARD.inline_keyboard for button in row],
+        "bowl": [button.text for row in bot1.BOWL_CHOICES for button in row if button.text != "Ввести вручную"],
+        "draft": list(bot1.DRAFT_CHOICES),
+    }
+    backlog = Backlog(api, random.Random(args.seed))
+    for i in range(args.staff):
+        backlog.staff(1000 + i, args.taps, keyboards)
+    # Нажатия разных сотрудников приходили вперемешку, свои — по порядку
+    by_user = {}
+    for update in backlog.updates:
+        sender = (update.get("message") or update["callback_query"])["from"]["id"]
+        by_user.setdefault(sender, []).append(update)
+    rng = random.Random(args.seed)
+    mixed = []
+    while by_user:
+        user = rng.choice(list(by_user))
+        mixed.append(by_user[user].pop(0))
+        if not by_user[user]:
+            del by_user[user]
+    for update_id, update in enumerate(mixed, 1):
+        update["update_id"] = update_id
+        api.push(update)
+    api._update_id = len(mixed)
+    # Первый, кто пишет боту уже после подъёма
+    probe = Backlog(api, rng)
+    probe.message(PROBE_USER, "/start")
+    probe_renders = api.renders(PROBE_USER)
+
+    app = bot1.build_application(Application.builder().token(TOKEN).base_url(base_url))
+    started = perf_counter()
+    await app.initialize()
+    await app.post_init(app)
+    await app.updater.start_polling(poll_interval=0.0)
+    await app.start()
+    api.push(probe.updates[0])
+    _, _, answered = await asyncio.wait_for(probe_renders.get(), 600)
+    responsive = answered - started
+
+    while (orders_count() < backlog.orders or backlog_drain.pending or app.update_queue.qsize()
+           or app.update_processor.current_concurrent_updates):
+        await asyncio.sleep(0.05)
+    drained = perf_counter() - started
+
+    await app.updater.stop()
+    await app.stop()
+    await app.post_stop(app)
+    await app.shutdown()
+    await app.post_shutdown(app)
+    await api.stop()
+
+    print(f"накоплено апдейтов: {len(mixed)} от {args.staff} сотрудников, "
+          f"нажатий «Отправить»: {backlog.sends} на {backlog.orders} заказов, "
+          f"слив при старте: {'да' if os.environ['BACKLOG_DRAIN'] == '1' else 'нет'}")
+    print(f"схлопнуто: {backlog_drain.coalesced}, разобрано: {len(mixed) - backlog_drain.coalesced}, "
+          f"заказов создано: {orders_count()} из {backlog.orders} (состав {orders_digest()})")
+    print(f"новый пользователь получил ответ через {responsive:.2f}с, весь накопленный разбор — {drained:.2f}с")
+    print("вызовы API: " + ", ".join(f"{method}={count}" for method, count in sorted(api.calls.items())))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--staff", type=int, default=60)
+    parser.add_argument("--taps", type=int, default=50, help="нажатий на сотрудника за время простоя (примерно)")
+    parser.add_argument("--drain", type=int, default=1, help="1 — схлопывать накопленное при старте")
+    parser.add_argument("--latency", type=float, default=30, help="базовая задержка Bot API, мс")
+    parser.add_argument("--jitter", type=float, default=20, help="случайная добавка к задержке, мс")
+    parser.add_argument("--concurrency", type=int, help="UPDATE_CONCURRENCY для бота; 1 — последовательная обработка")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.getcwd())
+    os.environ.setdefault("BOT_TOKEN", TOKEN)
+    os.environ.setdefault("METRICS_PORT", "0")
+    os.environ["BACKLOG_DRAIN"] = str(args.drain)
+    if args.concurrency is not None:
+        os.environ["UPDATE_CONCURRENCY"] = str(args.concurrency)
+    os.environ["TARGET_CHAT_ID"] = str(GROUP_CHAT_ID)
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
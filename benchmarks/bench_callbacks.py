@@ -0,0 +1,89 @@
+# Запуск: python -m benchmarks.bench_callbacks
+# Сравнивает прежние строки callback_data с регулярками и новый кодек с таблицей действий:
+# размер данных, стоимость разбора и поиск обработчика для одного нажатия.
+import re
+from timeit import timeit
+
+import callbacks as cb
+
+# Порядок как в прежнем main(): обработчики верхнего уровня, затем точки входа и состояния диалога
+LEGACY_PATTERNS = [
+    "^main_order$", "^send_order$", "^to_menu$", "^order_done_", "^noop$", "^quick_order_(menu|page_\\d+)$",
+    r"^edit_", r"^bowl_.*|bowl_manual$", "^save_as_template$", "^quick_order_apply_", r"^strength_", r"^draft_",
+]
+
+PRESSES = [
+    ("edit_aroma", cb.encode(cb.EDIT, "aroma")),
+    ("strength_Безопасный Дарк", cb.encode(cb.STRENGTH, "Безопасный Дарк")),
+    ("draft_Wookah 🟤", cb.encode(cb.DRAFT, "Wookah 🟤")),
+    ("bowl_Грейпфрут 🍊", cb.encode(cb.BOWL, "Грейпфрут 🍊")),
+    ("send_order", cb.encode(cb.SEND_ORDER)),
+    ("order_done_123456", cb.encode(cb.ORDER_DONE, 123456)),
+    ("quick_order_page_12", cb.encode(cb.QUICK_MENU, 12)),
+    ("quick_order_apply_987", cb.encode(cb.QUICK_APPLY, 987)),
+]
+
+ACTIONS = [cb.MAIN_ORDER, cb.SEND_ORDER, cb.TO_MENU, cb.ORDER_DONE, cb.NOOP, cb.QUICK_MENU,
+           cb.EDIT, cb.BOWL, cb.SAVE_AS_TEMPLATE, cb.QUICK_APPLY, cb.STRENGTH, cb.DRAFT]
+
+
+def legacy_route(data, compiled):
+    # CallbackQueryHandler с pattern-строкой делает re.match по каждому обработчику, пока не совпадёт
+    for i, pattern in enumerate(compiled):
+        if pattern.match(data):
+            return i
+    return None
+
+
+def legacy_args(data):
+    if data.startswith("order_done_"):
+        return int(data.split("_")[2])
+    if data.startswith("quick_order_page_"):
+        return int(data.replace("quick_order_page_", ""))
+    if data.startswith("quick_order_apply_"):
+        return int(data.replace("quick_order_apply_", ""))
+    for prefix in ("edit_", "strength_", "draft_", "bowl_"):
+        if data.startswith(prefix):
+            return data.replace(prefix, "")
+    return None
+
+
+def new_route(data, predicates):
+    for i, check in enumerate(predicates):
+        if check(data):
+            return i
+    return None
+
+
+def main():
+    for legacy, new in PRESSES:
+        assert cb.decode(new) == cb.decode(legacy), (legacy, new)
+        print(f"{legacy!r:32} {len(legacy.encode()):>3} байт -> {new!r:24} {len(new.encode()):>3} байт")
+
+    compiled = [re.compile(p) for p in LEGACY_PATTERNS]
+    predicates = [cb.matches(action) for action in ACTIONS]
+    rounds = 200_000
+    per = rounds // len(PRESSES)
+
+    old = timeit(lambda: [(legacy_route(l, compiled), legacy_args(l)) for l, _ in PRESSES], number=per)
+    new = timeit(lambda: [(new_route(n, predicates), cb.decode(n)) for _, n in PRESSES], number=per)
+    print(f"поиск обработчика + разбор: regex {old / rounds * 1e9:.0f} нс, кодек {new / rounds * 1e9:.0f} нс")
+
+    # Верхний уровень теперь один обработчик со словарём действий
+    top = cb.matches(*ACTIONS[:6])
+    old = timeit(lambda: [legacy_route(l, compiled[:6]) for l, _ in PRESSES], number=per)
+    new = timeit(lambda: [top(n) for _, n in PRESSES], number=per)
+    print(f"проверка верхнего уровня: 6 regex {old / rounds * 1e9:.0f} нс, одна таблица {new / rounds * 1e9:.0f} нс")
+
+    encode = timeit(lambda: [cb.encode(cb.STRENGTH, "Безопасный Дарк"), cb.encode(cb.ORDER_DONE, 123456)],
+                    number=per)
+    print(f"кодирование: {encode / (2 * per) * 1e9:.0f} нс на кнопку")
+
+    long_value = "Очень длинное название вкуса, которое не помещается в 64 байта callback_data"
+    data = cb.encode(cb.EDIT, long_value)
+    assert cb.decode(data).args == (long_value,)
+    print(f"длинное значение уходит в хранилище: {data!r} ({len(data.encode())} байт)")
+
+
+if __name__ == "__main__":
+    main()
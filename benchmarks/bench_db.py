@@ -0,0 +1,49 @@
+# Запуск: python -m benchmarks.bench_db
+# Сравнивает открытие соединения на каждый вызов (как было) с пулом из db.py
+import os
+import asyncio
+import tempfile
+from time import perf_counter
+
+import aiosqlite
+
+from db import Database, SQL_SELECT_TEMPLATE, SQL_INSERT_TEMPLATE
+
+ROUNDS = 500
+CONCURRENCY = 20
+
+
+async def per_call_fetch(path, tpl_id):
+    async with aiosqlite.connect(path) as conn:
+        async with conn.execute(SQL_SELECT_TEMPLATE, (tpl_id,)) as cursor:
+            return await cursor.fetchone()
+
+
+async def run(label, fetch):
+    sem = asyncio.Semaphore(CONCURRENCY)
+
+    async def one(i):
+        async with sem:
+            return await fetch(i % 100 + 1)
+
+    started = perf_counter()
+    await asyncio.gather(*(one(i) for i in range(ROUNDS)))
+    elapsed = perf_counter() - started
+    print(f"{label:<10} {ROUNDS} запросов за {elapsed:.3f}с ({elapsed / ROUNDS * 1e6:.0f} мкс/запрос)")
+
+
+async def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        database = Database(path, readers=4)
+        await database.open()
+        for i in range(100):
+            await database.execute(SQL_INSERT_TEMPLATE, (f"Гость {i}", "Мята", "Средний", "Фанел", "Union 🔴"))
+
+        await run("per-call", lambda tpl_id: per_call_fetch(path, tpl_id))
+        await run("pooled", lambda tpl_id: database.fetchone(SQL_SELECT_TEMPLATE, (tpl_id,)))
+        await database.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
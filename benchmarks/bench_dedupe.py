@@ -0,0 +1,126 @@
+# Запуск: python -m benchmarks.bench_dedupe [--staff 1000] [--taps 3] [--send-ms 50]
+# Повторные нажатия "Отправить" на уровне SubmitDedupe: --staff сотрудников жмут по --taps раз, нажатия одного
+# сотрудника — по очереди, как их пускает PerUserUpdateProcessor. Проверяется, что заказ уходит один раз
+# на сотрудника, что упавшую отправку следующее нажатие повторяет, что окно и размер кэша соблюдаются;
+# меряется цена проверки на нажатие. Сквозной сценарий через бота — tests/test_dedupe.py.
+import os
+import sys
+import asyncio
+import argparse
+from time import perf_counter
+
+
+async def tap(dedupe, key, fingerprint, send):
+    # Как send_order_callback: сначала проверка повтора, потом отправка
+    first = dedupe.duplicate_of(key, fingerprint)
+    if first is not None:
+        return first
+    return await dedupe.submit(key, fingerprint, send)
+
+
+async def repeats(args):
+    from dedupe import SubmitDedupe
+
+    dedupe = SubmitDedupe(ttl=30, size=args.staff * 2)
+    sent = []
+
+    async def send(user_id):
+        await asyncio.sleep(args.send_ms / 1000)
+        sent.append(user_id)
+        return user_id
+
+    async def staff(user_id):
+        return [await tap(dedupe, (user_id, 1), hash(("12", user_id)), lambda: send(user_id))
+                for _ in range(args.taps)]
+
+    started = perf_counter()
+    results = await asyncio.gather(*(staff(user_id) for user_id in range(args.staff)))
+    elapsed = perf_counter() - started
+    assert sorted(sent) == list(range(args.staff)), "заказ ушёл не ровно один раз"
+    assert results == [[user_id] * args.taps for user_id in range(args.staff)]
+    print(f"{args.staff} сотрудников × {args.taps} нажатия: отправок {len(sent)}, "
+          f"всё за {elapsed * 1000:.0f}мс (одна отправка — {args.send_ms:g}мс)")
+
+
+async def failed_first():
+    from dedupe import SubmitDedupe
+
+    dedupe = SubmitDedupe(ttl=30)
+    calls = []
+
+    async def send():
+        calls.append(None)
+        if len(calls) == 1:
+            raise ConnectionError("база недоступна")
+        return 42
+
+    try:
+        await tap(dedupe, "k", 1, send)
+    except ConnectionError:
+        pass
+    # Ошибка не запоминается: следующее нажатие отправляет заново
+    assert await tap(dedupe, "k", 1, send) == 42 and len(calls) == 2
+    assert await tap(dedupe, "k", 1, send) == 42 and len(calls) == 2
+    print("упавшая отправка не запомнилась: следующее нажатие отправило заново, третье — уже повтор")
+
+
+async def window_and_size():
+    from dedupe import SubmitDedupe
+
+    async def send():
+        return True
+
+    dedupe = SubmitDedupe(ttl=0.05, size=100)
+    await dedupe.submit("k", 1, send)
+    assert dedupe.duplicate_of("k", 1) is not None and dedupe.duplicate_of("k", 2) is None
+    dedupe.extend("k", 2)
+    assert dedupe.duplicate_of("k", 2) is not None
+    await asyncio.sleep(0.06)
+    assert dedupe.duplicate_of("k", 1) is None, "окно не истекло"
+    dedupe.ttl = 30
+    for key in range(1000):
+        await dedupe.submit(key, 1, send)
+    assert len(dedupe) == 100 and dedupe.duplicate_of(999, 1) is not None
+    print(f"окно {0.05:g}с и размер кэша {dedupe.size} соблюдаются")
+
+
+async def overhead(args):
+    from dedupe import SubmitDedupe
+
+    async def send():
+        return True
+
+    dedupe = SubmitDedupe(ttl=30, size=10000)
+    started = perf_counter()
+    for key in range(args.checks):
+        await dedupe.submit(key, 1, send)
+    first = perf_counter() - started
+    started = perf_counter()
+    for key in range(args.checks):
+        dedupe.duplicate_of(key % 10000 + args.checks - 10000, 1)
+    repeat = perf_counter() - started
+    print(f"первое нажатие: {first / args.checks * 1e6:.2f}мкс, проверка повтора: {repeat / args.checks * 1e6:.2f}мкс "
+          f"(кэш {len(dedupe)} записей)")
+
+
+async def run(args):
+    await repeats(args)
+    await failed_first()
+    await window_and_size()
+    await overhead(args)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--staff", type=int, default=1000)
+    parser.add_argument("--taps", type=int, default=3, help="нажатий на сотрудника")
+    parser.add_argument("--send-ms", type=float, default=50, help="сколько идёт первая отправка")
+    parser.add_argument("--checks", type=int, default=100000)
+    args = parser.parse_args()
+    sys.path.insert(0, os.getcwd())
+    os.environ.setdefault("METRICS_PORT", "0")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+# Запуск: python -m benchmarks.bench_drafts [--users 10000] [--carts 0.3] [--idle 0.7]
+# Память под черновики заказов: 10k сотрудников с недособранным заказом, поднятых из базы.
+# Сравниваются прежний user_data с россыпью строковых ключей и OrderDraft со __slots__ и номерами
+# вместо строк крепости/тяги; затем чистильщик вычищает простоявших и меряется, сколько вернулось.
+import os
+import sys
+import pickle
+import random
+import asyncio
+import argparse
+import tempfile
+import tracemalloc
+from time import monotonic, perf_counter
+
+TOKEN = "123:bench"
+TABLES = ["3", "12", "20", "33", "101", "777", "VIP"]
+AROMAS = ["Мята", "Арбуз", "Двойное яблоко", "Черника с лаймом", "Манго", "Грейпфрут и базилик"]
+BOWLS = ["Фанел", "Фрукт", "Чаша 1", "Чаша 2"]
+
+
+def random_item(rng):
+    from drafts import STRENGTHS, DRAFT_CHOICES
+    return (
+        rng.choice(AROMAS) if rng.random() < 0.9 else None,
+        rng.choice(STRENGTHS),
+        rng.choice(BOWLS),
+        rng.choice(DRAFT_CHOICES) if rng.random() < 0.8 else None,
+    )
+
+
+def legacy_user_data(rng, args, msg_id):
+    # Как лежало раньше: после user_data.clear() остаются только заполненные ключи
+    data = {"order_msg_id": msg_id, "table": rng.choice(TABLES)}
+    for field, value in zip(("aroma", "strength", "bowl", "draft"), random_item(rng)):
+        if value is not None:
+            data[field] = value
+    if rng.random() < args.carts:
+        data["cart"] = [random_item(rng) for _ in range(rng.randint(1, 3))]
+    return data
+
+
+def measure(blobs):
+    # Сколько занимают черновики, поднятые из базы: у каждого пользователя строки свои, как после pickle
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    loaded = [pickle.loads(blob) for blob in blobs]
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return loaded, used
+
+
+def mb(size):
+    return f"{size / 2 ** 20:.2f} МБ"
+
+
+def populate(app, conv, state, sweeper, blobs, args, now):
+    from sweeper import conversation_states
+    # state — шаг диалога, на котором сотрудник отошёл посреди заказа
+    rng = random.Random(args.seed)
+    for uid, blob in enumerate(blobs, 1000):
+        app._user_data[uid] = pickle.loads(blob)
+        conversation_states(conv)[(uid, uid)] = state
+        # Доля idle ушла со смены больше часа назад, остальные работают
+        sweeper.touch(uid, now - (7200 if rng.random() < args.idle else 60))
+
+
+async def sweep(args, drafts):
+    import gc
+    import bot1
+    from telegram.ext import Application, ConversationHandler
+    from sweeper import IdleSweeper, conversation_states
+
+    await bot1.init_db()
+    app = bot1.build_application(Application.builder().token(TOKEN))
+    conv = next(handler for handler in app.handlers[0] if isinstance(handler, ConversationHandler))
+    sweeper = IdleSweeper(ttl=3600, interval=3600)
+    await sweeper.start(app)
+    blobs = [pickle.dumps(data) for data in drafts]
+
+    # Память: трассировка с момента загрузки, иначе освобождённое не учитывается
+    now = monotonic()
+    tracemalloc.start()
+    populate(app, conv, bot1.STRENGTH, sweeper, blobs, args, now)
+    gc.collect()
+    before = tracemalloc.get_traced_memory()[0]
+    evicted = await sweeper.sweep(now)
+    await app.persistence.flush()
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    kept = len(app.user_data), len(conversation_states(conv))
+
+    # Время: отдельный проход без трассировки, она замедляет выделения в разы
+    app._user_data.clear()
+    conversation_states(conv).clear()
+    now = monotonic()
+    populate(app, conv, bot1.STRENGTH, sweeper, blobs, args, now)
+    started = perf_counter()
+    await sweeper.sweep(now)
+    elapsed = perf_counter() - started
+    await app.persistence.flush()
+
+    await sweeper.stop()
+    await bot1.close_db()
+    print(f"чистильщик: вычищено {evicted} из {len(blobs)} за {elapsed * 1000:.1f}мс, "
+          f"осталось черновиков {kept[0]}, диалогов {kept[1]}; память {mb(before)} → {mb(after)}")
+
+
+def run(args):
+    from drafts import OrderDraft
+
+    rng = random.Random(args.seed)
+    legacy = [legacy_user_data(rng, args, 100 + i) for i in range(args.users)]
+    legacy_blobs = [pickle.dumps(data) for data in legacy]
+    # Те же черновики после переноса в OrderDraft
+    current = [{"order": OrderDraft.from_legacy(dict(data))} for data in legacy]
+    current_blobs = [pickle.dumps(data) for data in current]
+
+    _, legacy_used = measure(legacy_blobs)
+    loaded, current_used = measure(current_blobs)
+    assert [data["order"].items() for data in loaded] == [data["order"].items() for data in current]
+
+    print(f"{args.users} сотрудников, корзина у {args.carts:.0%}")
+    print(f"россыпь ключей: {mb(legacy_used)} в памяти ({legacy_used / args.users:.0f} Б на сотрудника), "
+          f"{mb(sum(map(len, legacy_blobs)))} в базе")
+    print(f"OrderDraft:     {mb(current_used)} в памяти ({current_used / args.users:.0f} Б на сотрудника), "
+          f"{mb(sum(map(len, current_blobs)))} в базе")
+    asyncio.run(sweep(args, current))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--carts", type=float, default=0.3, help="доля сотрудников с отложенными кальянами")
+    parser.add_argument("--idle", type=float, default=0.7, help="доля сотрудников, простоявших дольше IDLE_TTL")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.getcwd())
+    os.environ.setdefault("BOT_TOKEN", TOKEN)
+    os.environ.setdefault("METRICS_PORT", "0")
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+# Запуск: python -m benchmarks.bench_eventlog [--events 100000] [--burst 20] [--orders 100000] [--per-order 10]
+# Журнал событий: сколько стоит event() в потоке бота с очередью и фоновым писателем против штатных
+# sink'ов loguru (файл с serialize=True — синхронно и с enqueue=True), затем хронология заказа
+# по индексу смещений против полного прохода по журналу в --orders × --per-order строк.
+import os
+import sys
+import json
+import random
+import argparse
+import tempfile
+from time import perf_counter, sleep
+
+
+def per_event(label, add_sink, remove_sink, args):
+    from eventlog import event, bind_trace
+
+    add_sink()
+    bind_trace("0123456789abcdef")
+    spent = 0.0
+    started = perf_counter()
+    # Бот пишет события пачками на нажатие и ждёт сеть между ними: в паузах фоновый поток успевает записать
+    for burst in range(args.events // args.burst):
+        emit = perf_counter()
+        for i in range(args.burst):
+            event("order.field", field="aroma", value="Мята", order_id=burst * args.burst + i)
+        spent += perf_counter() - emit
+        sleep(args.pause / 1000)
+    # Пока не записано, событие не считается: останов дожидается хвоста очереди
+    remove_sink()
+    total = perf_counter() - started
+    print(f"  {label:18} {spent / args.events * 1e6:6.2f}мкс в потоке бота, до записи всех — {total:.2f}с")
+
+
+def compare_sinks(args, workdir):
+    from loguru import logger
+    from eventlog import EventLog
+
+    print(f"{args.events} событий пачками по {args.burst}, между пачками {args.pause:g}мс:")
+    handler = {}
+    event_log = EventLog(os.path.join(workdir, "queue.jsonl"))
+    per_event("очередь + поток", event_log.start, event_log.stop, args)
+    for label, enqueue in (("loguru serialize", False), ("loguru enqueue", True)):
+        path = os.path.join(workdir, f"loguru-{enqueue}.jsonl")
+        per_event(
+            label,
+            lambda: handler.update(id=logger.add(path, level="DEBUG", serialize=True, enqueue=enqueue)),
+            lambda: logger.remove(handler["id"]),
+            args,
+        )
+
+
+def fill(args, path):
+    from eventlog import EventLog, event, bind_trace
+
+    # Смена: заказы идут вперемешку, у каждого --per-order событий под своим trace
+    rng = random.Random(args.seed)
+    pending = {}
+    traces = []
+    event_log = EventLog(path)
+    event_log.start()
+    for order_id in range(1, args.orders + 1):
+        trace = f"{order_id:016x}"
+        traces.append(trace)
+        pending[order_id] = [trace, 0]
+        while len(pending) > 50 or (order_id == args.orders and pending):
+            done = rng.choice(list(pending))
+            trace, step = pending[done]
+            bind_trace(trace)
+            if step + 1 == args.per_order:
+                event("order.done", order_id=done, wait=rng.randint(300, 1500))
+                del pending[done]
+            else:
+                event("order.field", field="aroma", value="Мята")
+                pending[done][1] += 1
+    sink = event_log.sink
+    event_log.stop()
+    return traces, sink.dropped
+
+
+def scan(path, key):
+    # Без индекса: каждая строка разбирается ради поля trace
+    records = []
+    with open(path, "rb") as f:
+        for line in f:
+            record = json.loads(line)
+            if record.get("trace") == key:
+                records.append(record)
+    return records
+
+
+def compare_lookup(args, workdir):
+    from eventlog import timeline, index_path
+
+    path = os.path.join(workdir, "events.jsonl")
+    started = perf_counter()
+    traces, dropped = fill(args, path)
+    written = perf_counter() - started
+    print(f"журнал: {args.orders * args.per_order} строк, {os.path.getsize(path) / 2 ** 20:.1f} МБ "
+          f"(+{os.path.getsize(index_path(path)) / 2 ** 20:.1f} МБ индекс), записан за {written:.1f}с, "
+          f"отброшено {dropped}")
+    rng = random.Random(args.seed)
+    keys = [rng.choice(traces) for _ in range(args.lookups)]
+    order_id = str(rng.randint(1, args.orders))
+
+    started = perf_counter()
+    found = [timeline(path, key) for key in keys]
+    indexed = (perf_counter() - started) / args.lookups
+    started = perf_counter()
+    by_order = timeline(path, order_id)
+    by_number = perf_counter() - started
+    started = perf_counter()
+    scanned = scan(path, keys[0])
+    full = perf_counter() - started
+    assert [record["ts"] for record in found[0]] == [record["ts"] for record in scanned]
+    assert all(len(records) == args.per_order for records in found)
+    print(f"  по индексу:  {indexed * 1000:7.1f}мс на заказ ({args.per_order} записей); "
+          f"по номеру #{order_id}: {by_number * 1000:.1f}мс, записей {len(by_order)}")
+    print(f"  полный проход: {full * 1000:7.1f}мс на заказ")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=100000)
+    parser.add_argument("--burst", type=int, default=20, help="событий на одно нажатие")
+    parser.add_argument("--pause", type=float, default=1, help="мс между нажатиями")
+    parser.add_argument("--orders", type=int, default=100000)
+    parser.add_argument("--per-order", type=int, default=10)
+    parser.add_argument("--lookups", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.getcwd())
+    # Ротация в этом замере не участвует: весь журнал — один файл
+    os.environ.setdefault("EVENT_LOG_MAX_BYTES", str(2 ** 40))
+    with tempfile.TemporaryDirectory() as workdir:
+        compare_sinks(args, workdir)
+        compare_lookup(args, workdir)
+
+
+if __name__ == "__main__":
+    main()
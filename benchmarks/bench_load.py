@@ -0,0 +1,363 @@
+# Запуск: python -m benchmarks.bench_load [--staff 20] [--rounds 10] [--latency 30] [--retry-rate 0.02]
+#         [--mode webhook] [--concurrency 1] [--suggest 0.8] [--carts 0] [--double-tap 0]
+# Нагрузочный стенд: настоящий bot1 против локальной подделки Bot API. Виртуальные сотрудники
+# параллельно проходят сценарии ручного заказа, корзины, быстрого заказа и сохранения шаблона;
+# на выходе — пропускная способность и p50/p95/p99 задержки от нажатия до правки сообщения.
+import os
+import sys
+import json
+import sqlite3
+import random
+import asyncio
+import argparse
+import tempfile
+from time import perf_counter, time
+
+import aiohttp
+
+from benchmarks.fake_bot_api import FakeBotApi
+
+TOKEN = "123:bench"
+API_PORT = 18090
+WEBHOOK_PORT = 18091
+WEBHOOK_SECRET = "bench-secret"
+GROUP_CHAT_ID = -100500
+# Сколько ждать реакции бота, прежде чем засчитать таймаут
+RENDER_TIMEOUT = 15
+
+TABLES = ["3", "12", "20", "33", "101", "777", "VIP"]
+# Кнопка "оставить как набрано" на уточнении ароматики
+KEEP_TYPED = "✏️ Оставить"
+AROMAS = ["Мята", "Арбуз", "Двойное яблоко", "Черника с лаймом", "Манго", "Грейпфрут и базилик"]
+
+
+def percentile(samples, q):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Staff:
+    def __init__(self, index, api, deliver, rng, think, choices, suggest, carts, double_tap):
+        self.user = {"id": 1000 + index, "is_bot": False, "first_name": f"staff{index}", "username": f"staff{index}"}
+        self.chat_id = self.user["id"]
+        self.api = api
+        self.deliver = deliver
+        self.rng = rng
+        self.think = think
+        self.choices = choices
+        self.suggest = suggest
+        self.carts = carts
+        self.double_tap = double_tap
+        self.message_id = None
+        self.latencies = []
+        self.timeouts = 0
+        self.orders = 0
+        self.hookahs = 0
+        self.templates = 0
+        self.repeats = 0
+
+    # --- апдейты от имени сотрудника ---
+
+    def _message_update(self, text):
+        message = {
+            "message_id": self.api.new_message_id(self.chat_id),
+            "date": int(time()),
+            "chat": {"id": self.chat_id, "type": "private"},
+            "from": self.user,
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": self.api.next_update_id(), "message": message}
+
+    def _callback_update(self, data):
+        update_id = self.api.next_update_id()
+        return {
+            "update_id": update_id,
+            "callback_query": {
+                "id": str(update_id),
+                "from": self.user,
+                "chat_instance": str(self.chat_id),
+                "data": data,
+                "message": self.api.message(self.chat_id, self.message_id),
+            },
+        }
+
+    def buttons(self):
+        return self.api.buttons(self.chat_id, self.message_id)
+
+    def find(self, label):
+        buttons = self.buttons()
+        for button in buttons:
+            if button["text"] == label:
+                return button["callback_data"]
+        for button in buttons:
+            if button["text"].startswith(label):
+                return button["callback_data"]
+        raise LookupError(label)
+
+    async def _act(self, update, until=None, repeats=()):
+        # Задержка — до первой отправки/правки в чате сотрудника; until — дождаться ещё и нужного метода
+        renders = self.api.renders(self.chat_id)
+        while not renders.empty():
+            renders.get_nowait()
+        started = perf_counter()
+        await self.deliver(update)
+        # Повторные нажатия той же кнопки приходят следом, пока бот ещё не ответил на первое
+        for repeat in repeats:
+            await self.deliver(repeat)
+        try:
+            method, message_id, at = await asyncio.wait_for(self._next_render(renders), RENDER_TIMEOUT)
+            self.latencies.append(at - started)
+            while until and method != until:
+                method, message_id, at = await asyncio.wait_for(self._next_render(renders), RENDER_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+        if method == "sendMessage":
+            self.message_id = message_id
+        if self.think:
+            await asyncio.sleep(self.rng.uniform(0, self.think))
+
+    async def _next_render(self, renders):
+        # Правка прежнего меню может прийти позже отправки нового (бот шлёт их параллельно) — не в счёт
+        while True:
+            method, message_id, at = await renders.get()
+            if method == "sendMessage" or message_id == self.message_id:
+                return method, message_id, at
+
+    async def tap(self, label, until=None):
+        await self._act(self._callback_update(self.find(label)), until)
+
+    async def say(self, text, until=None):
+        await self._act(self._message_update(text), until)
+
+    # --- сценарии ---
+
+    async def open_menu(self, attempts=3):
+        # /start мог утонуть в 429 — пробуем ещё, прежде чем сдаться
+        for attempt in range(attempts):
+            try:
+                await self.say("/start", until="sendMessage")
+                return
+            except asyncio.TimeoutError:
+                if attempt == attempts - 1:
+                    raise
+
+    async def fill_item(self):
+        await self.tap("Ароматика:")
+        await self.pick_aroma()
+        await self.tap("Крепость:")
+        await self.tap(self.rng.choice(self.choices["strength"]))
+        await self.tap("Чаша:")
+        await self.tap(self.rng.choice(self.choices["bowl"]))
+        await self.tap("Тяга:")
+        await self.tap(self.rng.choice(self.choices["draft"]))
+
+    async def manual_order(self, size=1):
+        # size > 1 — корзина: несколько кальянов на один стол одной отправкой
+        await self.tap("📝 Сделать заказ")
+        await self.tap("Стол:")
+        await self.say(self.rng.choice(TABLES))
+        for i in range(size):
+            if i:
+                await self.tap("➕")
+            await self.fill_item()
+        await self.send()
+        self.orders += 1
+        self.hookahs += size
+
+    async def send(self):
+        data = self.find("✅ Отправить заказ")
+        repeats = self.rng.randint(1, 2) if self.rng.random() < self.double_tap else 0
+        self.repeats += repeats
+        await self._act(self._callback_update(data), repeats=[self._callback_update(data) for _ in range(repeats)])
+
+    async def table_order(self):
+        # Стол из нескольких гостей: корзиной или, как раньше, отдельными заказами
+        size = self.rng.randint(2, 4)
+        if self.rng.random() < self.carts:
+            await self.manual_order(size)
+        else:
+            for _ in range(size):
+                await self.manual_order()
+
+    async def pick_aroma(self):
+        # Подсказка — одно нажатие; иначе набор текста, а на уточнение оставляем набранное
+        suggestions = [b for b in self.buttons() if not b["text"].startswith(KEEP_TYPED)]
+        if suggestions and self.rng.random() < self.suggest:
+            await self._act(self._callback_update(self.rng.choice(suggestions)["callback_data"]))
+            return
+        await self.say(self.rng.choice(AROMAS))
+        if any(b["text"].startswith(KEEP_TYPED) for b in self.buttons()):
+            await self.tap(KEEP_TYPED)
+
+    async def template_save(self):
+        await self.manual_order()
+        await self.tap("💾 Сохранить как шаблон")
+        self.templates += 1
+        await self.say(f"Гость {self.chat_id}-{self.templates}", until="sendMessage")
+
+    async def quick_order(self):
+        await self.tap("⚡ Быстрый заказ")
+        templates = [b for b in self.buttons() if b["text"] not in ("◀️", "▶️", "🔙 В меню")]
+        if not templates:
+            await self.tap("🔙 В меню")
+            return
+        await self._act(self._callback_update(self.rng.choice(templates)["callback_data"]))
+        await self.say(self.rng.choice(TABLES), until="sendMessage")
+        self.orders += 1
+        self.hookahs += 1
+
+    async def run(self, rounds):
+        scenarios = [self.manual_order, self.quick_order, self.template_save, self.table_order]
+        await self.open_menu()
+        for _ in range(rounds):
+            scenario = self.rng.choices(scenarios, weights=[5, 4, 1, 2])[0]
+            try:
+                await scenario()
+            except (asyncio.TimeoutError, LookupError):
+                # Сбились со сценария — начинаем с чистого меню
+                await self.open_menu()
+
+
+def topic_posts():
+    # Сколько сообщений заказы поставили в очередь на группу; группа пропускает ~20 в минуту,
+    # поэтому за короткий прогон доставляется лишь часть
+    with sqlite3.connect("templates.db") as conn:
+        payloads = [json.loads(payload) for payload, in conn.execute("SELECT payload FROM outbox")]
+    return sum(len(p["sends"] if isinstance(p, dict) else p) for p in payloads)
+
+
+def stored_hookahs():
+    with sqlite3.connect("templates.db") as conn:
+        return conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+
+
+async def wait_healthy(session, url):
+    for _ in range(100):
+        try:
+            async with session.get(url) as resp:
+                if (await resp.json())["status"] == "ok":
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.05)
+
+
+async def run(args):
+    import bot1
+    from telegram.ext import Application
+    from webhook import serve_webhook, SECRET_HEADER
+
+    api = FakeBotApi(latency=args.latency / 1000, jitter=args.jitter / 1000, retry_rate=args.retry_rate, seed=args.seed)
+    base_url = await api.start(port=API_PORT)
+    app = bot1.build_application(Application.builder().token(TOKEN).base_url(base_url))
+
+    session = aiohttp.ClientSession()
+    if args.mode == "webhook":
+        stop = asyncio.Event()
+        server = asyncio.create_task(
+            serve_webhook(app, stop, listen="127.0.0.1", port=WEBHOOK_PORT, url="", secret=WEBHOOK_SECRET)
+        )
+        await wait_healthy(session, f"http://127.0.0.1:{WEBHOOK_PORT}/healthz")
+
+        async def deliver(update):
+            async with session.post(f"http://127.0.0.1:{WEBHOOK_PORT}/telegram", json=update,
+                                    headers={SECRET_HEADER: WEBHOOK_SECRET}):
+                pass
+    else:
+        await app.initialize()
+        await app.post_init(app)
+        await app.updater.start_polling(poll_interval=0.0)
+        await app.start()
+
+        async def deliver(update):
+            api.push(update)
+
+    # Варианты берём из клавиатур самого бота, чтобы сценарии не разъезжались с меню
+    choices = {
+        "strength": [button.text for row in bot1.STRENGTH_KEYBOARD.inline_keyboard for button in row],
+        "bowl": [button.text for row in bot1.BOWL_CHOICES for button in row if button.text != "Ввести вручную"],
+        "draft": list(bot1.DRAFT_CHOICES),
+    }
+    rng = random.Random(args.seed)
+    staff = [
+        Staff(
+            i, api, deliver, random.Random(rng.random()), args.think / 1000, choices, args.suggest, args.carts,
+            args.double_tap,
+        )
+        for i in range(args.staff)
+    ]
+    started = perf_counter()
+    await asyncio.gather(*(member.run(args.rounds) for member in staff))
+    elapsed = perf_counter() - started
+
+    if args.mode == "webhook":
+        stop.set()
+        await server
+    else:
+        await app.updater.stop()
+        await app.stop()
+        await app.post_stop(app)
+        await app.shutdown()
+        await app.post_shutdown(app)
+    await session.close()
+    await api.stop()
+
+    latencies = [sample for member in staff for sample in member.latencies]
+    orders = sum(member.orders for member in staff)
+    hookahs = sum(member.hookahs for member in staff)
+    posts = topic_posts()
+    print(f"{args.staff} сотрудников × {args.rounds} сценариев, {args.mode}, "
+          f"параллельность {os.environ.get('UPDATE_CONCURRENCY', 'по умолчанию')}, "
+          f"API {args.latency:.0f}±{args.jitter:.0f} мс, 429: {args.retry_rate:.0%}")
+    print(f"нажатий: {len(latencies)} за {elapsed:.1f}с — {len(latencies) / elapsed:.1f}/с, "
+          f"заказов: {orders} ({orders / elapsed:.2f}/с), кальянов: {hookahs}")
+    print(f"сообщений в топики: {posts} ({posts / max(hookahs, 1):.2f} на кальян), "
+          f"доставлено за прогон: {sum(1 for chat_id, _ in api.messages if chat_id == GROUP_CHAT_ID)}")
+    print("нажатие → правка: " + " ".join(
+        f"{name}={percentile(latencies, q) * 1000:.1f}мс" for name, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))
+    ) + f" max={max(latencies, default=0) * 1000:.1f}мс")
+    print(f"таймаутов: {sum(member.timeouts for member in staff)}")
+    if args.double_tap:
+        print(f"повторных нажатий «Отправить»: {sum(member.repeats for member in staff)}, "
+              f"кальянов в базе: {stored_hookahs()} из {hookahs}")
+    print("вызовы API: " + ", ".join(f"{method}={count}" for method, count in sorted(api.calls.items())))
+    if api.retries:
+        print("отвечено 429: " + ", ".join(f"{method}={count}" for method, count in sorted(api.retries.items())))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--staff", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=30, help="базовая задержка Bot API, мс")
+    parser.add_argument("--jitter", type=float, default=20, help="случайная добавка к задержке, мс")
+    parser.add_argument("--retry-rate", type=float, default=0.0, help="доля записей, на которые API отвечает 429")
+    parser.add_argument("--think", type=float, default=0, help="пауза сотрудника между нажатиями, мс")
+    parser.add_argument("--mode", choices=["polling", "webhook"], default="polling")
+    parser.add_argument("--concurrency", type=int, help="UPDATE_CONCURRENCY для бота; 1 — последовательная обработка")
+    parser.add_argument("--suggest", type=float, default=0.8, help="доля ароматик, выбранных из подсказок")
+    parser.add_argument("--carts", type=float, default=0.0, help="доля столов, заказанных корзиной")
+    parser.add_argument("--double-tap", type=float, default=0.0,
+                        help="доля отправок, где «Отправить» нажато ещё 1–2 раза подряд")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    # bot1 и его модули читают окружение при импорте, а базу и файлы ищут в текущем каталоге
+    sys.path.insert(0, os.getcwd())
+    os.environ.setdefault("BOT_TOKEN", TOKEN)
+    os.environ.setdefault("METRICS_PORT", "0")
+    if args.concurrency is not None:
+        os.environ["UPDATE_CONCURRENCY"] = str(args.concurrency)
+    os.environ["TARGET_CHAT_ID"] = str(GROUP_CHAT_ID)
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
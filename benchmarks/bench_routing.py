@@ -0,0 +1,30 @@
+# Запуск: python -m benchmarks.bench_routing
+# Сравнивает стоимость поиска зоны: прежняя цепочка if-ов против скомпилированной раскладки,
+# затем таблица на большой раскладке. Совпадение маршрутизации проверяет tests/test_routing.py.
+import random
+from timeit import timeit
+
+from routing import DEFAULT_LAYOUT, ZoneTable
+from tests.routing_layouts import big_layout, legacy_get_zone_and_topic_id
+
+
+def main():
+    table = ZoneTable(DEFAULT_LAYOUT)
+
+    samples = ["5", "20", "40", "101", "777", "VIP", " 33 "]
+    rounds = 200_000
+    legacy = timeit(lambda: [legacy_get_zone_and_topic_id(s) for s in samples], number=rounds // len(samples))
+    compiled = timeit(lambda: [table.lookup(s) for s in samples], number=rounds // len(samples))
+    print(f"текущая раскладка: if-цепочка {legacy / rounds * 1e9:.0f} нс, таблица {compiled / rounds * 1e9:.0f} нс")
+
+    for zones in (10, 1000, 100_000):
+        big = ZoneTable(big_layout(zones))
+        rng = random.Random(1)
+        probes = [str(rng.randint(1, zones * 100)) for _ in range(1000)]
+        probes += [f"T{rng.randrange(zones)}-1" for _ in range(1000)]
+        elapsed = timeit(lambda: [big.lookup(p) for p in probes], number=20)
+        print(f"{zones:>7} зон: {elapsed / (20 * len(probes)) * 1e9:.0f} нс на поиск")
+
+
+if __name__ == "__main__":
+    main()
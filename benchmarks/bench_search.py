@@ -0,0 +1,73 @@
+# Запуск: python -m benchmarks.bench_search [шаблонов]
+# Задержка inline-поиска шаблонов по FTS5 на большой базе: запросы, как они приходят при наборе —
+# префикс за префиксом ("и", "ив", "ива", ...), в том числе из двух слов.
+import os
+import sys
+import random
+import asyncio
+import tempfile
+from time import perf_counter
+
+TEMPLATES = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+QUERIES = 300
+
+NAMES = ["Иван", "Пётр", "Алексей", "Мария", "Анна", "Дмитрий", "Ольга", "Сергей", "Екатерина", "Артём",
+         "Наталья", "Михаил", "Юлия", "Андрей", "Светлана", "Николай", "Татьяна", "Владимир", "Елена", "Павел"]
+SURNAMES = ["Иванов", "Петров", "Сидоров", "Смирнов", "Кузнецов", "Попов", "Соколов", "Лебедев", "Козлов",
+            "Новиков", "Морозов", "Волков", "Алексеев", "Фёдоров", "Михайлов", "Орлов", "Зайцев", "Белов"]
+AROMAS = ["Мята", "Арбуз", "Двойное яблоко", "Черника с лаймом", "Манго", "Грейпфрут и базилик", "Дыня",
+          "Киви", "Малина", "Персик", "Ёлка", "Кола", "Лимонный пирог", "Маракуйя", "Груша", "Вишня"]
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def typing(rng):
+    # Все промежуточные состояния строки, пока сотрудник набирает имя (и иногда ароматику)
+    text = rng.choice(NAMES + SURNAMES)
+    if rng.random() < 0.3:
+        text += " " + rng.choice(AROMAS).split()[0]
+    return [text[:i] for i in range(1, len(text) + 1) if not text[:i].endswith(" ")]
+
+
+async def main():
+    rng = random.Random(1)
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        from db import (
+            db, init_db, close_db, search_templates, template_cache, SQL_INSERT_TEMPLATE, SQL_SELECT_TEMPLATES
+        )
+
+        await init_db()
+        rows = [
+            (f"{rng.choice(NAMES)} {rng.choice(SURNAMES)} {i}", rng.choice(AROMAS), "Средний", "Фанел", "Union 🔴")
+            for i in range(TEMPLATES)
+        ]
+        started = perf_counter()
+        async with db.writer() as conn:
+            await conn.executemany(SQL_INSERT_TEMPLATE, rows)
+        print(f"{TEMPLATES} шаблонов вставлено (с триггерами FTS) за {perf_counter() - started:.1f}с")
+        template_cache.load(await db.fetchall(SQL_SELECT_TEMPLATES))
+
+        by_length = {}
+        hits = 0
+        for _ in range(QUERIES // 5):
+            for query in typing(rng):
+                started = perf_counter()
+                found = await search_templates(query)
+                by_length.setdefault(min(len(query), 6), []).append(perf_counter() - started)
+                hits += bool(found)
+
+        samples = [sample for group in by_length.values() for sample in group]
+        print(f"запросов: {len(samples)}, с результатами: {hits}")
+        for length, group in sorted(by_length.items()):
+            label = f"{length}{'+' if length == 6 else ''} симв."
+            print(f"{label:<9} p50={percentile(group, 0.5) * 1000:.2f}мс p99={percentile(group, 0.99) * 1000:.2f}мс")
+        print(f"все      p50={percentile(samples, 0.5) * 1000:.2f}мс p99={percentile(samples, 0.99) * 1000:.2f}мс")
+        await close_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,106 @@
+# Запуск: python -m benchmarks.bench_sla [--open 100 1000 10000] [--hours 4] [--poll 15]
+# Планировщик напоминаний о просрочке на виртуальной смене: заказы приходят так, чтобы невыданных
+# одновременно было около --open, выдаются через 5–25 минут (часть — позже SLA зоны).
+# Куча сроков (Escalator) против цикла, который раз в --poll секунд перебирает все открытые заказы.
+import gc
+import os
+import sys
+import random
+import argparse
+from time import perf_counter
+
+ZONES = ["1 Зона", "2 Зона", "2 Этаж", "General"]
+
+
+def shift_events(rng, open_orders, hours):
+    # (время, 0 — заказ / 1 — выдача, order_id, зона); среднее ожидание 15 минут
+    mean_wait = 900
+    rate = open_orders / mean_wait
+    events = []
+    t = 0.0
+    order_id = 0
+    while t < hours * 3600:
+        t += rng.expovariate(rate)
+        order_id += 1
+        events.append((t, 0, order_id, rng.choice(ZONES)))
+        events.append((t + rng.uniform(300, 1500), 1, order_id, None))
+    events.sort()
+    return events
+
+
+def run_heap(events):
+    from escalation import Escalator, REMINDER, ESCALATION
+
+    escalator = Escalator()
+    fired = 0
+    stall = 0.0
+    started = perf_counter()
+    for t, kind, order_id, zone in events:
+        # Цикл просыпается только к ближайшему сроку: всё, что просрочилось до события, уже разобрано
+        wakeup = perf_counter()
+        for entry in escalator.pop_due(t):
+            fired += 1
+            if entry[6] == REMINDER:
+                escalator.add(entry[2], entry[3], entry[4], entry[5], ESCALATION)
+        stall = max(stall, perf_counter() - wakeup)
+        if kind == 0:
+            escalator.add(order_id, zone, "1", t)
+        else:
+            escalator.remove(order_id)
+    return perf_counter() - started, fired, stall
+
+
+def run_rescan(events, poll):
+    from routing import router
+
+    open_orders = {}
+    fired = 0
+    scans = 0
+    stall = 0.0
+    next_scan = poll
+    started = perf_counter()
+    for t, kind, order_id, zone in events:
+        while next_scan <= t:
+            scans += 1
+            wakeup = perf_counter()
+            for entry in open_orders.values():
+                deadline, stage, zone_name = entry
+                if stage < 2 and deadline <= next_scan:
+                    fired += 1
+                    entry[0] += router.zone(zone_name)[1]
+                    entry[1] += 1
+            stall = max(stall, perf_counter() - wakeup)
+            next_scan += poll
+        if kind == 0:
+            open_orders[order_id] = [t + router.zone(zone)[1], 0, zone]
+        else:
+            del open_orders[order_id]
+    return perf_counter() - started, fired, stall
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--open", type=int, nargs="+", default=[100, 1000, 10000],
+                        help="сколько заказов одновременно ждут выдачи")
+    parser.add_argument("--hours", type=float, default=4)
+    parser.add_argument("--poll", type=float, default=15, help="интервал опроса у цикла с перебором, с")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    sys.path.insert(0, os.getcwd())
+    # Паузы сборщика мусора на сотнях тысяч записей к планировщику не относятся и забивают «самый долгий проход»
+    gc.disable()
+
+    for open_orders in args.open:
+        events = shift_events(random.Random(args.seed), open_orders, args.hours)
+        orders = len(events) // 2
+        heap_time, heap_fired, heap_stall = run_heap(events)
+        scan_time, scan_fired, scan_stall = run_rescan(events, args.poll)
+        print(f"открыто ~{open_orders}, заказов за {args.hours:g}ч: {orders}")
+        print(f"  куча:    {heap_time / orders * 1e6:6.2f}мкс на заказ, самый долгий проход "
+              f"{heap_stall * 1000:.3f}мс, напоминаний {heap_fired}")
+        print(f"  перебор: {scan_time / orders * 1e6:6.2f}мкс на заказ, самый долгий проход "
+              f"{scan_stall * 1000:.3f}мс, напоминаний {scan_fired}")
+
+
+if __name__ == "__main__":
+    main()
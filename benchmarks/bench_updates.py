@@ -0,0 +1,125 @@
+# Запуск: python -m benchmarks.bench_updates
+# Пропускная способность обработки апдейтов: много сотрудников шлют вперемешку шаги двухшагового
+# ConversationHandler, каждый шаг читает user_data, «ходит в API» и пишет обратно. Сравниваются
+# последовательная обработка PTB, простая параллельность PTB и PerUserUpdateProcessor.
+# Корректность диалогов и user_data проверяет tests/test_updates.py.
+import random
+import asyncio
+from time import perf_counter, time
+
+from telegram import Update
+from telegram.ext import Application, ConversationHandler, MessageHandler, filters
+
+from benchmarks.fake_bot_api import FakeBotApi
+from updates import PerUserUpdateProcessor
+
+TOKEN = "123:bench"
+API_PORT = 18092
+USERS = 50
+STEPS = 20
+CONCURRENCY = 16
+# Имитация запроса к Bot API/SQLite внутри обработчика
+IO_DELAY = (0.001, 0.01)
+
+FIRST, SECOND = range(2)
+
+
+def build(mode, base_url, rng, done):
+    builder = Application.builder().token(TOKEN).base_url(base_url).updater(None)
+    if mode == "ptb-concurrent":
+        builder = builder.concurrent_updates(CONCURRENCY)
+    elif mode == "per-user":
+        builder = builder.concurrent_updates(PerUserUpdateProcessor(CONCURRENCY))
+    app = builder.build()
+
+    async def step(update, context, state, next_state):
+        data = context.user_data
+        count = data.get("count", 0)
+        visited = data.get("visited", ())
+        await asyncio.sleep(rng.uniform(*IO_DELAY))
+        # Чтение-изменение-запись через await: при гонке два шага увидят одно и то же значение
+        data["count"] = count + 1
+        data["visited"] = (*visited, state)
+        data.setdefault("seen", []).append(int(update.message.text))
+        done()
+        return next_state
+
+    async def first(update, context):
+        return await step(update, context, FIRST, SECOND)
+
+    async def second(update, context):
+        return await step(update, context, SECOND, FIRST)
+
+    text = filters.TEXT & ~filters.COMMAND
+    app.add_handler(ConversationHandler(
+        entry_points=[MessageHandler(text, first)],
+        states={FIRST: [MessageHandler(text, first)], SECOND: [MessageHandler(text, second)]},
+        fallbacks=[],
+    ))
+    return app
+
+
+def make_updates(bot, rng):
+    # Шаги каждого пользователя идут по порядку, но пользователи перемешаны между собой
+    cursors = {user: 0 for user in range(1, USERS + 1)}
+    updates = []
+    while cursors:
+        user = rng.choice(list(cursors))
+        seq = cursors[user]
+        cursors[user] += 1
+        if cursors[user] == STEPS:
+            del cursors[user]
+        payload = {
+            "update_id": len(updates) + 1,
+            "message": {
+                "message_id": len(updates) + 1,
+                "date": int(time()),
+                "chat": {"id": user, "type": "private"},
+                "from": {"id": user, "is_bot": False, "first_name": f"u{user}"},
+                "text": str(seq),
+            },
+        }
+        updates.append(Update.de_json(payload, bot))
+    return updates
+
+
+async def run(mode, base_url, seed=7):
+    rng = random.Random(seed)
+    total = USERS * STEPS
+    processed = 0
+    finished = asyncio.Event()
+
+    def done():
+        nonlocal processed
+        processed += 1
+        if processed == total:
+            finished.set()
+
+    app = build(mode, base_url, rng, done)
+    async with app:
+        await app.start()
+        updates = make_updates(app.bot, rng)
+        started = perf_counter()
+        for update in updates:
+            await app.update_queue.put(update)
+        try:
+            await asyncio.wait_for(finished.wait(), 120)
+        except asyncio.TimeoutError:
+            pass
+        elapsed = perf_counter() - started
+        await app.stop()
+    print(f"{mode:<15} {total / elapsed:>8.0f} апд/с")
+
+
+async def main():
+    api = FakeBotApi()
+    base_url = await api.start(port=API_PORT)
+    try:
+        for mode in ("sequential", "ptb-concurrent", "per-user"):
+            await run(mode, base_url)
+    finally:
+        await api.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,140 @@
+# Запуск: python -m benchmarks.bench_webhook
+# Задержка от появления апдейта до вызова обработчика: long polling против webhook.
+# Для polling поднимается минимальная подделка Bot API (getMe/deleteWebhook/getUpdates).
+import asyncio
+import statistics
+from time import perf_counter
+
+import aiohttp
+from aiohttp import web
+from telegram.ext import Application, CommandHandler
+
+from webhook import serve_webhook, SECRET_HEADER
+
+TOKEN = "123:bench"
+API_PORT = 18081
+WEBHOOK_PORT = 18082
+WEBHOOK_SECRET = "bench-secret"
+ROUNDS = 200
+
+BOT_USER = {"id": 123, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+
+
+def make_update(update_id):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": 1, "type": "private"},
+            "from": {"id": 1, "is_bot": False, "first_name": "staff"},
+            "text": "/ping",
+            "entities": [{"type": "bot_command", "offset": 0, "length": 5}],
+        },
+    }
+
+
+class FakeBotApi:
+    def __init__(self):
+        self.pending = []
+        self.arrived = asyncio.Event()
+
+    def push(self, update):
+        self.pending.append(update)
+        self.arrived.set()
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        if method == "getMe":
+            return web.json_response({"ok": True, "result": BOT_USER})
+        if method == "getUpdates":
+            if not self.pending:
+                self.arrived.clear()
+                try:
+                    await asyncio.wait_for(self.arrived.wait(), 1)
+                except asyncio.TimeoutError:
+                    pass
+            updates, self.pending = self.pending, []
+            return web.json_response({"ok": True, "result": updates})
+        return web.json_response({"ok": True, "result": True})
+
+
+def build_application(handled):
+    async def ping(update, context):
+        handled[update.update_id].set_result(perf_counter())
+
+    app = Application.builder().token(TOKEN).base_url(f"http://127.0.0.1:{API_PORT}/bot").build()
+    app.add_handler(CommandHandler("ping", ping))
+    return app
+
+
+def report(label, samples):
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    print(f"{label:<8} p50={statistics.median(samples) * 1000:.2f}мс p95={p95 * 1000:.2f}мс")
+
+
+async def bench_polling(api):
+    loop = asyncio.get_running_loop()
+    handled = {}
+    app = build_application(handled)
+    async with app:
+        await app.updater.start_polling(poll_interval=0.0)
+        await app.start()
+        samples = []
+        for i in range(1, ROUNDS + 1):
+            handled[i] = loop.create_future()
+            started = perf_counter()
+            api.push(make_update(i))
+            samples.append(await handled[i] - started)
+        await app.updater.stop()
+        await app.stop()
+    report("polling", samples)
+
+
+async def bench_webhook():
+    loop = asyncio.get_running_loop()
+    handled = {}
+    app = build_application(handled)
+    stop = asyncio.Event()
+    server = asyncio.create_task(
+        serve_webhook(app, stop, listen="127.0.0.1", port=WEBHOOK_PORT, url="", secret=WEBHOOK_SECRET)
+    )
+    samples = []
+    async with aiohttp.ClientSession() as session:
+        for _ in range(100):
+            try:
+                async with session.get(f"http://127.0.0.1:{WEBHOOK_PORT}/healthz") as resp:
+                    if (await resp.json())["status"] == "ok":
+                        break
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.05)
+        for i in range(1, ROUNDS + 1):
+            handled[i] = loop.create_future()
+            started = perf_counter()
+            async with session.post(f"http://127.0.0.1:{WEBHOOK_PORT}/telegram", json=make_update(i),
+                                    headers={SECRET_HEADER: WEBHOOK_SECRET}):
+                pass
+            samples.append(await handled[i] - started)
+    stop.set()
+    await server
+    report("webhook", samples)
+
+
+async def main():
+    api = FakeBotApi()
+    web_app = web.Application()
+    web_app.router.add_post("/bot{token}/{method}", api.handle)
+    runner = web.AppRunner(web_app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", API_PORT).start()
+    try:
+        await bench_polling(api)
+        await bench_webhook()
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
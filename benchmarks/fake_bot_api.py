@@ -0,0 +1,168 @@
+# Локальная подделка Bot API для нагрузочных стендов: хранит сообщения по чатам,
+# отдаёт апдейты через getUpdates, умеет добавлять задержку и отвечать 429 (RetryAfter).
+import json
+import random
+import asyncio
+from collections import Counter
+from time import perf_counter, time
+
+from aiohttp import web
+
+BOT_USER = {"id": 123, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+# Методы, которые в реальном API упираются во flood control
+WRITE_METHODS = {"sendMessage", "editMessageText", "editMessageReplyMarkup", "deleteMessage"}
+
+
+class FakeBotApi:
+    def __init__(self, latency=0.0, jitter=0.0, retry_rate=0.0, retry_after=1, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.retry_rate = retry_rate
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.calls = Counter()
+        self.retries = Counter()
+        self.messages = {}
+        self.last_message = {}
+        self._next_id = Counter()
+        self._renders = {}
+        self._pending = []
+        self._arrived = asyncio.Event()
+        self._update_id = 0
+        self._runner = None
+
+    # --- сервер ---
+
+    async def start(self, host="127.0.0.1", port=18090):
+        web_app = web.Application()
+        web_app.router.add_post("/bot{token}/{method}", self.handle)
+        self._runner = web.AppRunner(web_app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        return f"http://{host}:{port}/bot"
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            # PTB шлёт form-urlencoded, вложенные объекты — строками JSON
+            params = dict(await request.post())
+            if isinstance(params.get("reply_markup"), str):
+                params["reply_markup"] = json.loads(params["reply_markup"])
+        self.calls[method] += 1
+        if method == "getUpdates":
+            return _ok(await self._get_updates(params))
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + self.rng.uniform(0, self.jitter))
+        if method in WRITE_METHODS and self.rng.random() < self.retry_rate:
+            self.retries[method] += 1
+            return web.json_response({
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }, status=429)
+        handler = getattr(self, f"_{method}", None)
+        return _ok(handler(params) if handler else True)
+
+    # --- апдейты ---
+
+    def next_update_id(self):
+        self._update_id += 1
+        return self._update_id
+
+    def push(self, update):
+        self._pending.append(update)
+        self._arrived.set()
+
+    async def _get_updates(self, params):
+        if not self._pending:
+            self._arrived.clear()
+            try:
+                await asyncio.wait_for(self._arrived.wait(), min(float(params.get("timeout") or 0), 1))
+            except asyncio.TimeoutError:
+                pass
+        limit = int(params.get("limit") or 100)
+        updates, self._pending = self._pending[:limit], self._pending[limit:]
+        return updates
+
+    # --- сообщения ---
+
+    def message(self, chat_id, message_id):
+        stored = self.messages[(chat_id, message_id)]
+        message = {
+            "message_id": message_id,
+            "date": int(time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"},
+            "from": BOT_USER,
+            "text": stored["text"],
+        }
+        if stored.get("reply_markup"):
+            message["reply_markup"] = stored["reply_markup"]
+        if stored.get("message_thread_id"):
+            message["message_thread_id"] = stored["message_thread_id"]
+        return message
+
+    def _render(self, method, chat_id, message_id):
+        self.last_message[chat_id] = message_id
+        self.renders(chat_id).put_nowait((method, message_id, perf_counter()))
+
+    def renders(self, chat_id):
+        # Очередь отправок/правок сообщений бота в чате: по ней стенд меряет время до реакции
+        queue = self._renders.get(chat_id)
+        if queue is None:
+            queue = self._renders[chat_id] = asyncio.Queue()
+        return queue
+
+    def new_message_id(self, chat_id):
+        # Общая нумерация для сообщений бота и пользователя, как в настоящем чате
+        self._next_id[chat_id] += 1
+        return self._next_id[chat_id]
+
+    def _sendMessage(self, params):
+        chat_id = int(params["chat_id"])
+        message_id = self.new_message_id(chat_id)
+        thread_id = params.get("message_thread_id")
+        self.messages[(chat_id, message_id)] = {
+            "text": params.get("text", ""),
+            "reply_markup": params.get("reply_markup"),
+            "message_thread_id": int(thread_id) if thread_id else None,
+        }
+        self._render("sendMessage", chat_id, message_id)
+        return self.message(chat_id, message_id)
+
+    def _editMessageText(self, params):
+        chat_id, message_id = int(params["chat_id"]), int(params["message_id"])
+        stored = self.messages.setdefault((chat_id, message_id), {})
+        stored["text"] = params.get("text", "")
+        stored["reply_markup"] = params.get("reply_markup")
+        self._render("editMessageText", chat_id, message_id)
+        return self.message(chat_id, message_id)
+
+    def _editMessageReplyMarkup(self, params):
+        chat_id, message_id = int(params["chat_id"]), int(params["message_id"])
+        stored = self.messages.setdefault((chat_id, message_id), {"text": ""})
+        stored["reply_markup"] = params.get("reply_markup")
+        self._render("editMessageReplyMarkup", chat_id, message_id)
+        return self.message(chat_id, message_id)
+
+    def _deleteMessage(self, params):
+        self.messages.pop((int(params["chat_id"]), int(params["message_id"])), None)
+        return True
+
+    def _getMe(self, params):
+        return BOT_USER
+
+    def buttons(self, chat_id, message_id):
+        stored = self.messages.get((chat_id, message_id)) or {}
+        markup = stored.get("reply_markup") or {}
+        return [button for row in markup.get("inline_keyboard", []) for button in row]
+
+
+def _ok(result):
+    return web.json_response({"ok": True, "result": result})
@@ -1,366 +1,415 @@
-
 import os
+import re
 import asyncio
-import aiosqlite
+from functools import lru_cache
 from time import time
 from telegram import (
-    Update, InlineKeyboardButton, InlineKeyboardMarkup
+    Update, Chat, ChatMember, InlineKeyboardButton, InlineKeyboardMarkup, InlineQueryResultArticle,
+    InputTextMessageContent
 )
-from telegram.constants import ParseMode
 from telegram.ext import (
-    Application, CommandHandler, CallbackQueryHandler, MessageHandler, ContextTypes, ConversationHandler, filters
+    Application, CommandHandler, CallbackQueryHandler, MessageHandler, InlineQueryHandler, ContextTypes,
+    ConversationHandler, TypeHandler, filters
 )
+from telegram.error import TelegramError
 from dotenv import load_dotenv
+from loguru import logger
 
 load_dotenv()
 
+# Локальные модули читают настройки из окружения при импорте, поэтому импортируем их после .env
+from db import (
+    init_db, close_db, save_template, get_template_by_id, get_templates_page, search_templates,
+    create_order, create_cart, complete_order, get_cart_orders, TEMPLATES_SEARCH_LIMIT
+)
+from dispatch import dispatcher, PRIORITY_UI
+from outbox import outbox
+from routing import router
+from persistence import SQLitePersistence
+from stoplist import stoplist
+from suggest import aroma_suggestions
+from webhook import serve_webhook, WEBHOOK_URL
+from backlog import backlog_drain, BACKLOG_DRAIN
+from drafts import STRENGTH_CHOICES, DRAFT_CHOICES, get_draft
+from sweeper import idle_sweeper, track_activity
+from escalation import escalator
+from dedupe import submit_dedupe
+from render import render_cache
+from effects import effects, pipelined
+from ticker import ticker, format_wait
+from analytics import record_completion, backfill, stats_report, shift_summary
+from eventlog import event, new_trace, bind_trace, event_log
+from metrics import MetricsRequest, instrument_handlers, metrics_server
+from updates import PerUserUpdateProcessor, UPDATE_CONCURRENCY
+import callbacks as cb
+from callbacks import encode, decode, matches, make_dispatcher
+
 TOKEN = os.getenv("BOT_TOKEN")
+# polling | webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling")
 TARGET_CHAT_ID = os.getenv("TARGET_CHAT_ID")
+# Кто может менять стоп-лист: id через запятую; пусто — все участники рабочей группы TARGET_CHAT_ID
+ADMIN_IDS = {int(user_id) for user_id in os.getenv("ADMIN_IDS", "").replace(" ", "").split(",") if user_id}
 
-DB_FILE = "templates.db"
+# Inline-выдача кэшируется Telegram недолго: свежесохранённый шаблон должен находиться сразу
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", "5"))
+# Выбранный inline-результат приходит обычным сообщением "via @бот" с id шаблона в тексте
+INLINE_PICK_PREFIX = "⚡ Быстрый заказ #"
+INLINE_PICK_PATTERN = re.compile(rf"^{re.escape(INLINE_PICK_PREFIX)}(\d+)")
 
 TABLE, AROMA, STRENGTH, BOWL, DRAFT, SAVE_TEMPLATE_LABEL, MANUAL_BOWL = range(7)
 
-STRENGTH_CHOICES = [
-    ["Легкий", "Легкий +", "Легкий-Средний"],
-    ["Безопасный Дарк", "Средний"],
-    ["Средний+", "Выше среднего", "Крепкий"]
-]
-DRAFT_CHOICES = ["Union 🔴", "Yapona ⚫", "Wookah 🟤"]
 BOWL_CHOICES = [
-    [InlineKeyboardButton("Прямоток", callback_data="bowl_Прямоток"),
-     InlineKeyboardButton("Фанел", callback_data="bowl_Фанел")],
-    [InlineKeyboardButton("Фольга", callback_data="bowl_Фольга"),
-     InlineKeyboardButton("Грейпфрут 🍊", callback_data="bowl_Грейпфрут 🍊")],
-    [InlineKeyboardButton("Гранат 🍎", callback_data="bowl_Гранат 🍎")],
-    [InlineKeyboardButton("Ввести вручную", callback_data="bowl_manual")]
+    [InlineKeyboardButton("Прямоток", callback_data=encode(cb.BOWL, "Прямоток")),
+     InlineKeyboardButton("Фанел", callback_data=encode(cb.BOWL, "Фанел"))],
+    [InlineKeyboardButton("Фольга", callback_data=encode(cb.BOWL, "Фольга")),
+     InlineKeyboardButton("Грейпфрут 🍊", callback_data=encode(cb.BOWL, "Грейпфрут 🍊"))],
+    [InlineKeyboardButton("Гранат 🍎", callback_data=encode(cb.BOWL, "Гранат 🍎"))],
+    [InlineKeyboardButton("Ввести вручную", callback_data=encode(cb.BOWL_MANUAL))]
 ]
 
-TOPICS = {
-    "1 Зона": 5,
-    "2 Зона": 2,
-    "2 Этаж": 6,
-    "general": 2446094747
-}
-
-# --- DATABASE FUNCTIONS ---
-
-async def init_db():
-    async with aiosqlite.connect(DB_FILE) as db:
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS templates (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                label TEXT NOT NULL,
-                aroma TEXT,
-                strength TEXT,
-                bowl TEXT,
-                draft TEXT
-            )
-        """)
-        await db.commit()
-
-async def save_template(label, aroma, strength, bowl, draft):
-    async with aiosqlite.connect(DB_FILE) as db:
-        await db.execute(
-            "INSERT INTO templates (label, aroma, strength, bowl, draft) VALUES (?, ?, ?, ?, ?)",
-            (label, aroma, strength, bowl, draft)
-        )
-        await db.commit()
-
-async def get_templates():
-    async with aiosqlite.connect(DB_FILE) as db:
-        async with db.execute("SELECT id, label, aroma, strength, bowl, draft FROM templates") as cursor:
-            rows = await cursor.fetchall()
-            return rows
-
-async def get_template_by_id(template_id):
-    async with aiosqlite.connect(DB_FILE) as db:
-        async with db.execute(
-            "SELECT id, label, aroma, strength, bowl, draft FROM templates WHERE id = ?",
-            (template_id,)
-        ) as cursor:
-            return await cursor.fetchone()
+# Статичные клавиатуры собираются один раз при импорте
+ORDER_MENU_TEXT = "Меню заказа. Нажмите на пункт для ввода/изменения:"
+MAIN_MENU_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📝 Сделать заказ", callback_data=encode(cb.MAIN_ORDER))],
+    [InlineKeyboardButton("⚡ Быстрый заказ", callback_data=encode(cb.QUICK_MENU, 0))]
+])
+STRENGTH_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton(text, callback_data=encode(cb.STRENGTH, text)) for text in row]
+    for row in STRENGTH_CHOICES
+])
+BOWL_KEYBOARD = InlineKeyboardMarkup(BOWL_CHOICES)
+DRAFT_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton(text, callback_data=encode(cb.DRAFT, text))]
+    for text in DRAFT_CHOICES
+])
+ORDER_SENT_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("💾 Сохранить как шаблон", callback_data=encode(cb.SAVE_AS_TEMPLATE))],
+    [InlineKeyboardButton("📝 Сделать заказ", callback_data=encode(cb.MAIN_ORDER))],
+    [InlineKeyboardButton("⚡ Быстрый заказ", callback_data=encode(cb.QUICK_MENU, 0))]
+])
+BACK_TO_MENU_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔙 В меню", callback_data=encode(cb.TO_MENU))]
+])
 
 # --- BUSINESS LOGIC ---
 
 def get_zone_and_topic_id(table_number: str):
-    table_number = table_number.strip()
-    try:
-        num = int(table_number)
-    except ValueError:
-        num = None
-    if (num is not None and 1 <= num <= 16) or table_number in ["101", "102", "103"]:
-        return "1 Зона", TOPICS["1 Зона"]
-    if (num is not None and 17 <= num <= 32) or table_number in ["104", "105"]:
-        return "2 Зона", TOPICS["2 Зона"]
-    if (num is not None and 33 <= num <= 47) or table_number in ["201", "777"]:
-        return "2 Этаж", TOPICS["2 Этаж"]
-    return "General", TOPICS["general"]
+    return router.lookup(table_number)
 
-def get_order_keyboard(context):
-    data = context.user_data
-    def val(key): return data.get(key, "❌ Не выбрано")
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton(f"Стол: {val('table')}", callback_data="edit_table")],
-        [InlineKeyboardButton(f"Ароматика: {val('aroma')}", callback_data="edit_aroma")],
-        [InlineKeyboardButton(f"Крепость: {val('strength')}", callback_data="edit_strength")],
-        [InlineKeyboardButton(f"Чаша: {val('bowl')}", callback_data="edit_bowl")],
-        [InlineKeyboardButton(f"Тяга: {val('draft')}", callback_data="edit_draft")],
-        [InlineKeyboardButton("✅ Отправить заказ", callback_data="send_order")]
-    ])
+@lru_cache(maxsize=1024)
+def order_keyboard(table, aroma, strength, bowl, draft, cart=(), total=1):
+    # cart — уже отложенные кальяны этого заказа, total — сколько уйдёт вместе с черновиком
+    keyboard = [
+        [InlineKeyboardButton(f"Стол: {table}", callback_data=encode(cb.EDIT, "table"))],
+        [InlineKeyboardButton(f"Ароматика: {aroma}", callback_data=encode(cb.EDIT, "aroma"))],
+        [InlineKeyboardButton(f"Крепость: {strength}", callback_data=encode(cb.EDIT, "strength"))],
+        [InlineKeyboardButton(f"Чаша: {bowl}", callback_data=encode(cb.EDIT, "bowl"))],
+        [InlineKeyboardButton(f"Тяга: {draft}", callback_data=encode(cb.EDIT, "draft"))],
+    ]
+    for i, item in enumerate(cart):
+        keyboard.append([
+            InlineKeyboardButton(f"✏️ {i + 1}. {item_title(item)}", callback_data=encode(cb.CART_EDIT, i))
+        ])
+    keyboard.append([InlineKeyboardButton("➕ Ещё кальян в этот заказ", callback_data=encode(cb.CART_ADD))])
+    send = f"✅ Отправить заказ (кальянов: {total})" if total > 1 else "✅ Отправить заказ"
+    keyboard.append([InlineKeyboardButton(send, callback_data=encode(cb.SEND_ORDER))])
+    return InlineKeyboardMarkup(keyboard)
 
-async def menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+def aroma_keyboard(prefix="", typed=None):
+    # Частые ароматики одной кнопкой; typed — введённый текст, который можно оставить как есть
     keyboard = [
-        [InlineKeyboardButton("📝 Сделать заказ", callback_data="main_order")],
-        [InlineKeyboardButton("⚡ Быстрый заказ", callback_data="quick_order_menu")]
+        [InlineKeyboardButton(aroma, callback_data=encode(cb.AROMA, aroma))]
+        for aroma in aroma_suggestions.top(prefix, skip=stoplist.check)
     ]
+    if keyboard and typed:
+        keyboard.append([InlineKeyboardButton(f"✏️ Оставить «{typed}»", callback_data=encode(cb.AROMA, typed))])
+    return InlineKeyboardMarkup(keyboard) if keyboard else None
+
+def get_order_keyboard(context):
+    # Разметка меню зависит только от черновика, поэтому кэшируется по его полям
+    order = get_draft(context)
+    def val(value): return "❌ Не выбрано" if value is None else value
+    cart = tuple(order.cart_items())
+    return order_keyboard(
+        val(order.table), val(order.aroma), val(order.strength), val(order.bowl), val(order.draft),
+        cart, len(order.items())
+    )
+
+def item_title(item):
+    return " · ".join(value for value in item if value) or "❌ Не выбрано"
+
+def refresh_order_menu(context, chat_id, order_msg_id, text="Сохранено!"):
+    # Косметическая правка: идёт через очередь с низким приоритетом, заказы обгоняют её
+    text = f"{text}\n\n{ORDER_MENU_TEXT}"
+    markup = get_order_keyboard(context)
+    if render_cache.is_current(chat_id, order_msg_id, text, markup):
+        return
+    effects().edit(chat_id, order_msg_id, text, markup, priority=PRIORITY_UI)
+
+def order_event(context, name, **fields):
+    # Черновик без trace (поднят из базы до журнала) получает его при первой правке
+    order = get_draft(context)
+    if order.trace_id is None:
+        order.trace_id = new_trace()
+    bind_trace(order.trace_id)
+    event(name, **fields)
+
+async def bind_order_trace(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Группа -2: правки черновика и вызовы Bot API ради них пишутся с trace заказа
+    chat = update.effective_chat
+    if update.effective_user is None or chat is None or chat.type != Chat.PRIVATE:
+        bind_trace(None)
+        return
+    bind_trace(get_draft(context).trace_id)
+
+bind_order_trace.timed = True
+
+@pipelined
+async def menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.message:
-        msg = await update.message.reply_text("Главное меню:", reply_markup=InlineKeyboardMarkup(keyboard))
-        context.user_data["order_msg_id"] = msg.message_id
+        msg = await effects().send(update.message.chat_id, "Главное меню:", MAIN_MENU_KEYBOARD)
+        get_draft(context).order_msg_id = msg.message_id
     else:
-        msg = await update.callback_query.edit_message_text("Главное меню:", reply_markup=InlineKeyboardMarkup(keyboard))
-        context.user_data["order_msg_id"] = msg.message_id
+        message = update.callback_query.message
+        effects().edit(message.chat_id, message.message_id, "Главное меню:", MAIN_MENU_KEYBOARD)
+        get_draft(context).order_msg_id = message.message_id
 
+@pipelined
 async def start_order(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    order_msg_id = context.user_data.get("order_msg_id")
-    context.user_data.clear()
-    if order_msg_id:
-        context.user_data["order_msg_id"] = order_msg_id
-    await update.callback_query.answer()
-    msg = await update.callback_query.edit_message_text(
-        "Меню заказа. Нажмите на пункт для ввода/изменения:",
-        reply_markup=get_order_keyboard(context)
-    )
-    context.user_data["order_msg_id"] = msg.message_id
-
+    fx = effects()
+    order = get_draft(context)
+    order.reset_fields()
+    order.trace_id = new_trace()
+    order_event(context, "order.start")
+    fx.answer(update.callback_query)
+    message = update.callback_query.message
+    submit_dedupe.forget((update.effective_user.id, message.message_id))
+    fx.edit(message.chat_id, message.message_id, ORDER_MENU_TEXT, get_order_keyboard(context))
+    order.order_msg_id = message.message_id
+
+@pipelined
 async def edit_field(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    fx = effects()
     query = update.callback_query
-    await query.answer()
-    field = query.data.replace("edit_", "")
-    context.user_data["edit_field"] = field
-    order_msg_id = context.user_data.get("order_msg_id")
+    fx.answer(query)
+    callback = decode(query.data)
+    if callback is None:
+        return ConversationHandler.END
+    field = callback.args[0]
+    order = get_draft(context)
+    order.edit_field = field
+    order_msg_id = order.order_msg_id
     chat_id = query.message.chat_id
 
     if field == "strength":
-        keyboard = InlineKeyboardMarkup([
-            [InlineKeyboardButton(text, callback_data=f"strength_{text}") for text in row]
-            for row in STRENGTH_CHOICES
-        ])
-        await context.bot.edit_message_text(
-            "Выберите крепость:",
-            chat_id=chat_id,
-            message_id=order_msg_id,
-            reply_markup=keyboard
-        )
+        fx.edit(chat_id, order_msg_id, "Выберите крепость:", STRENGTH_KEYBOARD)
         return STRENGTH
     elif field == "bowl":
-        await context.bot.edit_message_text(
-            "Выберите чашу:",
-            chat_id=chat_id,
-            message_id=order_msg_id,
-            reply_markup=InlineKeyboardMarkup(BOWL_CHOICES)
-        )
+        fx.edit(chat_id, order_msg_id, "Выберите чашу:", BOWL_KEYBOARD)
         return BOWL
     elif field == "draft":
-        keyboard = InlineKeyboardMarkup([
-            [InlineKeyboardButton(text, callback_data=f"draft_{text}")]
-            for text in DRAFT_CHOICES
-        ])
-        await context.bot.edit_message_text(
-            "Выберите тягу:",
-            chat_id=chat_id,
-            message_id=order_msg_id,
-            reply_markup=keyboard
-        )
+        fx.edit(chat_id, order_msg_id, "Выберите тягу:", DRAFT_KEYBOARD)
         return DRAFT
     elif field == "table":
-        await context.bot.edit_message_text(
-            "Введите номер стола:",
-            chat_id=chat_id,
-            message_id=order_msg_id,
-            reply_markup=None
-        )
+        fx.edit(chat_id, order_msg_id, "Введите номер стола:")
         return TABLE
     else:
-        prompts = {
-            "aroma": "Введите ароматику:"
-        }
-        await context.bot.edit_message_text(
-            prompts[field],
-            chat_id=chat_id,
-            message_id=order_msg_id,
-            reply_markup=None
-        )
+        markup = aroma_keyboard()
+        prompt = "Выберите ароматику или введите свою:" if markup else "Введите ароматику:"
+        fx.edit(chat_id, order_msg_id, prompt, markup)
         return AROMA
 
+@pipelined
 async def save_table_field(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    context.user_data["table"] = update.message.text.strip()
-    context.user_data["edit_field"] = None
+    order = get_draft(context)
+    order.table = update.message.text.strip()
+    order.edit_field = None
+    order_event(context, "order.field", field="table", value=order.table)
 
-    # Удалить сообщение пользователя
-    try:
-        await update.message.delete()
-    except Exception:
-        pass
+    # Удалить сообщение пользователя — параллельно с правкой меню
+    effects().delete(update.message)
 
-    order_msg_id = context.user_data.get('order_msg_id')
+    order_msg_id = order.order_msg_id
     chat_id = update.effective_chat.id
 
-    if context.user_data.get("from_quick"):
-        context.user_data.pop("from_quick")
+    if order.from_quick:
         await send_order(update, context, from_quick=True)
-        order_msg_id = context.user_data.get("order_msg_id")
-        context.user_data.clear()
-        if order_msg_id:
-            context.user_data["order_msg_id"] = order_msg_id
+        order.reset_fields()
         await menu(update, context)
         return ConversationHandler.END
 
-    try:
-        await context.bot.edit_message_text(
-            "Сохранено!\n\nМеню заказа. Нажмите на пункт для ввода/изменения:",
-            chat_id=chat_id,
-            message_id=order_msg_id,
-            reply_markup=get_order_keyboard(context)
-        )
-    except Exception:
-        pass
+    refresh_order_menu(context, chat_id, order_msg_id)
     return ConversationHandler.END
 
+@pipelined
 async def save_field(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    field = context.user_data.get("edit_field")
+    fx = effects()
+    order = get_draft(context)
+    field = order.edit_field
     if field not in ["aroma", "bowl"]:
         return
-    context.user_data[field] = update.message.text
-    context.user_data["edit_field"] = None
 
-    # Удалить сообщение пользователя
-    try:
-        await update.message.delete()
-    except Exception:
-        pass
+    # Удалить сообщение пользователя — параллельно с правкой меню
+    fx.delete(update.message)
 
-    order_msg_id = context.user_data.get('order_msg_id')
+    order_msg_id = order.order_msg_id
     chat_id = update.effective_chat.id
 
-    if context.user_data.get("from_quick"):
-        context.user_data.pop("from_quick")
+    if field == "aroma":
+        blocked = stoplist.check(update.message.text)
+        if blocked:
+            order_event(context, "order.blocked", aromas=blocked)
+            fx.edit(chat_id, order_msg_id, f"⛔ Нет в наличии: {', '.join(blocked)}\n\nВведите другую ароматику:")
+            return AROMA
+        # Начало известной ароматики — предлагаем дописанные варианты вместо опечаток
+        if not aroma_suggestions.known(update.message.text):
+            markup = aroma_keyboard(update.message.text, typed=update.message.text)
+            if markup:
+                fx.edit(chat_id, order_msg_id, "Уточните ароматику:", markup)
+                return AROMA
+
+    setattr(order, field, update.message.text)
+    order.edit_field = None
+    order_event(context, "order.field", field=field, value=update.message.text)
+
+    if order.from_quick:
         await send_order(update, context, from_quick=True)
-        order_msg_id = context.user_data.get("order_msg_id")
-        context.user_data.clear()
-        if order_msg_id:
-            context.user_data["order_msg_id"] = order_msg_id
+        order.reset_fields()
         await menu(update, context)
         return ConversationHandler.END
 
-    try:
-        await context.bot.edit_message_text(
-            "Сохранено!\n\nМеню заказа. Нажмите на пункт для ввода/изменения:",
-            chat_id=chat_id,
-            message_id=order_msg_id,
-            reply_markup=get_order_keyboard(context)
+    refresh_order_menu(context, chat_id, order_msg_id)
+    return ConversationHandler.END
+
+@pipelined
+async def save_aroma_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    effects().answer(query)
+    callback = decode(query.data)
+    if callback is None:
+        return ConversationHandler.END
+    text = callback.args[0]
+    order = get_draft(context)
+    order_msg_id = order.order_msg_id
+    chat_id = query.message.chat_id
+    # Подсказки собирались до того, как стоп-лист мог пополниться
+    blocked = stoplist.check(text)
+    if blocked:
+        order_event(context, "order.blocked", aromas=blocked)
+        effects().edit(
+            chat_id, order_msg_id,
+            f"⛔ Нет в наличии: {', '.join(blocked)}\n\nВыберите или введите другую ароматику:",
+            aroma_keyboard()
         )
-    except Exception:
-        pass
+        return AROMA
+    order.aroma = text
+    order.edit_field = None
+    order_event(context, "order.field", field="aroma", value=text)
+    refresh_order_menu(context, chat_id, order_msg_id)
     return ConversationHandler.END
 
+@pipelined
 async def save_strength_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    await query.answer()
-    text = query.data.replace("strength_", "")
-    context.user_data["strength"] = text
-    context.user_data["edit_field"] = None
-    order_msg_id = context.user_data.get("order_msg_id")
+    effects().answer(query)
+    callback = decode(query.data)
+    if callback is None:
+        return ConversationHandler.END
+    order = get_draft(context)
+    order.strength = callback.args[0]
+    order.edit_field = None
+    order_event(context, "order.field", field="strength", value=order.strength)
+    order_msg_id = order.order_msg_id
     chat_id = query.message.chat_id
-    try:
-        await context.bot.edit_message_text(
-            "Сохранено!\n\nМеню заказа. Нажмите на пункт для ввода/изменения:",
-            chat_id=chat_id,
-            message_id=order_msg_id,
-            reply_markup=get_order_keyboard(context)
-        )
-    except Exception:
-        pass
+    refresh_order_menu(context, chat_id, order_msg_id)
     return ConversationHandler.END
 
+@pipelined
 async def save_draft_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    await query.answer()
-    text = query.data.replace("draft_", "")
-    context.user_data["draft"] = text
-    context.user_data["edit_field"] = None
-    order_msg_id = context.user_data.get("order_msg_id")
+    effects().answer(query)
+    callback = decode(query.data)
+    if callback is None:
+        return ConversationHandler.END
+    order = get_draft(context)
+    order.draft = callback.args[0]
+    order.edit_field = None
+    order_event(context, "order.field", field="draft", value=order.draft)
+    order_msg_id = order.order_msg_id
     chat_id = query.message.chat_id
-    try:
-        await context.bot.edit_message_text(
-            "Сохранено!\n\nМеню заказа. Нажмите на пункт для ввода/изменения:",
-            chat_id=chat_id,
-            message_id=order_msg_id,
-            reply_markup=get_order_keyboard(context)
-        )
-    except Exception:
-        pass
+    refresh_order_menu(context, chat_id, order_msg_id)
     return ConversationHandler.END
 
+@pipelined
 async def bowl_choice(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    await query.answer()
-    data = query.data
-    order_msg_id = context.user_data.get("order_msg_id")
+    effects().answer(query)
+    callback = decode(query.data)
+    order = get_draft(context)
+    order_msg_id = order.order_msg_id
     chat_id = query.message.chat_id
-    if data == "bowl_manual":
-        context.user_data["edit_field"] = "bowl"
-        try:
-            await context.bot.edit_message_text(
-                "Введите название чаши вручную:",
-                chat_id=chat_id,
-                message_id=order_msg_id,
-                reply_markup=None
-            )
-        except Exception:
-            pass
+    if callback is None:
+        return ConversationHandler.END
+    if callback.action == cb.BOWL_MANUAL:
+        order.edit_field = "bowl"
+        effects().edit(chat_id, order_msg_id, "Введите название чаши вручную:")
         return MANUAL_BOWL
-    elif data.startswith("bowl_"):
-        context.user_data["bowl"] = data[5:]
-        context.user_data["edit_field"] = None
-        try:
-            await context.bot.edit_message_text(
-                "Сохранено!\n\nМеню заказа. Нажмите на пункт для ввода/изменения:",
-                chat_id=chat_id,
-                message_id=order_msg_id,
-                reply_markup=get_order_keyboard(context)
-            )
-        except Exception:
-            pass
+    else:
+        order.bowl = callback.args[0]
+        order.edit_field = None
+        order_event(context, "order.field", field="bowl", value=order.bowl)
+        refresh_order_menu(context, chat_id, order_msg_id)
         return ConversationHandler.END
 
+@pipelined
 async def save_manual_bowl(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    context.user_data["bowl"] = update.message.text
-    context.user_data["edit_field"] = None
+    order = get_draft(context)
+    order.bowl = update.message.text
+    order.edit_field = None
+    order_event(context, "order.field", field="bowl", value=order.bowl)
 
-    # Удалить сообщение пользователя
-    try:
-        await update.message.delete()
-    except Exception:
-        pass
+    # Удалить сообщение пользователя — параллельно с правкой меню
+    effects().delete(update.message)
 
-    order_msg_id = context.user_data.get("order_msg_id")
+    order_msg_id = order.order_msg_id
     chat_id = update.effective_chat.id
-    try:
-        await context.bot.edit_message_text(
-            "Сохранено!\n\nМеню заказа. Нажмите на пункт для ввода/изменения:",
-            chat_id=chat_id,
-            message_id=order_msg_id,
-            reply_markup=get_order_keyboard(context)
-        )
-    except Exception:
-        pass
+    refresh_order_menu(context, chat_id, order_msg_id)
     return ConversationHandler.END
 
+# ----------- Корзина: несколько кальянов на один стол -----------
+
+@pipelined
+async def cart_add_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    effects().answer(query)
+    order = get_draft(context)
+    if not order.has_item():
+        text = "Сначала заполните кальян."
+    else:
+        order.stash()
+        order_event(context, "order.cart_add", hookahs=len(order.cart))
+        text = f"Кальянов в заказе: {len(order.cart)}. Заполните следующий:"
+    refresh_order_menu(context, query.message.chat_id, order.order_msg_id, text=text)
+
+@pipelined
+async def cart_edit_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Кальян из корзины возвращается в черновик и правится обычными обработчиками полей
+    query = update.callback_query
+    effects().answer(query)
+    callback = decode(query.data)
+    order = get_draft(context)
+    if callback is None or not 0 <= callback.args[0] < len(order.cart):
+        return
+    # Текущий черновик не теряем: он встаёт на своё место, номера после него сдвигаются
+    index = order.take(callback.args[0])
+    order_event(context, "order.cart_edit", index=index)
+    refresh_order_menu(context, query.message.chat_id, order.order_msg_id, text=f"Кальян {index + 1}: правка")
+
 # ----------- Кнопка "Кальян отдан" -----------
 
-def format_elapsed(ts):
-    now = int(time())
+def format_elapsed(ts, now=None):
+    now = int(time()) if now is None else now
     delta = now - ts
     mins, secs = divmod(delta, 60)
     hours, mins = divmod(mins, 60)
@@ -371,291 +420,486 @@ def format_elapsed(ts):
     else:
         return f"{secs}с"
 
+@pipelined
 async def order_done_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    fx = effects()
     query = update.callback_query
-    await query.answer()
-    data = query.data  # order_done_{user_id}_{timestamp}
-    parts = data.split("_")
-    if len(parts) != 4:
+    # Ответ на нажатие уходит, пока заказ закрывается в базе
+    fx.answer(query)
+    callback = decode(query.data)
+    if callback is None:
         return
+    if callback.action == cb.ORDER_DONE:
+        order = await complete_order(callback.args[0], int(time()), on_complete=record_completion)
+        if not order:
+            return
+        escalator.remove(order[0])
+        # Выдачу нажимают в группе: trace берётся из самого заказа
+        bind_trace(order[14])
+        event("order.done", order_id=order[0], wait=order[11] - order[10])
+        await ticker.close(order[0])
+        # Кальян из корзины: в общем сообщении меняется только его кнопка.
+        # Соседи — по cart_id: пост в зону мог не дойти, а нажали под копией в general
+        items = await get_cart_orders(order[15]) if order[15] else []
+        if len(items) > 1:
+            fx.edit_markup(query.message.chat_id, query.message.message_id, cart_markup(items, int(time())))
+            return
+        # Как в корзине: от создания до выдачи. Повторное нажатие на выданный заказ не сдвигает отметку
+        elapsed = format_elapsed(order[10], order[11])
+    else:
+        # Кнопки, отправленные до появления таблицы orders: (user_id, timestamp)
+        elapsed = format_elapsed(callback.args[1])
 
-    ts = int(parts[3])
-    elapsed = format_elapsed(ts)
-
-    await query.edit_message_reply_markup(
-        reply_markup=InlineKeyboardMarkup([
-            [InlineKeyboardButton(f"Кальян отдан ({elapsed} назад)", callback_data="noop")]
-        ])
-    )
+    fx.edit_markup(query.message.chat_id, query.message.message_id, InlineKeyboardMarkup([
+        [InlineKeyboardButton(f"Кальян отдан ({elapsed} назад)", callback_data=encode(cb.NOOP))]
+    ]))
 
+@pipelined
 async def noop_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.callback_query.answer()
+    effects().answer(update.callback_query)
 
 # ----------- Отправка заказа -----------
 
+def order_summary(author, zone, table, items):
+    def fields(item):
+        aroma, strength, bowl, draft = (value or '❌ Не выбрано' for value in item)
+        return f"Ароматика: {aroma}\nКрепость: {strength}\nЧаша: {bowl}\nТяга: {draft}\n"
+
+    if len(items) == 1:
+        return f"Новый заказ от пользователя {author}:\nЗона: {zone}\nСтол: {table}\n" + fields(items[0])
+    # Корзина — одно сообщение на топик, кальяны пронумерованы так же, как кнопки под ним
+    return (
+        f"Новый заказ от пользователя {author} (кальянов: {len(items)}):\nЗона: {zone}\nСтол: {table}\n"
+        + "".join(f"\n{i}. " + fields(item) for i, item in enumerate(items, 1))
+    )
+
 async def send_order(update: Update, context: ContextTypes.DEFAULT_TYPE, from_quick=False):
-    data = context.user_data
-    table = data.get('table', '')
+    order = get_draft(context)
+    table = order.table or ''
     zone, topic_id = get_zone_and_topic_id(table)
     user_id = update.effective_user.id
     ts = int(time())
+    items = order.items() or [order.item()]
 
-    summary = (
-        f"Новый заказ от пользователя @{update.effective_user.username or update.effective_user.id}:\n"
-        f"Зона: {zone}\n"
-        f"Стол: {table}\n"
-        f"Ароматика: {data.get('aroma', '❌ Не выбрано')}\n"
-        f"Крепость: {data.get('strength', '❌ Не выбрано')}\n"
-        f"Чаша: {data.get('bowl', '❌ Не выбрано')}\n"
-        f"Тяга: {data.get('draft', '❌ Не выбрано')}\n"
-    )
+    summary = order_summary(f"@{update.effective_user.username or update.effective_user.id}", zone, table, items)
 
-    order_msg_id = context.user_data.get("order_msg_id")
-    chat_id = update.effective_chat.id if update.effective_chat else None
-    if not from_quick:
-        try:
-            if order_msg_id and chat_id:
-                await context.bot.edit_message_text(
-                    "Спасибо! Ваш заказ отправлен.",
-                    chat_id=chat_id,
-                    message_id=order_msg_id,
-                    reply_markup=InlineKeyboardMarkup([
-                        [InlineKeyboardButton("💾 Сохранить как шаблон", callback_data="save_as_template")],
-                        [InlineKeyboardButton("📝 Сделать заказ", callback_data="main_order")],
-                        [InlineKeyboardButton("⚡ Быстрый заказ", callback_data="quick_order_menu")]
-                    ])
-                )
-            elif hasattr(update, "callback_query") and update.callback_query:
-                await update.callback_query.edit_message_text(
-                    "Спасибо! Ваш заказ отправлен.",
-                    reply_markup=InlineKeyboardMarkup([
-                        [InlineKeyboardButton("💾 Сохранить как шаблон", callback_data="save_as_template")],
-                        [InlineKeyboardButton("📝 Сделать заказ", callback_data="main_order")],
-                        [InlineKeyboardButton("⚡ Быстрый заказ", callback_data="quick_order_menu")]
-                    ])
-                )
-        except Exception:
-            pass
-
-    # Отправляем заказ в основной топик (если есть)
-    order_buttons = InlineKeyboardMarkup([
-        [InlineKeyboardButton("Кальян отдан", callback_data=f"order_done_{user_id}_{ts}")]
-    ])
+    # Заказ и его отправка в топик зоны + дубль в general пишутся в outbox одной транзакцией,
+    # доставляет фоновый диспетчер: сбой сети или рестарт заказ не теряют
+    sends = []
     if topic_id is not None:
-        await context.bot.send_message(
-            chat_id=TARGET_CHAT_ID,
-            text=summary,
-            message_thread_id=topic_id,
-            reply_markup=order_buttons,
-            parse_mode=ParseMode.HTML
-        )
+        sends.append(dict(chat_id=TARGET_CHAT_ID, text=summary, message_thread_id=topic_id))
     else:
-        await context.bot.send_message(
-            chat_id=TARGET_CHAT_ID,
-            text=f"(Не определена тема для стола {table})\n" + summary,
-            reply_markup=order_buttons,
-            parse_mode=ParseMode.HTML
-        )
+        sends.append(dict(chat_id=TARGET_CHAT_ID, text=f"(Не определена тема для стола {table})\n" + summary))
 
     # Дублируем заказ в general, если это не он и если general определён
-    general_topic_id = TOPICS.get("general")
+    general_topic_id = router.topics.get("general")
     if general_topic_id is not None and topic_id != general_topic_id:
-        await context.bot.send_message(
-            chat_id=TARGET_CHAT_ID,
-            text=summary,
-            message_thread_id=general_topic_id,
-            reply_markup=order_buttons,
-            parse_mode=ParseMode.HTML
-        )
+        sends.append(dict(chat_id=TARGET_CHAT_ID, text=summary, message_thread_id=general_topic_id))
 
+    username = update.effective_user.username
+    order_event(context, "order.submit", zone=zone, table=table, hookahs=len(items))
+    trace = order.trace_id
+    if len(items) == 1:
+        order_ids = [await create_order(user_id, username, zone, table, *items[0], ts, sends=sends, trace_id=trace)]
+    else:
+        order_ids = await create_cart(user_id, username, zone, table, items, ts, sends, trace_id=trace)
+    order_id = order_ids[0]
+    event("order.send", order_ids=order_ids)
+    outbox.notify()
+    # Срок выдачи отсчитывается каждому кальяну; выдача снимает его в order_done_callback
+    for created_id in order_ids:
+        escalator.add(created_id, zone, table, ts)
+    for item in items:
+        aroma_suggestions.record(item[0], ts)
+    # Корзина ушла; в черновике остаётся последний кальян — его можно сохранить шаблоном
+    order.cart = ()
+    order.cart_index = None
+    order.set_item(items[-1])
+    # Следующий заказ из того же черновика — уже другой trace
+    order.trace_id = None
+
+    order_msg_id = order.order_msg_id
+    chat_id = update.effective_chat.id if update.effective_chat else None
+    if not from_quick:
+        message = update.callback_query.message if update.callback_query else None
+        if not (order_msg_id and chat_id) and message:
+            chat_id, order_msg_id = message.chat_id, message.message_id
+        if order_msg_id and chat_id:
+            effects().edit(chat_id, order_msg_id, "Спасибо! Ваш заказ отправлен.", ORDER_SENT_KEYBOARD)
+    return order_id
+
+def order_done_markup(order_id, wait=None):
+    # wait — сколько заказ уже ждёт; подставляет фоновый тикер
+    label = f"Кальян отдан (ждёт {wait})" if wait else "Кальян отдан"
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(label, callback_data=encode(cb.ORDER_DONE, order_id))]
+    ])
+
+def cart_markup(items, now=None):
+    # items — (order_id, created_at, status, completed_at) кальянов корзины по порядку; now — подписать ожидание
+    keyboard = []
+    for i, (order_id, created_at, status, completed_at) in enumerate(items, 1):
+        if status == "open":
+            label = f"{i}. Кальян отдан (ждёт {format_wait(now - created_at)})" if now else f"{i}. Кальян отдан"
+            keyboard.append([InlineKeyboardButton(label, callback_data=encode(cb.ORDER_DONE, order_id))])
+        else:
+            label = f"{i}. Кальян отдан ({format_elapsed(created_at, completed_at)} назад)"
+            keyboard.append([InlineKeyboardButton(label, callback_data=encode(cb.NOOP))])
+    return InlineKeyboardMarkup(keyboard)
+
+def delivery_markup(order_ids):
+    # Разметка для outbox: заказ или корзина, все кальяны ещё ждут
+    if len(order_ids) == 1:
+        return order_done_markup(order_ids[0])
+    return cart_markup([(order_id, None, "open", None) for order_id in order_ids])
+
+def live_markup(items, now):
+    # Разметка для тикера: items — кальяны одного сообщения
+    if len(items) == 1:
+        order_id, created_at, _, _ = items[0]
+        return order_done_markup(order_id, format_wait(now - created_at))
+    return cart_markup(items, now)
+
+@pipelined
 async def send_order_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await send_order(update, context, from_quick=False)
+    order = get_draft(context)
+    # Двойное нажатие в запаре: повтор того же состава с того же меню в топики второй раз не уходит
+    key = (update.effective_user.id, order.order_msg_id)
+    fingerprint = order.fingerprint()
+    order_id = submit_dedupe.duplicate_of(key, fingerprint)
+    if order_id is not None:
+        # trace заказа уже снят с черновика: повтор находится в журнале по номеру
+        event("order.duplicate", order_id=order_id)
+        effects().answer(update.callback_query, "Заказ уже отправлен")
+        return
+    effects().answer(update.callback_query)
+    # Стоп-лист мог пополниться, пока заказ собирался
+    blocked = list(dict.fromkeys(name for item in order.items() for name in stoplist.check(item[0])))
+    if blocked:
+        order_event(context, "order.blocked", aromas=blocked)
+        refresh_order_menu(
+            context, update.callback_query.message.chat_id, order.order_msg_id,
+            text=f"⛔ Нет в наличии: {', '.join(blocked)}. Измените ароматику."
+        )
+        return
+    await submit_dedupe.submit(key, fingerprint, lambda: send_order(update, context, from_quick=False))
+    submit_dedupe.extend(key, order.fingerprint())
+
+async def is_staff(bot, user_id):
+    if ADMIN_IDS:
+        return user_id in ADMIN_IDS
+    if not TARGET_CHAT_ID:
+        return False
+    try:
+        member = await bot.get_chat_member(TARGET_CHAT_ID, user_id)
+    except TelegramError:
+        return False
+    if member.status in (ChatMember.OWNER, ChatMember.ADMINISTRATOR, ChatMember.MEMBER):
+        return True
+    return member.status == ChatMember.RESTRICTED and member.is_member
+
+@pipelined
+async def stop_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # /stop — показать, /stop add Мята, Арбуз — добавить, /stop del Мята — убрать.
+    # Смотреть может любой (стоп-лист и так виден в отказе заказа), менять — только персонал
+    args = context.args or []
+    action = args[0].lower() if args else ""
+    items = [item.strip() for item in " ".join(args[1:]).split(",") if item.strip()]
+    if action in ("add", "del") and items:
+        if not await is_staff(context.bot, update.effective_user.id):
+            effects().send(update.message.chat_id, "Менять стоп-лист может только персонал.")
+            return
+        if action == "add":
+            await stoplist.edit(add=items)
+        else:
+            await stoplist.edit(remove=items)
+    elif action:
+        effects().send(update.message.chat_id, "Использование: /stop, /stop add Мята, Арбуз, /stop del Мята")
+        return
+    current = stoplist.items
+    text = "Стоп-лист:\n" + "\n".join(f"• {item}" for item in current) if current else "Стоп-лист пуст."
+    effects().send(update.message.chat_id, text)
+
+@pipelined
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    effects().send(update.message.chat_id, await stats_report())
 
+@pipelined
 async def to_menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    order_msg_id = context.user_data.get("order_msg_id")
-    context.user_data.clear()
-    if order_msg_id:
-        context.user_data["order_msg_id"] = order_msg_id
+    effects().answer(update.callback_query)
+    get_draft(context).reset_fields()
     await menu(update, context)
 
 # ----------- Быстрые заказы (шаблоны) -----------
 
+@pipelined
 async def quick_order_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    templates = await get_templates()
-    order_msg_id = context.user_data.get("order_msg_id")
+    fx = effects()
+    callback = decode(update.callback_query.data) if update.callback_query else None
+    if update.callback_query:
+        fx.answer(update.callback_query)
+    page = callback.args[0] if callback and callback.action == cb.QUICK_MENU else 0
+    templates, page_count = get_templates_page(page)
+    page = min(page, max(page_count - 1, 0))
+    order_msg_id = get_draft(context).order_msg_id
     chat_id = update.effective_chat.id if update.effective_chat else update.callback_query.message.chat_id
 
     if not templates:
-        try:
-            await context.bot.edit_message_text(
-                "Нет сохранённых быстрых заказов.",
-                chat_id=chat_id,
-                message_id=order_msg_id,
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("🔙 В меню", callback_data="to_menu")]
-                ])
-            )
-        except Exception:
-            pass
+        fx.edit(chat_id, order_msg_id, "Нет сохранённых быстрых заказов.", BACK_TO_MENU_KEYBOARD)
         return
 
     keyboard = [
-        [InlineKeyboardButton(label, callback_data=f"quick_order_apply_{tpl_id}")]
-        for tpl_id, label, *_ in templates
+        [InlineKeyboardButton(label, callback_data=encode(cb.QUICK_APPLY, tpl_id))]
+        for tpl_id, label in templates
     ]
-    keyboard.append([InlineKeyboardButton("🔙 В меню", callback_data="to_menu")])
-    try:
-        await context.bot.edit_message_text(
-            "Выберите шаблон для быстрого заказа:",
-            chat_id=chat_id,
-            message_id=order_msg_id,
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
-    except Exception:
-        pass
-
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("◀️", callback_data=encode(cb.QUICK_MENU, page - 1)))
+    if page < page_count - 1:
+        nav.append(InlineKeyboardButton("▶️", callback_data=encode(cb.QUICK_MENU, page + 1)))
+    if nav:
+        keyboard.append(nav)
+    keyboard.append([InlineKeyboardButton("🔙 В меню", callback_data=encode(cb.TO_MENU))])
+    text = "Выберите шаблон для быстрого заказа:"
+    if page_count > 1:
+        text += f" (стр. {page + 1}/{page_count})"
+    fx.edit(chat_id, order_msg_id, text, InlineKeyboardMarkup(keyboard))
+
+@pipelined
 async def quick_order_apply(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    tpl_id = int(update.callback_query.data.replace("quick_order_apply_", ""))
+    effects().answer(update.callback_query)
+    callback = decode(update.callback_query.data)
+    if callback is None:
+        return ConversationHandler.END
+    return await apply_template(update, context, callback.args[0], update.callback_query.message.chat_id)
+
+async def apply_template(update: Update, context: ContextTypes.DEFAULT_TYPE, tpl_id, chat_id):
+    # Общий путь для кнопки меню быстрых заказов и для выбора в inline-поиске
     tpl = await get_template_by_id(tpl_id)
-    order_msg_id = context.user_data.get("order_msg_id")
-    chat_id = update.callback_query.message.chat_id
+    order = get_draft(context)
+    order_msg_id = order.order_msg_id
 
     if not tpl:
-        try:
-            await context.bot.edit_message_text(
-                "Шаблон не найден.",
-                chat_id=chat_id,
-                message_id=order_msg_id,
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("🔙 В меню", callback_data="to_menu")]
-                ])
-            )
-        except Exception:
-            pass
+        effects().edit(chat_id, order_msg_id, "Шаблон не найден.", BACK_TO_MENU_KEYBOARD)
         return ConversationHandler.END
 
     _, label, aroma, strength, bowl, draft = tpl
-    context.user_data.clear()
-    if order_msg_id:
-        context.user_data["order_msg_id"] = order_msg_id
-
-    context.user_data["aroma"] = aroma
-    context.user_data["strength"] = strength
-    context.user_data["bowl"] = bowl
-    context.user_data["draft"] = draft
-
-    if not context.user_data.get("table"):
-        context.user_data["edit_field"] = "table"
-        context.user_data["from_quick"] = True
-        try:
-            await context.bot.edit_message_text(
-                "Введите номер стола:",
-                chat_id=chat_id,
-                message_id=order_msg_id,
-                reply_markup=None
-            )
-        except Exception:
-            pass
+    blocked = stoplist.check(aroma)
+    if blocked:
+        effects().edit(
+            chat_id, order_msg_id,
+            f"⛔ Шаблон '{label}' сейчас недоступен, нет в наличии: {', '.join(blocked)}",
+            BACK_TO_MENU_KEYBOARD
+        )
+        return ConversationHandler.END
+
+    order.reset_fields()
+    order.set_item((aroma, strength, bowl, draft))
+    order.trace_id = new_trace()
+    order_event(context, "order.template", template_id=tpl_id)
+
+    if not order.table:
+        order.edit_field = "table"
+        order.from_quick = True
+        effects().edit(chat_id, order_msg_id, "Введите номер стола:")
         return TABLE
     else:
         await send_order(update, context, from_quick=True)
-        context.user_data.clear()
-        if order_msg_id:
-            context.user_data["order_msg_id"] = order_msg_id
+        order.reset_fields()
         await menu(update, context)
         return ConversationHandler.END
 
+def template_summary(tpl):
+    _, label, aroma, strength, bowl, draft = tpl
+    return " · ".join(value for value in (aroma, strength, bowl, draft) if value)
+
+@pipelined
+async def inline_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # @бот иван — поиск по подписи и ароматике шаблонов, выдача листается по offset
+    query = update.inline_query
+    offset = int(query.offset) if query.offset.isdigit() else 0
+    templates = await search_templates(query.query, offset)
+    results = [
+        InlineQueryResultArticle(
+            id=str(tpl[0]),
+            title=tpl[1],
+            description=template_summary(tpl),
+            input_message_content=InputTextMessageContent(f"{INLINE_PICK_PREFIX}{tpl[0]}: {tpl[1]}"),
+        )
+        for tpl in templates
+    ]
+    next_offset = str(offset + len(templates)) if len(templates) == TEMPLATES_SEARCH_LIMIT else ""
+    effects().answer(query, results, cache_time=INLINE_CACHE_TIME, next_offset=next_offset)
+
+@pipelined
+async def inline_template_pick(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    message = update.message
+    if message.via_bot is None or message.via_bot.id != context.bot.id:
+        return None
+    tpl_id = int(context.matches[0].group(1))
+
+    # Удалить сообщение пользователя
+    effects().delete(message)
+
+    # Без открытого меню показывать подсказку негде — отправляем его заново
+    if not get_draft(context).order_msg_id:
+        await menu(update, context)
+    return await apply_template(update, context, tpl_id, message.chat_id)
+
+@pipelined
 async def save_as_template(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.callback_query.answer()
-    order_msg_id = context.user_data.get("order_msg_id")
+    effects().answer(update.callback_query)
+    order_msg_id = get_draft(context).order_msg_id
     chat_id = update.callback_query.message.chat_id
-    try:
-        await context.bot.edit_message_text(
-            "Введите подпись для шаблона (например, ФИО гостя):",
-            chat_id=chat_id,
-            message_id=order_msg_id,
-            reply_markup=None
-        )
-    except Exception:
-        pass
+    effects().edit(chat_id, order_msg_id, "Введите подпись для шаблона (например, ФИО гостя):")
     return SAVE_TEMPLATE_LABEL
 
+@pipelined
 async def save_template_label(update: Update, context: ContextTypes.DEFAULT_TYPE):
     label = update.message.text
-    aroma = context.user_data.get("aroma")
-    strength = context.user_data.get("strength")
-    bowl = context.user_data.get("bowl")
-    draft = context.user_data.get("draft")
-    await save_template(label, aroma, strength, bowl, draft)
-
-    # Удалить сообщение пользователя
-    try:
-        await update.message.delete()
-    except Exception:
-        pass
+    order = get_draft(context)
+    # Удаление сообщения пользователя не ждёт записи шаблона в базу
+    effects().delete(update.message)
+    await save_template(label, *order.item())
 
-    order_msg_id = context.user_data.get("order_msg_id")
     chat_id = update.effective_chat.id
-    try:
-        await context.bot.edit_message_text(
-            f"Шаблон '{label}' сохранён!",
-            chat_id=chat_id,
-            message_id=order_msg_id
-        )
-    except Exception:
-        pass
-    order_msg_id = context.user_data.get("order_msg_id")
-    context.user_data.clear()
-    if order_msg_id:
-        context.user_data["order_msg_id"] = order_msg_id
+    effects().edit(chat_id, order.order_msg_id, f"Шаблон '{label}' сохранён!")
+    order.reset_fields()
     await menu(update, context)
     return ConversationHandler.END
 
 # --- ASYNC INIT FOR TELEGRAM PTB ---
 
 async def post_init(application: Application):
+    event_log.start()
     await init_db()
+    await aroma_suggestions.start()
+    # В режиме webhook /metrics отдаёт тот же aiohttp-сервер
+    if BOT_MODE != "webhook":
+        await metrics_server.start()
+    await router.start()
+    await stoplist.start()
+    await dispatcher.start()
+    await outbox.start(application.bot, delivery_markup)
+    ticker.start(application.job_queue, application.bot, TARGET_CHAT_ID, live_markup)
+    await escalator.start(application.bot, TARGET_CHAT_ID)
+    await backfill()
+    if BACKLOG_DRAIN:
+        # Накопленное за простой забираем пачкой и схлопываем до старта приёма апдейтов.
+        # Пока висит webhook, getUpdates недоступен — снимаем его, serve_webhook поставит заново
+        if BOT_MODE == "webhook" and WEBHOOK_URL:
+            await application.bot.delete_webhook()
+        if BOT_MODE != "webhook" or WEBHOOK_URL:
+            await backlog_drain.start(application)
+    shift_summary.start(application.job_queue, application.bot, TARGET_CHAT_ID, lambda: router.topics.get("general"))
+    await idle_sweeper.start(application)
+
+async def post_stop(application: Application):
+    # Дожидаемся очереди, пока HTTP-клиент бота ещё открыт
+    await backlog_drain.stop()
+    await idle_sweeper.stop()
+    ticker.stop()
+    await escalator.stop()
+    shift_summary.stop()
+    await outbox.stop()
+    await dispatcher.stop()
+    await router.stop()
+    await stoplist.stop()
+    await aroma_suggestions.stop()
+
+async def post_shutdown(application: Application):
+    await metrics_server.stop()
+    await close_db()
+    event_log.stop()
+
+async def log_error(update, context: ContextTypes.DEFAULT_TYPE):
+    # Без своего обработчика PTB пишет ошибку через logging — без trace заказа и полей апдейта
+    update_id = update.update_id if isinstance(update, Update) else None
+    logger.opt(exception=context.error).error("handler failed", event="error", update_id=update_id)
+
+def build_application(builder=None):
+    # builder можно подменить: нагрузочный стенд направляет бота на локальную подделку Bot API
+    if builder is None:
+        builder = Application.builder().token(TOKEN)
+    if UPDATE_CONCURRENCY > 1:
+        # Разные сотрудники обрабатываются параллельно, нажатия одного — строго по очереди
+        builder = builder.concurrent_updates(PerUserUpdateProcessor())
+    app = (
+        builder
+        .request(MetricsRequest(connection_pool_size=256))
+        .persistence(SQLitePersistence())
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
-def main():
-    app = Application.builder().token(TOKEN).post_init(post_init).build()
-
+    app.add_handler(TypeHandler(Update, bind_order_trace), group=-2)
+    app.add_handler(TypeHandler(Update, track_activity), group=-1)
     app.add_handler(CommandHandler(['menu', 'start'], menu))
-    app.add_handler(CallbackQueryHandler(start_order, pattern="^main_order$"))
-    app.add_handler(CallbackQueryHandler(send_order_callback, pattern="^send_order$"))
-    app.add_handler(CallbackQueryHandler(to_menu_callback, pattern="^to_menu$"))
-    app.add_handler(CallbackQueryHandler(order_done_callback, pattern=r"^order_done_"))
-    app.add_handler(CallbackQueryHandler(noop_callback, pattern="^noop$"))
-
-    # Быстрые заказы
-    app.add_handler(CallbackQueryHandler(quick_order_menu, pattern="^quick_order_menu$"))
+    app.add_handler(CommandHandler('stop', stop_command))
+    app.add_handler(CommandHandler('stats', stats_command))
+    # Все колбэки верхнего уровня — через одну таблицу действий вместо цепочки regex
+    dispatch_callback, top_level = make_dispatcher({
+        cb.MAIN_ORDER: start_order,
+        cb.SEND_ORDER: send_order_callback,
+        cb.TO_MENU: to_menu_callback,
+        cb.ORDER_DONE: order_done_callback,
+        cb.ORDER_DONE_LEGACY: order_done_callback,
+        cb.NOOP: noop_callback,
+        cb.QUICK_MENU: quick_order_menu,
+        cb.CART_ADD: cart_add_callback,
+        cb.CART_EDIT: cart_edit_callback,
+    })
+    app.add_handler(CallbackQueryHandler(dispatch_callback, pattern=top_level))
+    # Шаблоны содержат имена гостей, поэтому ищем только в личке с ботом
+    app.add_handler(InlineQueryHandler(inline_search, chat_types=[Chat.SENDER]))
 
     order_conv = ConversationHandler(
         entry_points=[
-            CallbackQueryHandler(edit_field, pattern=r"^edit_"),
-            CallbackQueryHandler(bowl_choice, pattern=r"^bowl_.*|bowl_manual$"),
-            CallbackQueryHandler(save_as_template, pattern="^save_as_template$"),
-            CallbackQueryHandler(quick_order_apply, pattern="^quick_order_apply_"),
-            CallbackQueryHandler(save_strength_callback, pattern=r"^strength_"),
-            CallbackQueryHandler(save_draft_callback, pattern=r"^draft_"),
+            CallbackQueryHandler(edit_field, pattern=matches(cb.EDIT)),
+            CallbackQueryHandler(bowl_choice, pattern=matches(cb.BOWL, cb.BOWL_MANUAL)),
+            CallbackQueryHandler(save_as_template, pattern=matches(cb.SAVE_AS_TEMPLATE)),
+            CallbackQueryHandler(quick_order_apply, pattern=matches(cb.QUICK_APPLY)),
+            MessageHandler(
+                filters.ChatType.PRIVATE & filters.VIA_BOT & filters.Regex(INLINE_PICK_PATTERN),
+                inline_template_pick
+            ),
+            CallbackQueryHandler(save_strength_callback, pattern=matches(cb.STRENGTH)),
+            CallbackQueryHandler(save_draft_callback, pattern=matches(cb.DRAFT)),
+            CallbackQueryHandler(save_aroma_callback, pattern=matches(cb.AROMA)),
         ],
         states={
             TABLE: [MessageHandler(filters.TEXT & ~filters.COMMAND, save_table_field)],
-            AROMA: [MessageHandler(filters.TEXT & ~filters.COMMAND, save_field)],
-            STRENGTH: [CallbackQueryHandler(save_strength_callback, pattern=r"^strength_")],
+            AROMA: [
+                CallbackQueryHandler(save_aroma_callback, pattern=matches(cb.AROMA)),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, save_field)
+            ],
+            STRENGTH: [CallbackQueryHandler(save_strength_callback, pattern=matches(cb.STRENGTH))],
             BOWL: [
-                CallbackQueryHandler(bowl_choice, pattern=r"^bowl_.*|bowl_manual$"),
+                CallbackQueryHandler(bowl_choice, pattern=matches(cb.BOWL, cb.BOWL_MANUAL)),
                 MessageHandler(filters.TEXT & ~filters.COMMAND, save_manual_bowl)
             ],
-            DRAFT: [CallbackQueryHandler(save_draft_callback, pattern=r"^draft_")],
+            DRAFT: [CallbackQueryHandler(save_draft_callback, pattern=matches(cb.DRAFT))],
             MANUAL_BOWL: [MessageHandler(filters.TEXT & ~filters.COMMAND, save_manual_bowl)],
             SAVE_TEMPLATE_LABEL: [MessageHandler(filters.TEXT & ~filters.COMMAND, save_template_label)],
         },
         fallbacks=[CommandHandler('cancel', menu)],
-        allow_reentry=True
+        allow_reentry=True,
+        name="order_conv",
+        persistent=True
     )
     app.add_handler(order_conv)
+    app.add_error_handler(log_error)
+    instrument_handlers(app)
+    return app
 
-    app.run_polling()
+def main():
+    app = build_application()
+    if BOT_MODE == "webhook":
+        asyncio.run(serve_webhook(app))
+    else:
+        app.run_polling()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,235 @@
+import os
+import itertools
+from collections import OrderedDict, namedtuple
+from functools import lru_cache
+from time import monotonic
+
+CALLBACK_STORE_SIZE = int(os.getenv("CALLBACK_STORE_SIZE", "10000"))
+CALLBACK_STORE_TTL = float(os.getenv("CALLBACK_STORE_TTL", str(24 * 3600)))
+
+# Лимит Telegram на callback_data — 64 байта в UTF-8
+MAX_CALLBACK_BYTES = 64
+VERSION = "1"
+SEP = ":"
+DIGITS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+
+# Код действия — один символ; коды не переиспользуем, иначе старые кнопки в чатах сменят смысл
+MAIN_ORDER = "a"
+SEND_ORDER = "b"
+TO_MENU = "c"
+ORDER_DONE = "d"
+ORDER_DONE_LEGACY = "e"
+NOOP = "f"
+QUICK_MENU = "g"
+QUICK_APPLY = "h"
+EDIT = "i"
+BOWL = "j"
+BOWL_MANUAL = "k"
+SAVE_AS_TEMPLATE = "l"
+STRENGTH = "m"
+DRAFT = "n"
+AROMA = "o"
+CART_ADD = "p"
+CART_EDIT = "q"
+
+Callback = namedtuple("Callback", "action args")
+_Ref = namedtuple("_Ref", "key")
+
+
+class _Unresolved(Callback):
+    # Среди аргументов есть ссылки в хранилище
+    __slots__ = ()
+
+
+def to_base(num):
+    if num == 0:
+        return "0"
+    sign = "-" if num < 0 else ""
+    num = abs(num)
+    out = []
+    while num:
+        num, rem = divmod(num, len(DIGITS))
+        out.append(DIGITS[rem])
+    return sign + "".join(reversed(out))
+
+
+def from_base(text):
+    sign = -1 if text.startswith("-") else 1
+    num = 0
+    for ch in text.lstrip("-"):
+        num = num * len(DIGITS) + DIGITS.index(ch)
+    return sign * num
+
+
+class PayloadStore:
+    # Значения, которые не влезают в callback_data, живут здесь: LRU с ограничением по размеру и TTL
+    def __init__(self, size=CALLBACK_STORE_SIZE, ttl=CALLBACK_STORE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._keys = {}
+        self._ids = itertools.count(1)
+
+    def put(self, value):
+        key = self._keys.get(value)
+        if key is not None and key in self._items:
+            self._items[key] = (value, monotonic())
+            self._items.move_to_end(key)
+            return key
+        key = next(self._ids)
+        self._items[key] = (value, monotonic())
+        self._keys[value] = key
+        while len(self._items) > self.size:
+            _, (old, _) = self._items.popitem(last=False)
+            self._keys.pop(old, None)
+        return key
+
+    def get(self, key):
+        item = self._items.get(key)
+        if item is None:
+            return None
+        value, stored = item
+        if monotonic() - stored > self.ttl:
+            del self._items[key]
+            self._keys.pop(value, None)
+            return None
+        return value
+
+
+payload_store = PayloadStore()
+
+
+def _encode_arg(arg, inline=True):
+    if isinstance(arg, bool) or not isinstance(arg, (int, str)):
+        raise TypeError(f"Неподдерживаемый аргумент callback: {arg!r}")
+    if isinstance(arg, int):
+        return "#" + to_base(arg)
+    if inline and SEP not in arg:
+        return "'" + arg
+    return "@" + to_base(payload_store.put(arg))
+
+
+def encode(action, *args):
+    parts = [_encode_arg(arg) for arg in args]
+    data = SEP.join([VERSION + action, *parts])
+    if len(data) <= MAX_CALLBACK_BYTES // 4 or len(data.encode()) <= MAX_CALLBACK_BYTES:
+        return data
+    # Длинные строки по одной (начиная с самой длинной) уносим в хранилище, пока не влезет
+    for i in sorted(range(len(args)), key=lambda i: -len(parts[i])):
+        if len(data.encode()) <= MAX_CALLBACK_BYTES:
+            break
+        if isinstance(args[i], str):
+            parts[i] = _encode_arg(args[i], inline=False)
+            data = SEP.join([VERSION + action, *parts])
+    if len(data.encode()) > MAX_CALLBACK_BYTES:
+        raise ValueError(f"callback_data длиннее {MAX_CALLBACK_BYTES} байт: {data!r}")
+    return data
+
+
+def _parse_arg(part):
+    tag, body = part[:1], part[1:]
+    if tag == "#":
+        return from_base(body)
+    if tag == "'":
+        return body
+    if tag == "@":
+        return _Ref(from_base(body))
+    raise ValueError(part)
+
+
+# Строки старого формата: кнопки, уже висящие в чатах, должны продолжать работать
+LEGACY_EXACT = {
+    "main_order": Callback(MAIN_ORDER, ()),
+    "send_order": Callback(SEND_ORDER, ()),
+    "to_menu": Callback(TO_MENU, ()),
+    "noop": Callback(NOOP, ()),
+    "quick_order_menu": Callback(QUICK_MENU, (0,)),
+    "bowl_manual": Callback(BOWL_MANUAL, ()),
+    "save_as_template": Callback(SAVE_AS_TEMPLATE, ()),
+}
+LEGACY_PREFIXES = [
+    ("quick_order_apply_", QUICK_APPLY, int),
+    ("quick_order_page_", QUICK_MENU, int),
+    ("edit_", EDIT, str),
+    ("strength_", STRENGTH, str),
+    ("draft_", DRAFT, str),
+    ("bowl_", BOWL, str),
+]
+
+
+def _parse_legacy(data):
+    if data in LEGACY_EXACT:
+        return LEGACY_EXACT[data]
+    if data.startswith("order_done_"):
+        parts = data.split("_")
+        if len(parts) == 3:
+            return Callback(ORDER_DONE, (int(parts[2]),))
+        if len(parts) == 4:
+            return Callback(ORDER_DONE_LEGACY, (int(parts[2]), int(parts[3])))
+        return None
+    for prefix, action, cast in LEGACY_PREFIXES:
+        if data.startswith(prefix):
+            return Callback(action, (cast(data[len(prefix):]),))
+    return None
+
+
+@lru_cache(maxsize=4096)
+def _parse(data):
+    try:
+        if data[:1] == VERSION:
+            head, *parts = data.split(SEP)
+            args = tuple(_parse_arg(part) for part in parts)
+            if any(isinstance(arg, _Ref) for arg in args):
+                return _Unresolved(head[1:], args)
+            return Callback(head[1:], args)
+        return _parse_legacy(data)
+    except (ValueError, IndexError):
+        return None
+
+
+def decode(data):
+    # None — данные не распознаны или значение из хранилища уже вытеснено
+    if not data:
+        return None
+    callback = _parse(data)
+    if type(callback) is not _Unresolved:
+        return callback
+    args = []
+    for arg in callback.args:
+        if isinstance(arg, _Ref):
+            arg = payload_store.get(arg.key)
+            if arg is None:
+                return None
+        args.append(arg)
+    return Callback(callback.action, tuple(args))
+
+
+def action_of(data):
+    # Только код действия: ссылки в хранилище не разрешаются, поэтому работает и после рестарта
+    callback = _parse(data) if isinstance(data, str) else None
+    return callback.action if callback is not None else None
+
+
+def matches(*actions):
+    # Предикат для CallbackQueryHandler(pattern=...): разбор кэшируется, проверка — поиск в множестве
+    actions = frozenset(actions)
+
+    def check(data):
+        callback = _parse(data) if isinstance(data, str) else None
+        return callback is not None and callback.action in actions
+
+    return check
+
+
+def make_dispatcher(table):
+    # Один обработчик на все действия верхнего уровня вместо цепочки regex-паттернов
+    async def dispatch(update, context):
+        callback = decode(update.callback_query.data)
+        if callback is None:
+            await update.callback_query.answer()
+            return None
+        return await table[callback.action](update, context)
+
+    # Таблица открыта наружу: инструментирование оборачивает каждое действие отдельно
+    dispatch.table = table
+    return dispatch, matches(*table)
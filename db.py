@@ -0,0 +1,488 @@
+import os
+import re
+import json
+import asyncio
+from itertools import islice
+from contextlib import asynccontextmanager
+
+import aiosqlite
+
+from metrics import timed_query
+
+DB_FILE = "templates.db"
+DB_READERS = int(os.getenv("DB_READERS", "2"))
+TEMPLATES_PAGE_SIZE = int(os.getenv("TEMPLATES_PAGE_SIZE", "8"))
+# Сколько шаблонов отдаём на одну страницу inline-выдачи (Telegram принимает до 50)
+TEMPLATES_SEARCH_LIMIT = int(os.getenv("TEMPLATES_SEARCH_LIMIT", "20"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS templates (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    label TEXT NOT NULL,
+    aroma TEXT,
+    strength TEXT,
+    bowl TEXT,
+    draft TEXT
+);
+
+-- Поиск шаблонов для inline-режима: подпись и ароматика, префиксные индексы под набор с клавиатуры.
+-- unicode61 сам приводит регистр и кириллицу, а ё/е сводим в триггерах (и в запросе)
+CREATE VIRTUAL TABLE IF NOT EXISTS templates_fts USING fts5(
+    label, aroma, tokenize = 'unicode61 remove_diacritics 2', prefix = '1 2 3'
+);
+CREATE TRIGGER IF NOT EXISTS templates_fts_insert AFTER INSERT ON templates BEGIN
+    INSERT INTO templates_fts (rowid, label, aroma) VALUES (
+        new.id,
+        replace(replace(new.label, 'ё', 'е'), 'Ё', 'Е'),
+        replace(replace(coalesce(new.aroma, ''), 'ё', 'е'), 'Ё', 'Е')
+    );
+END;
+CREATE TRIGGER IF NOT EXISTS templates_fts_update AFTER UPDATE OF label, aroma ON templates BEGIN
+    UPDATE templates_fts SET
+        label = replace(replace(new.label, 'ё', 'е'), 'Ё', 'Е'),
+        aroma = replace(replace(coalesce(new.aroma, ''), 'ё', 'е'), 'Ё', 'Е')
+    WHERE rowid = new.id;
+END;
+CREATE TRIGGER IF NOT EXISTS templates_fts_delete AFTER DELETE ON templates BEGIN
+    DELETE FROM templates_fts WHERE rowid = old.id;
+END;
+
+CREATE TABLE IF NOT EXISTS orders (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER,
+    username TEXT,
+    zone TEXT NOT NULL,
+    table_number TEXT,
+    aroma TEXT,
+    strength TEXT,
+    bowl TEXT,
+    draft TEXT,
+    status TEXT NOT NULL DEFAULT 'open',
+    created_at INTEGER NOT NULL,
+    completed_at INTEGER,
+    zone_message_id INTEGER,
+    general_message_id INTEGER,
+    escalated INTEGER NOT NULL DEFAULT 0,
+    trace_id TEXT,
+    cart_id INTEGER
+);
+-- "открытые заказы зоны X" и "выполненные за сегодня" идут по индексам, без сканирования истории
+CREATE INDEX IF NOT EXISTS idx_orders_zone_status_created ON orders (zone, status, created_at);
+CREATE INDEX IF NOT EXISTS idx_orders_status_completed ON orders (status, completed_at);
+CREATE INDEX IF NOT EXISTS idx_orders_zone_message ON orders (zone_message_id);
+
+-- Outbox: заказ и его отправка пишутся одной транзакцией, доставляет фоновый диспетчер
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    order_id INTEGER NOT NULL,
+    idempotency_key TEXT NOT NULL UNIQUE,
+    payload TEXT NOT NULL,
+    sent TEXT NOT NULL DEFAULT '{}',
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created_at INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_status_next ON outbox (status, next_attempt_at);
+
+-- Состояние PTB: черновики заказов и шаги ConversationHandler переживают рестарт контейнера
+CREATE TABLE IF NOT EXISTS user_data (
+    user_id INTEGER PRIMARY KEY,
+    data BLOB NOT NULL,
+    updated_at INTEGER NOT NULL
+);
+
+-- Накопительная статистика времени выдачи: строка на (час|день, зона, крепость), отчёт не сканирует orders
+CREATE TABLE IF NOT EXISTS order_stats (
+    period TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    zone TEXT NOT NULL,
+    strength TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    total INTEGER NOT NULL,
+    sketch TEXT NOT NULL,
+    PRIMARY KEY (period, bucket, zone, strength)
+);
+
+-- Затухающие счётчики ароматик для подсказок: score — вес на момент updated_at
+CREATE TABLE IF NOT EXISTS aroma_stats (
+    key TEXT PRIMARY KEY,
+    display TEXT NOT NULL,
+    score REAL NOT NULL,
+    updated_at INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS conversations (
+    name TEXT NOT NULL,
+    key TEXT NOT NULL,
+    state BLOB NOT NULL,
+    PRIMARY KEY (name, key)
+);
+"""
+
+# SQL держим константами: sqlite3 кэширует подготовленные выражения по тексту запроса
+SQL_INSERT_TEMPLATE = "INSERT INTO templates (label, aroma, strength, bowl, draft) VALUES (?, ?, ?, ?, ?)"
+SQL_SELECT_TEMPLATES = "SELECT id, label, aroma, strength, bowl, draft FROM templates"
+SQL_SELECT_TEMPLATE = "SELECT id, label, aroma, strength, bowl, draft FROM templates WHERE id = ?"
+# Подпись весит больше ароматики: "иван" должен находить Ивана, а не "Ивановскую мяту"
+SQL_SEARCH_TEMPLATES = (
+    "SELECT rowid FROM templates_fts WHERE templates_fts MATCH ? "
+    "ORDER BY bm25(templates_fts, 10.0, 1.0) LIMIT ? OFFSET ?"
+)
+# Одна буква совпадает с доброй частью базы: ранжировать её бессмысленно и дорого, отдаём свежие
+SQL_SEARCH_TEMPLATES_RECENT = (
+    "SELECT rowid FROM templates_fts WHERE templates_fts MATCH ? ORDER BY rowid DESC LIMIT ? OFFSET ?"
+)
+SQL_HAS_TEMPLATES_FTS = "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'templates_fts'"
+# Столбцы orders, появившиеся позже самой таблицы: в старую базу добавляются при открытии
+SQL_ORDERS_COLUMNS = "SELECT name FROM pragma_table_info('orders')"
+ORDERS_ADDED_COLUMNS = {
+    "escalated": "INTEGER NOT NULL DEFAULT 0",  # напоминания о просрочке
+    "trace_id": "TEXT",  # журнал событий
+    "cart_id": "INTEGER",  # корзины
+}
+# Кальяны одной корзины находят соседей по cart_id (id первого из них), а не по сообщению в топике:
+# пост в зону может ещё повторяться или не дойти вовсе, а копия в general уже с кнопками.
+# Индекс создаётся после миграции: в старой базе столбца до неё нет
+SQL_CREATE_CART_INDEX = "CREATE INDEX IF NOT EXISTS idx_orders_cart ON orders (cart_id)"
+# Корзины, доставленные до появления cart_id, узнаются по общему сообщению в зоне
+SQL_FILL_CART_IDS = (
+    "UPDATE orders SET cart_id = (SELECT MIN(id) FROM orders AS o WHERE o.zone_message_id = orders.zone_message_id) "
+    "WHERE zone_message_id IN (SELECT zone_message_id FROM orders WHERE zone_message_id IS NOT NULL "
+    "GROUP BY zone_message_id HAVING COUNT(*) > 1)"
+)
+# Индекс для базы, где шаблоны появились раньше поиска; дальше его ведут триггеры
+SQL_FILL_TEMPLATES_FTS = (
+    "INSERT INTO templates_fts (rowid, label, aroma) SELECT id, "
+    "replace(replace(label, 'ё', 'е'), 'Ё', 'Е'), "
+    "replace(replace(coalesce(aroma, ''), 'ё', 'е'), 'Ё', 'Е') FROM templates"
+)
+
+SQL_INSERT_ORDER = (
+    "INSERT INTO orders (user_id, username, zone, table_number, aroma, strength, bowl, draft, created_at, trace_id) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+SQL_SET_ORDER_MESSAGES = "UPDATE orders SET zone_message_id = ?, general_message_id = ? WHERE id = ?"
+# Пост ушёл: его сообщение записывается сразу, не дожидаясь второго поста строки outbox
+SQL_SET_ORDER_ZONE_MESSAGE = "UPDATE orders SET zone_message_id = ? WHERE id = ?"
+SQL_SET_ORDER_GENERAL_MESSAGE = "UPDATE orders SET general_message_id = ? WHERE id = ?"
+SQL_SET_CART_ID = "UPDATE orders SET cart_id = ? WHERE id = ?"
+SQL_COMPLETE_ORDER = "UPDATE orders SET status = 'done', completed_at = ? WHERE id = ? AND status = 'open'"
+SQL_SELECT_ORDER = (
+    "SELECT id, user_id, username, zone, table_number, aroma, strength, bowl, draft, status, created_at, "
+    "completed_at, zone_message_id, general_message_id, trace_id, cart_id FROM orders WHERE id = ?"
+)
+SQL_SELECT_OPEN_ORDERS = (
+    "SELECT id, table_number, created_at, zone_message_id, general_message_id FROM orders "
+    "WHERE zone = ? AND status = 'open' ORDER BY created_at"
+)
+# Невыданные кальяны и уже выданные соседи их корзин — для живого таймера ожидания.
+# Оба условия идут по индексам: OR в SQLite разбивается на два поиска
+SQL_SELECT_ACTIVE_ORDERS = (
+    "SELECT id, created_at, zone_message_id, general_message_id, status, completed_at FROM orders "
+    "WHERE status = 'open' OR cart_id IN (SELECT cart_id FROM orders WHERE status = 'open' AND cart_id IS NOT NULL) "
+    "ORDER BY id"
+)
+SQL_SELECT_CART_ORDERS = (
+    "SELECT id, created_at, status, completed_at FROM orders WHERE cart_id = ? ORDER BY id"
+)
+# Невыданные заказы для напоминаний о просрочке: escalated — сколько напоминаний уже ушло (0, 1 или 2)
+SQL_SELECT_SLA_ORDERS = (
+    "SELECT id, zone, table_number, created_at, escalated FROM orders "
+    "WHERE status = 'open' AND escalated < 2 AND created_at >= ?"
+)
+SQL_SET_ORDER_ESCALATED = "UPDATE orders SET escalated = ? WHERE id = ?"
+SQL_SELECT_COMPLETED_SINCE = (
+    "SELECT id, zone, table_number, created_at, completed_at FROM orders "
+    "WHERE status = 'done' AND completed_at >= ? ORDER BY completed_at"
+)
+
+SQL_INSERT_OUTBOX = "INSERT INTO outbox (order_id, idempotency_key, payload, created_at) VALUES (?, ?, ?, ?)"
+SQL_SELECT_DUE_OUTBOX = (
+    "SELECT id, order_id, idempotency_key, payload, sent, attempts, "
+    "(SELECT trace_id FROM orders WHERE orders.id = outbox.order_id) FROM outbox "
+    "WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY id LIMIT ?"
+)
+SQL_SELECT_NEXT_OUTBOX_DUE = "SELECT MIN(next_attempt_at) FROM outbox WHERE status = 'pending'"
+# Пост заказа ушёл: отмечаем сразу, не дожидаясь остальных постов строки
+SQL_SET_OUTBOX_SENT = "UPDATE outbox SET sent = ? WHERE id = ?"
+SQL_UPDATE_OUTBOX = (
+    "UPDATE outbox SET status = ?, sent = ?, attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?"
+)
+
+
+# Один писатель и небольшой пул читателей поверх одного файла в режиме WAL
+class Database:
+    def __init__(self, path=DB_FILE, readers=DB_READERS):
+        self.path = path
+        self.readers_count = max(1, readers)
+        self._writer = None
+        self._write_lock = asyncio.Lock()
+        self._readers = asyncio.Queue()
+        self._connections = []
+
+    async def _connect(self):
+        conn = await aiosqlite.connect(self.path)
+        await conn.execute("PRAGMA journal_mode=WAL")
+        await conn.execute("PRAGMA synchronous=NORMAL")
+        await conn.execute("PRAGMA busy_timeout=5000")
+        self._connections.append(conn)
+        return conn
+
+    async def open(self):
+        if self._writer is not None:
+            return
+        # Lock привязывается к циклу событий: база, открытая заново в другом цикле (тесты), берёт новый
+        self._write_lock = asyncio.Lock()
+        self._writer = await self._connect()
+        async with self._writer.execute(SQL_HAS_TEMPLATES_FTS) as cursor:
+            has_fts = await cursor.fetchone() is not None
+        await self._writer.executescript(SCHEMA)
+        if not has_fts:
+            await self._writer.execute(SQL_FILL_TEMPLATES_FTS)
+        async with self._writer.execute(SQL_ORDERS_COLUMNS) as cursor:
+            columns = {row[0] for row in await cursor.fetchall()}
+        for name, definition in ORDERS_ADDED_COLUMNS.items():
+            if name not in columns:
+                await self._writer.execute(f"ALTER TABLE orders ADD COLUMN {name} {definition}")
+        if "cart_id" not in columns:
+            await self._writer.execute(SQL_FILL_CART_IDS)
+        await self._writer.execute(SQL_CREATE_CART_INDEX)
+        await self._writer.commit()
+        for _ in range(self.readers_count):
+            self._readers.put_nowait(await self._connect())
+
+    async def close(self):
+        for conn in self._connections:
+            try:
+                await conn.close()
+            except Exception:
+                pass
+        self._connections.clear()
+        self._writer = None
+        self._readers = asyncio.Queue()
+
+    @asynccontextmanager
+    async def reader(self):
+        conn = await self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put_nowait(conn)
+
+    @asynccontextmanager
+    async def writer(self):
+        # Все записи идут через одно соединение: читатели в WAL не ждут писателя
+        async with self._write_lock:
+            try:
+                yield self._writer
+                await self._writer.commit()
+            except Exception:
+                await self._writer.rollback()
+                raise
+
+    async def fetchall(self, sql, params=()):
+        async with self.reader() as conn:
+            async with conn.execute(sql, params) as cursor:
+                return await cursor.fetchall()
+
+    async def fetchone(self, sql, params=()):
+        async with self.reader() as conn:
+            async with conn.execute(sql, params) as cursor:
+                return await cursor.fetchone()
+
+    async def execute(self, sql, params=()):
+        async with self.writer() as conn:
+            cursor = await conn.execute(sql, params)
+            return cursor.lastrowid
+
+
+# Кэш шаблонов на весь процесс: грузится один раз при старте, дальше обновляется при записи
+class TemplateCache:
+    def __init__(self, page_size=TEMPLATES_PAGE_SIZE):
+        self.page_size = max(1, page_size)
+        self.by_id = {}
+        self.pages = []
+
+    def load(self, rows):
+        self.by_id = {}
+        self.pages = []
+        for row in sorted(rows):
+            self.add(row)
+
+    def add(self, row):
+        tpl_id, label = row[0], row[1]
+        self.by_id[tpl_id] = tuple(row)
+        # id растут монотонно, поэтому новый шаблон всегда попадает в хвост последней страницы
+        if not self.pages or len(self.pages[-1]) >= self.page_size:
+            self.pages.append([])
+        self.pages[-1].append((tpl_id, label))
+
+    def get(self, tpl_id):
+        return self.by_id.get(tpl_id)
+
+    def page(self, number):
+        if not self.pages:
+            return []
+        return self.pages[min(max(number, 0), len(self.pages) - 1)]
+
+    @property
+    def page_count(self):
+        return len(self.pages)
+
+    def __len__(self):
+        return len(self.by_id)
+
+
+db = Database()
+template_cache = TemplateCache()
+
+# --- DATABASE FUNCTIONS ---
+
+async def init_db():
+    await db.open()
+    template_cache.load(await db.fetchall(SQL_SELECT_TEMPLATES))
+
+async def close_db():
+    await db.close()
+
+@timed_query
+async def save_template(label, aroma, strength, bowl, draft):
+    tpl_id = await db.execute(SQL_INSERT_TEMPLATE, (label, aroma, strength, bowl, draft))
+    template_cache.add((tpl_id, label, aroma, strength, bowl, draft))
+    return tpl_id
+
+@timed_query
+async def get_templates():
+    return list(template_cache.by_id.values())
+
+@timed_query
+async def get_template_by_id(template_id):
+    return template_cache.get(template_id)
+
+@timed_query
+def get_templates_page(number):
+    return template_cache.page(number), template_cache.page_count
+
+def search_words(text):
+    # ё/е сводим так же, как триггеры при индексации
+    return re.findall(r"\w+", text.replace("ё", "е").replace("Ё", "Е"))
+
+@timed_query
+async def search_templates(text, offset=0, limit=TEMPLATES_SEARCH_LIMIT):
+    words = search_words(text)
+    if not words:
+        # Пустой запрос — последние сохранённые шаблоны
+        return list(islice(reversed(template_cache.by_id.values()), offset, offset + limit))
+    sql = SQL_SEARCH_TEMPLATES_RECENT if len(words) == 1 and len(words[0]) == 1 else SQL_SEARCH_TEMPLATES
+    # Каждое слово — префикс: "ив мя" находит "Иван" с "Мятой" ещё до конца набора
+    match = " ".join(f'"{word}"*' for word in words)
+    rows = await db.fetchall(sql, (match, limit, offset))
+    # Поля берём из кэша: индекс хранит только то, по чему ищем
+    return [tpl for tpl in map(template_cache.get, (row[0] for row in rows)) if tpl]
+
+# --- ORDERS ---
+
+@timed_query
+async def create_order(user_id, username, zone, table, aroma, strength, bowl, draft, created_at, sends=None,
+                       trace_id=None):
+    async with db.writer() as conn:
+        cursor = await conn.execute(
+            SQL_INSERT_ORDER, (user_id, username, zone, table, aroma, strength, bowl, draft, created_at, trace_id)
+        )
+        order_id = cursor.lastrowid
+        if sends is not None:
+            await conn.execute(
+                SQL_INSERT_OUTBOX, (order_id, f"order:{order_id}", json.dumps(sends, ensure_ascii=False), created_at)
+            )
+    return order_id
+
+@timed_query
+async def create_cart(user_id, username, zone, table, items, created_at, sends, trace_id=None):
+    # Корзина: по строке orders на кальян и одна отправка на всех — одно сообщение в каждый топик
+    async with db.writer() as conn:
+        order_ids = []
+        for aroma, strength, bowl, draft in items:
+            cursor = await conn.execute(
+                SQL_INSERT_ORDER, (user_id, username, zone, table, aroma, strength, bowl, draft, created_at, trace_id)
+            )
+            order_ids.append(cursor.lastrowid)
+        await conn.executemany(SQL_SET_CART_ID, [(order_ids[0], order_id) for order_id in order_ids])
+        payload = json.dumps({"orders": order_ids, "sends": sends}, ensure_ascii=False)
+        await conn.execute(SQL_INSERT_OUTBOX, (order_ids[0], f"cart:{order_ids[0]}", payload, created_at))
+    return order_ids
+
+@timed_query
+async def set_order_messages(order_id, zone_message_id, general_message_id):
+    await db.execute(SQL_SET_ORDER_MESSAGES, (zone_message_id, general_message_id, order_id))
+
+@timed_query
+async def complete_order(order_id, completed_at, on_complete=None):
+    # Повторное нажатие (второй топик) не перезаписывает время выдачи.
+    # on_complete(conn, order) выполняется в той же транзакции и только при первой выдаче
+    async with db.writer() as conn:
+        cursor = await conn.execute(SQL_COMPLETE_ORDER, (completed_at, order_id))
+        async with conn.execute(SQL_SELECT_ORDER, (order_id,)) as select:
+            order = await select.fetchone()
+        if cursor.rowcount and order and on_complete is not None:
+            await on_complete(conn, order)
+    return order
+
+@timed_query
+async def get_order(order_id):
+    return await db.fetchone(SQL_SELECT_ORDER, (order_id,))
+
+@timed_query
+async def get_open_orders(zone):
+    return await db.fetchall(SQL_SELECT_OPEN_ORDERS, (zone,))
+
+@timed_query
+async def get_active_orders():
+    return await db.fetchall(SQL_SELECT_ACTIVE_ORDERS)
+
+@timed_query
+async def get_cart_orders(cart_id):
+    return await db.fetchall(SQL_SELECT_CART_ORDERS, (cart_id,))
+
+@timed_query
+async def get_sla_orders(since):
+    return await db.fetchall(SQL_SELECT_SLA_ORDERS, (since,))
+
+@timed_query
+async def set_orders_escalated(stages):
+    # stages: (escalated, order_id)
+    async with db.writer() as conn:
+        await conn.executemany(SQL_SET_ORDER_ESCALATED, stages)
+
+@timed_query
+async def get_completed_since(ts):
+    return await db.fetchall(SQL_SELECT_COMPLETED_SINCE, (ts,))
+
+# --- OUTBOX ---
+
+@timed_query
+async def get_due_outbox(now, limit):
+    return await db.fetchall(SQL_SELECT_DUE_OUTBOX, (now, limit))
+
+@timed_query
+async def get_next_outbox_due():
+    row = await db.fetchone(SQL_SELECT_NEXT_OUTBOX_DUE)
+    return row[0] if row else None
+
+@timed_query
+async def save_outbox_sent(outbox_id, sent, order_ids, general, message_id):
+    # general — пост в general (второй), иначе в топик зоны; кнопки под ним работают сразу
+    sql = SQL_SET_ORDER_GENERAL_MESSAGE if general else SQL_SET_ORDER_ZONE_MESSAGE
+    async with db.writer() as conn:
+        await conn.execute(SQL_SET_OUTBOX_SENT, (sent, outbox_id))
+        await conn.executemany(sql, [(message_id, order_id) for order_id in order_ids])
+
+@timed_query
+async def save_outbox_results(updates, delivered):
+    # updates: (status, sent, attempts, next_attempt_at, last_error, outbox_id)
+    # delivered: (zone_message_id, general_message_id, order_id) — всё одной транзакцией
+    async with db.writer() as conn:
+        await conn.executemany(SQL_UPDATE_OUTBOX, updates)
+        if delivered:
+            await conn.executemany(SQL_SET_ORDER_MESSAGES, delivered)
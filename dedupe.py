@@ -0,0 +1,68 @@
+import os
+from collections import OrderedDict
+from time import monotonic
+
+from metrics import submit_duplicates
+
+# Сколько секунд повторное нажатие "Отправить" с тем же составом считается тем же заказом
+SUBMIT_DEDUPE_TTL = float(os.getenv("SUBMIT_DEDUPE_TTL", "30"))
+SUBMIT_DEDUPE_SIZE = int(os.getenv("SUBMIT_DEDUPE_SIZE", "10000"))
+
+
+class SubmitDedupe:
+    # Ключ отправки — (сотрудник, сообщение меню) и отпечаток состава заказа. На ключ одна запись
+    # [срок, отпечатки, номер заказа]. Запоминается только успех: упавшую отправку следующее нажатие повторит.
+    # Отправки в работе не отслеживаются: PerUserUpdateProcessor пускает нажатия сотрудника по одному,
+    # и повтор приходит, когда первая отправка уже закончилась
+    def __init__(self, ttl=SUBMIT_DEDUPE_TTL, size=SUBMIT_DEDUPE_SIZE):
+        self.ttl = ttl
+        self.size = size
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _live(self, key, now):
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] <= now:
+            del self._entries[key]
+            return None
+        return entry
+
+    def duplicate_of(self, key, fingerprint, now=None):
+        # Номер заказа первой отправки, если нажатие её повторяет
+        entry = self._live(key, monotonic() if now is None else now)
+        if entry is None or fingerprint not in entry[1]:
+            return None
+        submit_duplicates.inc()
+        return entry[2]
+
+    async def submit(self, key, fingerprint, send):
+        result = await send()
+        # Срок считается от успеха, а не от нажатия: медленная отправка не сокращает окно
+        now = monotonic()
+        self._put(key, [now + self.ttl, {fingerprint}, result], now)
+        return result
+
+    def extend(self, key, fingerprint):
+        # Тот же заказ в другом виде: после отправки в черновике остаётся только последний кальян корзины
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry[1].add(fingerprint)
+
+    def forget(self, key):
+        # Новый заказ с того же меню: такой же состав — уже не повтор
+        self._entries.pop(key, None)
+
+    def _put(self, key, entry, now):
+        self._entries.pop(key, None)
+        self._entries[key] = entry
+        # Старейшие — в начале: истёкшие и лишние сверх размера уходят
+        while self._entries:
+            old_key, old = next(iter(self._entries.items()))
+            if old[0] > now and len(self._entries) <= self.size:
+                break
+            del self._entries[old_key]
+
+
+submit_dedupe = SubmitDedupe()
@@ -0,0 +1,207 @@
+import os
+import asyncio
+import itertools
+from time import monotonic
+
+from telegram.error import RetryAfter
+
+from eventlog import trace_id
+
+# Заказы уходят раньше косметических правок меню, фоновые обновления — последними
+PRIORITY_ORDER = 0
+PRIORITY_UI = 1
+PRIORITY_BACKGROUND = 2
+
+DISPATCH_WORKERS = int(os.getenv("DISPATCH_WORKERS", "8"))
+# Лимиты Telegram: ~20 сообщений в минуту в группу, ~30 в секунду на бота
+GROUP_RATE_PER_MIN = float(os.getenv("GROUP_RATE_PER_MIN", "20"))
+GROUP_BURST = float(os.getenv("GROUP_BURST", "10"))
+PRIVATE_RATE_PER_SEC = float(os.getenv("PRIVATE_RATE_PER_SEC", "5"))
+PRIVATE_BURST = float(os.getenv("PRIVATE_BURST", "5"))
+GLOBAL_RATE_PER_SEC = float(os.getenv("GLOBAL_RATE_PER_SEC", "30"))
+
+
+def retry_after_seconds(exc: RetryAfter):
+    value = exc.retry_after
+    if hasattr(value, "total_seconds"):
+        return value.total_seconds()
+    return float(value)
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self):
+        now = monotonic()
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    async def acquire(self):
+        while True:
+            wait = self.delay()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    def block(self, seconds):
+        self.blocked_until = max(self.blocked_until, monotonic() + seconds)
+
+
+class Dispatcher:
+    def __init__(self, workers=DISPATCH_WORKERS):
+        self.workers_count = workers
+        self._queue = None
+        self._workers = []
+        # Задача ожидания -> отложенная ею работа: при останове её future тоже надо закрыть
+        self._deferred = {}
+        self._buckets = {}
+        self._global = TokenBucket(GLOBAL_RATE_PER_SEC, GLOBAL_RATE_PER_SEC)
+        self._seq = itertools.count()
+
+    @property
+    def running(self):
+        return bool(self._workers)
+
+    @property
+    def pending(self):
+        # В очереди и отложенные из-за лимитов
+        return (self._queue.qsize() if self._queue is not None else 0) + len(self._deferred)
+
+    def bucket(self, chat_id):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            # Отрицательные id — группы и каналы
+            if str(chat_id).startswith("-"):
+                bucket = TokenBucket(GROUP_RATE_PER_MIN / 60, GROUP_BURST)
+            else:
+                bucket = TokenBucket(PRIVATE_RATE_PER_SEC, PRIVATE_BURST)
+            self._buckets[chat_id] = bucket
+        return bucket
+
+    async def start(self):
+        if self.running:
+            return
+        self._queue = asyncio.PriorityQueue()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.workers_count)]
+
+    async def stop(self, timeout=5):
+        if not self.running:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        deferred = list(self._deferred.items())
+        for task in [*self._workers, *self._deferred]:
+            task.cancel()
+        await asyncio.gather(*self._workers, *self._deferred, return_exceptions=True)
+        self._workers = []
+        self._deferred.clear()
+        # Что не успело уйти, завершается ошибкой: иначе ждущие его обработчики и outbox висят вечно.
+        # outbox вернёт свою строку в pending и отправит после рестарта
+        jobs = [job for _, job in deferred]
+        while not self._queue.empty():
+            jobs.append(self._queue.get_nowait()[2])
+            self._queue.task_done()
+        for _, _, future, _ in jobs:
+            if not future.done():
+                future.set_exception(RuntimeError("dispatcher stopped"))
+
+    def submit(self, chat_id, call, priority=PRIORITY_UI):
+        # call — фабрика корутины: при RetryAfter запрос создаётся заново
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(_consume_exception)
+        if not self.running:
+            task = asyncio.ensure_future(call())
+            task.add_done_callback(lambda t: _resolve(future, t))
+            return future
+        # Воркер живёт дольше обработчика: trace заказа едет вместе с задачей
+        self._put(priority, (chat_id, call, future, trace_id.get()))
+        return future
+
+    def _put(self, priority, job, seq=None):
+        self._queue.put_nowait((priority, next(self._seq) if seq is None else seq, job))
+
+    async def _worker(self):
+        while True:
+            priority, seq, job = await self._queue.get()
+            try:
+                await self._run(priority, seq, job)
+            except asyncio.CancelledError:
+                # Останов посреди вызова: ушёл ли запрос, неизвестно — ждущий решает сам, повторять ли
+                if not job[2].done():
+                    job[2].set_exception(RuntimeError("dispatcher stopped"))
+                raise
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, priority, seq, job):
+        chat_id, call, future, trace = job
+        if future.done():
+            return
+        bucket = self.bucket(chat_id)
+        wait = bucket.delay()
+        if wait:
+            # Чат выбрал свой лимит: откладываем задачу, а не спим в воркере,
+            # иначе очередь в группу занимает все воркеры и личные чаты ждут её
+            self._defer(wait, priority, job, seq)
+            return
+        await self._global.acquire()
+        trace_id.set(trace)
+        try:
+            result = await call()
+        except RetryAfter as exc:
+            # Flood control: откладываем отправку, а не роняем её
+            seconds = retry_after_seconds(exc)
+            bucket.block(seconds)
+            self._defer(seconds, priority, job, seq)
+        except Exception as exc:
+            if not future.done():
+                future.set_exception(exc)
+        else:
+            if not future.done():
+                future.set_result(result)
+
+    def _defer(self, seconds, priority, job, seq):
+        # Прежний seq сохраняет порядок: отложенные сообщения чата уходят в том же порядке
+        async def requeue():
+            await asyncio.sleep(seconds)
+            if self.running:
+                self._put(priority, job, seq)
+
+        task = asyncio.create_task(requeue())
+        self._deferred[task] = job
+        task.add_done_callback(lambda t: self._deferred.pop(t, None))
+
+
+def _resolve(future, task):
+    if future.done():
+        return
+    if task.cancelled():
+        future.cancel()
+    elif task.exception() is not None:
+        future.set_exception(task.exception())
+    else:
+        future.set_result(task.result())
+
+
+def _consume_exception(future):
+    if not future.cancelled():
+        future.exception()
+
+
+dispatcher = Dispatcher()
@@ -0,0 +1,162 @@
+STRENGTH_CHOICES = [
+    ["Легкий", "Легкий +", "Легкий-Средний"],
+    ["Безопасный Дарк", "Средний"],
+    ["Средний+", "Выше среднего", "Крепкий"]
+]
+DRAFT_CHOICES = ["Union 🔴", "Yapona ⚫", "Wookah 🟤"]
+STRENGTHS = tuple(name for row in STRENGTH_CHOICES for name in row)
+
+# Поля одного кальяна; стол общий для всей корзины
+ITEM_FIELDS = ("aroma", "strength", "bowl", "draft")
+# Ключи user_data до появления OrderDraft: старые сохранённые черновики переносятся при первом обращении
+LEGACY_KEYS = ("order_msg_id", "table", *ITEM_FIELDS, "edit_field", "from_quick", "cart", "cart_index")
+
+_STRENGTH_INDEX = {name: i for i, name in enumerate(STRENGTHS)}
+_DRAFT_INDEX = {name: i for i, name in enumerate(DRAFT_CHOICES)}
+
+
+def _pack(value, index):
+    # Значение с кнопки хранится номером: строки из callback_data и из pickle у каждого пользователя свои,
+    # а малые int общие. Чужое значение (например, из старого шаблона) остаётся строкой
+    if value is None:
+        return None
+    return index.get(value, value)
+
+
+def _unpack(value, names):
+    return names[value] if type(value) is int else value
+
+
+def pack_item(item):
+    aroma, strength, bowl, draft = item
+    return aroma, _pack(strength, _STRENGTH_INDEX), bowl, _pack(draft, _DRAFT_INDEX)
+
+
+def unpack_item(item):
+    aroma, strength, bowl, draft = item
+    return aroma, _unpack(strength, STRENGTHS), bowl, _unpack(draft, DRAFT_CHOICES)
+
+
+class OrderDraft:
+    # Черновик заказа сотрудника и состояние его меню; в user_data лежит один объект вместо россыпи ключей
+    __slots__ = (
+        "order_msg_id", "table", "aroma", "_strength", "bowl", "_draft",
+        "edit_field", "from_quick", "cart", "cart_index", "trace_id",
+    )
+
+    def __init__(self, order_msg_id=None):
+        self.order_msg_id = order_msg_id
+        self.reset_fields()
+
+    def reset_fields(self):
+        self.table = None
+        self.edit_field = None
+        self.from_quick = False
+        # Отложенные кальяны в упакованном виде (pack_item)
+        self.cart = ()
+        self.cart_index = None
+        # Журнал событий: новый trace откроет первое действие со следующим заказом
+        self.trace_id = None
+        self.clear_item()
+
+    @property
+    def strength(self):
+        return _unpack(self._strength, STRENGTHS)
+
+    @strength.setter
+    def strength(self, value):
+        self._strength = _pack(value, _STRENGTH_INDEX)
+
+    @property
+    def draft(self):
+        return _unpack(self._draft, DRAFT_CHOICES)
+
+    @draft.setter
+    def draft(self, value):
+        self._draft = _pack(value, _DRAFT_INDEX)
+
+    # ----------- Кальян и корзина -----------
+
+    def item(self):
+        return self.aroma, self.strength, self.bowl, self.draft
+
+    def set_item(self, item):
+        self.aroma, self.strength, self.bowl, self.draft = item
+
+    def clear_item(self):
+        self.aroma = self._strength = self.bowl = self._draft = None
+
+    def has_item(self):
+        return any(value is not None for value in (self.aroma, self._strength, self.bowl, self._draft))
+
+    def cart_items(self):
+        return [unpack_item(item) for item in self.cart]
+
+    def items(self):
+        # Корзина вместе с черновиком; редактируемый кальян стоит на своём прежнем месте
+        items = self.cart_items()
+        if self.has_item():
+            index = self.cart_index
+            items.insert(len(items) if index is None else index, self.item())
+        return items
+
+    def fingerprint(self):
+        # Состав заказа в том виде, в каком его отправит send_order: стол и кальяны по порядку
+        return hash((self.table, tuple(self.items() or [self.item()])))
+
+    def stash(self):
+        # Черновик уходит в корзину, поля кальяна освобождаются под следующий
+        self.cart = tuple(pack_item(item) for item in self.items())
+        self.cart_index = None
+        self.clear_item()
+
+    def take(self, index):
+        # Кальян из корзины возвращается в черновик; текущий черновик встаёт на своё место
+        if self.has_item():
+            current = self.cart_index
+            if current is not None and current <= index:
+                index += 1
+            self.stash()
+        cart = list(self.cart)
+        item = unpack_item(cart.pop(index))
+        self.cart = tuple(cart)
+        self.cart_index = index
+        for field, value in zip(ITEM_FIELDS, item):
+            if value is not None:
+                setattr(self, field, value)
+        return index
+
+    # ----------- Хранение -----------
+
+    def __getstate__(self):
+        # В базу уходит кортеж значений без имён полей: pickle для __slots__ иначе пишет их у каждого объекта
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        # Новые поля дописываются в конец __slots__: у сохранённого раньше черновика их просто нет
+        self.trace_id = None
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+    # ----------- Совместимость -----------
+
+    @classmethod
+    def from_legacy(cls, data):
+        # Черновик, сохранённый до появления OrderDraft: ключи из user_data переезжают в объект
+        order = cls(data.pop("order_msg_id", None))
+        legacy = {key: data.pop(key) for key in LEGACY_KEYS[1:] if key in data}
+        for key in ("table", *ITEM_FIELDS, "edit_field"):
+            if key in legacy:
+                setattr(order, key, legacy[key])
+        order.from_quick = bool(legacy.get("from_quick"))
+        order.cart = tuple(pack_item(item) for item in legacy.get("cart", ()))
+        order.cart_index = legacy.get("cart_index")
+        return order
+
+
+def get_draft(context):
+    user_data = context.user_data
+    order = user_data.get("order")
+    if order is None:
+        order = user_data["order"] = OrderDraft.from_legacy(user_data)
+    return order
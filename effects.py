@@ -0,0 +1,165 @@
+import os
+import asyncio
+import functools
+from contextvars import ContextVar
+
+from loguru import logger
+from telegram.error import RetryAfter
+
+from dispatch import dispatcher, retry_after_seconds
+from metrics import effect_errors
+from render import edit_message, edit_reply_markup, remember_message
+
+# Сколько раз повторяем вызов после 429 и дольше скольки секунд ждать не готовы: обработчик держит
+# очередь нажатий этого сотрудника, а правка меню через полминуты уже никому не нужна
+EFFECT_RETRIES = int(os.getenv("EFFECT_RETRIES", "2"))
+EFFECT_MAX_RETRY_WAIT = float(os.getenv("EFFECT_MAX_RETRY_WAIT", "5"))
+
+_current = ContextVar("effects")
+# Правки через очередь диспетчера, которые ещё не выполнились: (chat_id, message_id) -> future.
+# Обработчик ждёт такую правку не дольше EFFECT_MAX_RETRY_WAIT, и она может дойти уже после
+# прямой правки того же сообщения из следующего нажатия — тогда она устарела и не должна её перетереть
+_queued = {}
+# Из них те, чей запрос уже ушёл в Bot API: их не отменить, только дождаться
+_running = set()
+
+
+class Effects:
+    # Исходящие вызовы Bot API одного апдейта. Обработчик их объявляет, вызовы сразу уходят
+    # параллельно; вызовы об одном сообщении выполняются в порядке объявления. Ошибки считаются
+    # и не роняют обработчик — результат нужного вызова можно дождаться через await
+    def __init__(self, bot):
+        self.bot = bot
+        self._tasks = []
+        self._last = {}
+
+    def _spawn(self, kind, call, key=None):
+        # call — фабрика корутины: после RetryAfter запрос создаётся заново
+        previous = [self._last[key]] if key in self._last else []
+        task = asyncio.ensure_future(self._run(kind, call, previous))
+        if key is not None:
+            self._last[key] = task
+        self._tasks.append(task)
+        return task
+
+    async def _run(self, kind, call, previous):
+        if previous:
+            await asyncio.wait(previous)
+        for attempt in range(EFFECT_RETRIES + 1):
+            try:
+                return await call()
+            except RetryAfter as exc:
+                seconds = retry_after_seconds(exc)
+                if attempt == EFFECT_RETRIES or seconds > EFFECT_MAX_RETRY_WAIT:
+                    effect_errors.inc(kind, type(exc).__name__)
+                    logger.warning("effect {} gave up after RetryAfter {}s", kind, seconds, effect=kind)
+                    raise
+                await asyncio.sleep(seconds)
+            except Exception as exc:
+                effect_errors.inc(kind, type(exc).__name__)
+                logger.warning("effect {} failed: {!r}", kind, exc, effect=kind)
+                raise
+
+    # ----------- Эффекты -----------
+
+    def answer(self, query, *args, **kwargs):
+        # Колбэк и inline-запрос: снять "часики" с кнопки не зависит ни от чего другого
+        return self._spawn("answer", lambda: query.answer(*args, **kwargs))
+
+    def delete(self, message):
+        return self._spawn("delete", message.delete, (message.chat_id, message.message_id))
+
+    def edit(self, chat_id, message_id, text, reply_markup=None, priority=None):
+        # priority — косметическая правка идёт через очередь диспетчера и уступает заказам
+        def call():
+            return edit_message(self.bot, chat_id, message_id, text, reply_markup)
+        if priority is not None:
+            return self._spawn("edit", lambda: queued(chat_id, message_id, call, priority), (chat_id, message_id))
+        return self._direct("edit", call, (chat_id, message_id))
+
+    def edit_markup(self, chat_id, message_id, reply_markup):
+        return self._direct(
+            "edit_markup", lambda: edit_reply_markup(self.bot, chat_id, message_id, reply_markup), (chat_id, message_id)
+        )
+
+    def _direct(self, kind, call, key):
+        # Прямая правка новее любой правки этого сообщения в очереди: ждущую в очереди отменяем,
+        # уже отправленную дожидаемся, чтобы её ответ не лёг поверх нашего
+        pending = _queued.pop(key, None)
+        if pending is None or pending not in _running:
+            if pending is not None:
+                pending.cancel()
+            return self._spawn(kind, call, key)
+        previous = self._last.get(key)
+        task = asyncio.ensure_future(self._run(kind, call, [pending] + ([previous] if previous else [])))
+        self._last[key] = task
+        self._tasks.append(task)
+        return task
+
+    def send(self, chat_id, text, reply_markup=None):
+        async def call():
+            message = await self.bot.send_message(chat_id, text, reply_markup=reply_markup)
+            remember_message(message, reply_markup)
+            return message
+        return self._spawn("send", call, chat_id)
+
+    async def flush(self):
+        # Ждём всё объявленное; ошибки уже посчитаны в _run
+        while self._tasks:
+            tasks, self._tasks = self._tasks, []
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def queued(chat_id, message_id, call, priority):
+    # Диспетчер откладывает правку после 429 сколько потребуется, а обработчик держит очередь нажатий
+    # сотрудника: ждём не дольше EFFECT_MAX_RETRY_WAIT, правка дойдёт в фоне. Не дождались — не ошибка
+    key = (chat_id, message_id)
+
+    async def run():
+        _running.add(future)
+        try:
+            return await call()
+        finally:
+            # После 429 диспетчер откладывает правку, и до повтора её снова можно отменить
+            _running.discard(future)
+
+    previous = _queued.get(key)
+    if previous is not None and previous not in _running:
+        # Следующая правка того же сообщения из очереди делает прошлую лишней
+        previous.cancel()
+    future = dispatcher.submit(chat_id, run, priority)
+    _queued[key] = future
+    future.add_done_callback(lambda f: _queued_done(key, f))
+    done, _ = await asyncio.wait([future], timeout=EFFECT_MAX_RETRY_WAIT)
+    if not done or future.cancelled():
+        return None
+    return future.result()
+
+
+def _queued_done(key, future):
+    _running.discard(future)
+    if _queued.get(key) is future:
+        del _queued[key]
+
+
+def effects():
+    return _current.get()
+
+
+def pipelined(handler):
+    # Обработчик возвращается, когда все его вызовы API завершились: следующий апдейт того же
+    # сотрудника не обгонит правку предыдущего
+    @functools.wraps(handler)
+    async def wrapper(update, context):
+        if _current.get(None) is not None:
+            # Вызван из другого обработчика (menu из to_menu_callback) — эффекты уходят в его конвейер
+            return await handler(update, context)
+        pipeline = Effects(context.bot)
+        token = _current.set(pipeline)
+        try:
+            return await handler(update, context)
+        finally:
+            _current.reset(token)
+            await pipeline.flush()
+
+    return wrapper
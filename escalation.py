@@ -0,0 +1,188 @@
+import os
+import heapq
+import asyncio
+from itertools import count
+from time import time
+
+from loguru import logger
+from telegram import ReplyParameters
+
+from db import get_order, get_sla_orders, set_orders_escalated
+from dispatch import dispatcher, PRIORITY_UI
+from eventlog import event, bind_trace
+from metrics import sla_breaches
+from routing import router
+from ticker import format_wait
+
+# Незакрытые заказы старше этого при старте не поднимаем: это забытые кнопки, а не гости, которые ждут
+SLA_LOOKBACK = int(os.getenv("SLA_LOOKBACK", "21600"))
+# Когда в куче снятых записей больше, чем живых (и больше этого числа), она пересобирается
+SLA_COMPACT_MIN = 64
+# Через сколько секунд повторить, если база не ответила
+SLA_RETRY = 60
+
+REMINDER, ESCALATION = 0, 1
+STAGE_NAMES = ("reminder", "escalation")
+
+
+class Escalator:
+    # Невыданные заказы лежат в min-куче по сроку: цикл спит до ближайшего срока и не перебирает остальные.
+    # Первая просрочка (created_at + SLA зоны) — напоминание в топик зоны, вторая (+ ещё один SLA) — в general.
+    # Выдача снимает запись за O(1): она помечается мёртвой и выбрасывается, когда дойдёт до вершины кучи
+    def __init__(self):
+        self.bot = None
+        self.chat_id = None
+        # [срок, порядковый номер, order_id или None у снятой, зона, стол, created_at, этап]
+        self._heap = []
+        self._entries = {}
+        self._removed = 0
+        self._seq = count()
+        self._wake = asyncio.Event()
+        self._task = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def start(self, bot, chat_id):
+        if self._task is not None or not chat_id:
+            return
+        self.bot = bot
+        self.chat_id = chat_id
+        # Event привязывается к циклу событий: при повторном запуске приложения (тесты) — новый
+        self._wake = asyncio.Event()
+        # Что просрочилось, пока бот лежал, уйдёт первым же проходом
+        for order_id, zone, table, created_at, stage in await get_sla_orders(int(time()) - SLA_LOOKBACK):
+            self.add(order_id, zone, table, created_at, stage)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    # ----------- Очередь сроков -----------
+
+    def add(self, order_id, zone, table, created_at, stage=REMINDER, deadline=None):
+        if deadline is None:
+            deadline = created_at + router.zone(zone)[1] * (stage + 1)
+        entry = [deadline, next(self._seq), order_id, zone, table, created_at, stage]
+        self.remove(order_id)
+        self._entries[order_id] = entry
+        heapq.heappush(self._heap, entry)
+        if self._heap[0] is entry:
+            # Новый ближайший срок: цикл пересчитывает, сколько спать
+            self._wake.set()
+
+    def remove(self, order_id):
+        entry = self._entries.pop(order_id, None)
+        if entry is None:
+            return False
+        entry[2] = None
+        self._removed += 1
+        if self._removed > SLA_COMPACT_MIN and self._removed * 2 > len(self._heap):
+            self._heap = [entry for entry in self._heap if entry[2] is not None]
+            heapq.heapify(self._heap)
+            self._removed = 0
+        return True
+
+    def next_deadline(self):
+        heap = self._heap
+        while heap and heap[0][2] is None:
+            heapq.heappop(heap)
+            self._removed -= 1
+        return heap[0][0] if heap else None
+
+    def pop_due(self, now):
+        due = []
+        heap = self._heap
+        while True:
+            deadline = self.next_deadline()
+            if deadline is None or deadline > now:
+                return due
+            entry = heapq.heappop(heap)
+            del self._entries[entry[2]]
+            due.append(entry)
+
+    # ----------- Цикл -----------
+
+    async def _run(self):
+        while True:
+            self._wake.clear()
+            deadline = self.next_deadline()
+            now = time()
+            if deadline is None or deadline > now:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), None if deadline is None else deadline - now)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            due = self.pop_due(now)
+            try:
+                await self.fire(due, now)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # Заказы не прочитались из базы: сроки откладываем, уже переведённые на второй этап не трогаем
+                logger.exception("sla check failed, retrying in {}s", SLA_RETRY)
+                for _, _, order_id, zone, table, created_at, stage in due:
+                    if order_id not in self._entries:
+                        self.add(order_id, zone, table, created_at, stage, deadline=now + SLA_RETRY)
+
+    async def fire(self, due, now):
+        # Кальяны одной корзины просрочиваются вместе и делят сообщение: одно напоминание на корзину
+        groups = {}
+        traces = {}
+        for entry in due:
+            row = await get_order(entry[2])
+            if row is None or row[9] != "open":
+                continue
+            traces[entry[2]] = row[14]
+            bind_trace(row[14])
+            event("order.sla", order_id=entry[2], stage=STAGE_NAMES[entry[6]], wait=int(now - entry[5]))
+            zone_message_id, general_message_id = row[12], row[13]
+            key = (entry[6], row[15] or ("order", entry[2]))
+            groups.setdefault(key, (zone_message_id, general_message_id, []))[2].append(entry)
+
+        stages = []
+        for (stage, _), (zone_message_id, general_message_id, entries) in groups.items():
+            _, _, order_id, zone, table, created_at, _ = entries[0]
+            # Кальяны корзины делят trace: напоминание уходит с ним
+            bind_trace(traces[order_id])
+            self._post(stage, zone, table, now - created_at, len(entries), zone_message_id, general_message_id)
+            sla_breaches.inc(zone, STAGE_NAMES[stage], amount=len(entries))
+            for _, _, order_id, zone, table, created_at, _ in entries:
+                stages.append((stage + 1, order_id))
+                if stage == REMINDER:
+                    self.add(order_id, zone, table, created_at, ESCALATION)
+        if not stages:
+            return
+        try:
+            await set_orders_escalated(stages)
+        except Exception:
+            # Напоминания уже ушли: повторять их из-за записи не будем, после рестарта разве что продублируются
+            logger.exception("sla stages not saved")
+
+    def _post(self, stage, zone, table, age, hookahs, zone_message_id, general_message_id):
+        topic_id, sla = router.zone(zone)
+        what = f"кальянов: {hookahs}" if hookahs > 1 else "кальян"
+        if stage == REMINDER:
+            text = f"⏰ Стол {table} ждёт {format_wait(age)} ({what}), норма зоны — {format_wait(sla)}"
+            reply_to = zone_message_id
+        else:
+            text = f"🚨 {zone}, стол {table}: ждёт уже {format_wait(age)} ({what}), напоминание в зоне не помогло"
+            general_topic_id = router.topics.get("general")
+            # Заказ зоны, у которой топик и есть general, продублирован не был: отвечаем на него самого
+            reply_to = general_message_id or (zone_message_id if topic_id == general_topic_id else None)
+            topic_id = general_topic_id
+        params = dict(chat_id=self.chat_id, text=text, message_thread_id=topic_id)
+        if reply_to:
+            params["reply_parameters"] = ReplyParameters(reply_to, allow_sending_without_reply=True)
+        dispatcher.submit(self.chat_id, lambda: self.bot.send_message(**params), priority=PRIORITY_UI)
+
+
+escalator = Escalator()
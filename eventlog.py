@@ -0,0 +1,310 @@
+# Журнал событий: JSON-строки через loguru, запись в файл — отдельным потоком пачками.
+# Запуск разбора: python -m eventlog <trace_id | номер заказа> [--log logs/events.jsonl]
+import os
+import sys
+import json
+import queue
+import logging
+import argparse
+import threading
+import traceback
+from uuid import uuid4
+from contextvars import ContextVar
+from datetime import datetime
+
+from loguru import logger
+
+# "" — журнал в файл не пишем, остаются только предупреждения в stderr
+EVENT_LOG = os.getenv("EVENT_LOG", "logs/events.jsonl")
+EVENT_LOG_MAX_BYTES = int(os.getenv("EVENT_LOG_MAX_BYTES", str(50 * 2 ** 20)))
+EVENT_LOG_BACKUPS = int(os.getenv("EVENT_LOG_BACKUPS", "5"))
+# Записи, которые поток не успел записать; сверх этого новые отбрасываются, а не тормозят бота
+EVENT_LOG_QUEUE = int(os.getenv("EVENT_LOG_QUEUE", "100000"))
+EVENT_LOG_BATCH = 1024
+# Не дольше этого запись ждёт в очереди, если пачка не набралась
+EVENT_LOG_FLUSH_INTERVAL = float(os.getenv("EVENT_LOG_FLUSH_INTERVAL", "0.5"))
+LOG_LEVEL = os.getenv("LOG_LEVEL", "WARNING")
+
+# Заказ от "Заказать" до "Кальян отдан": всё, что делается ради него, пишется с этим id
+trace_id = ContextVar("trace_id", default=None)
+
+
+def new_trace():
+    return uuid4().hex[:16]
+
+
+def bind_trace(value):
+    trace_id.set(value)
+
+
+def event(name, **fields):
+    # Поля попадают в extra записи; уровень INFO — в stderr события не идут
+    logger.info(name, event=name, **fields)
+
+
+class _Intercept(logging.Handler):
+    # PTB, httpx и APScheduler пишут через logging: их записи идут туда же, с тем же trace
+    def emit(self, record):
+        try:
+            level = logger.level(record.levelname).name
+        except ValueError:
+            level = record.levelno
+        logger.opt(depth=6, exception=record.exc_info).log(level, record.getMessage())
+
+
+# ----------- Файл -----------
+
+def index_path(path):
+    return f"{path}.idx"
+
+
+def rotated_path(path, n):
+    return f"{path}.{n}"
+
+
+def index_keys(extra):
+    # Запись находится по trace и по номеру заказа ("#15"): выдача кнопкой знает только номер
+    keys = []
+    if extra.get("trace"):
+        keys.append(extra["trace"])
+    if extra.get("order_id") is not None:
+        keys.append(f"#{extra['order_id']}")
+    for order_id in extra.get("order_ids") or ():
+        keys.append(f"#{order_id}")
+    return keys
+
+
+class JsonLinesSink:
+    # Sink для loguru: в потоке бота запись только кладётся в очередь, сериализует и пишет фоновый поток.
+    # Рядом с журналом — индекс "ключ\tсмещение": разбор заказа читает его, а не весь журнал
+    def __init__(self, path=EVENT_LOG, max_bytes=EVENT_LOG_MAX_BYTES, backups=EVENT_LOG_BACKUPS,
+                 maxsize=EVENT_LOG_QUEUE):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.dropped = 0
+        self.written = 0
+        self._queue = queue.Queue(maxsize)
+        self._thread = None
+        self._log = None
+        self._index = None
+        self._size = 0
+
+    def __call__(self, message):
+        record = message.record
+        extra = record["extra"]
+        if "trace" not in extra:
+            # Sink вызывается в том же потоке и контексте, что и запись: trace — текущего заказа
+            extra = {**extra, "trace": trace_id.get()}
+        item = (record["time"].timestamp(), record["level"].name, record["message"], extra, record["exception"])
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    def start(self):
+        if self._thread is not None:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._open()
+        self._thread = threading.Thread(target=self._run, name="event-log", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        self._log.close()
+        self._index.close()
+
+    def _open(self):
+        self._log = open(self.path, "ab")
+        self._index = open(index_path(self.path), "ab")
+        self._size = self._log.tell()
+
+    def _rotate(self):
+        self._log.close()
+        self._index.close()
+        # events.jsonl -> events.jsonl.1 -> ... -> events.jsonl.<backups>, индексы следом; самый старый пропадает
+        for n in range(self.backups, 0, -1):
+            source = rotated_path(self.path, n - 1) if n > 1 else self.path
+            target = rotated_path(self.path, n)
+            for src, dst in ((source, target), (index_path(source), index_path(target))):
+                if os.path.exists(src):
+                    os.replace(src, dst)
+        if self.backups <= 0:
+            os.remove(self.path)
+            os.remove(index_path(self.path))
+        self._open()
+
+    def _run(self):
+        while True:
+            try:
+                batch = [self._queue.get(timeout=EVENT_LOG_FLUSH_INTERVAL)]
+            except queue.Empty:
+                continue
+            while len(batch) < EVENT_LOG_BATCH:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = batch[-1] is None
+            try:
+                self._write([item for item in batch if item is not None])
+            except (OSError, TypeError, ValueError) as exc:
+                # Через logger нельзя — запись вернулась бы сюда же
+                self.dropped += len(batch)
+                sys.stderr.write(f"[event-log] {exc!r}\n")
+            if stop:
+                return
+
+    def _write(self, batch):
+        lines = []
+        index = []
+        for ts, level, message, extra, exception in batch:
+            record = {"ts": round(ts, 6), "level": level, "msg": message, **extra}
+            if exception is not None:
+                record["exception"] = "".join(traceback.format_exception(*exception))
+            line = (json.dumps(record, ensure_ascii=False, default=str) + "\n").encode()
+            if self._size and self._size + len(line) > self.max_bytes:
+                # Пачка делится по границе файла: смещения в новом считаются от его начала
+                self._flush(lines, index)
+                self._rotate()
+                lines, index = [], []
+            for key in index_keys(extra):
+                index.append(f"{key}\t{self._size}\n")
+            lines.append(line)
+            self._size += len(line)
+        self._flush(lines, index)
+        self.written += len(batch)
+
+    def _flush(self, lines, index):
+        if not lines:
+            return
+        self._log.write(b"".join(lines))
+        self._index.write("".join(index).encode())
+        self._log.flush()
+        self._index.flush()
+
+
+class EventLog:
+    def __init__(self, path=EVENT_LOG):
+        self.path = path
+        self.sink = None
+        self._handler_id = None
+        self._configured = False
+
+    def configure(self):
+        # Настройка loguru и logging — при старте бота, а не при импорте: тесты и разбор журнала
+        # импортируют модуль и не должны терять свои обработчики
+        if self._configured:
+            return
+        self._configured = True
+        logger.remove()
+        logger.add(sys.stderr, level=LOG_LEVEL)
+        logging.basicConfig(handlers=[_Intercept()], level=logging.INFO, force=True)
+        # Строка на каждый запрос и каждый запуск задачи: это уже есть в событиях api и метриках
+        for name in ("httpx", "aiohttp.access", "apscheduler"):
+            logging.getLogger(name).setLevel(logging.WARNING)
+
+    def start(self):
+        self.configure()
+        if self.sink is not None or not self.path:
+            return
+        self.sink = JsonLinesSink(self.path)
+        self.sink.start()
+        self._handler_id = logger.add(self.sink, level="DEBUG", format="{message}", catch=True)
+
+    def stop(self):
+        if self.sink is None:
+            return
+        logger.remove(self._handler_id)
+        self.sink.stop()
+        self.sink = None
+
+
+event_log = EventLog()
+
+
+# ----------- Разбор -----------
+
+def _files(path):
+    # От старых к новым: так записи одного заказа идут по порядку
+    n = 1
+    while os.path.exists(rotated_path(path, n)):
+        n += 1
+    return [rotated_path(path, k) for k in range(n - 1, 0, -1)] + [path]
+
+
+def _offsets(index, key):
+    # Индекс читается целиком и ищется как байты: построчный разбор десятков МБ в разы медленнее
+    needle = f"\n{key}\t".encode()
+    data = b"\n" + index
+    offsets = []
+    pos = data.find(needle)
+    while pos != -1:
+        start = pos + len(needle)
+        end = data.index(b"\n", start)
+        offsets.append(int(data[start:end]))
+        pos = data.find(needle, end)
+    return offsets
+
+
+def lookup(path, key):
+    # {(файл, смещение): запись} — по ключу одна запись может найтись дважды (по trace и по номеру)
+    records = {}
+    for log_path in _files(path):
+        if not os.path.exists(index_path(log_path)):
+            continue
+        with open(index_path(log_path), "rb") as f:
+            offsets = _offsets(f.read(), key)
+        if not offsets:
+            continue
+        with open(log_path, "rb") as f:
+            for offset in offsets:
+                f.seek(offset)
+                records[(log_path, offset)] = json.loads(f.readline())
+    return records
+
+
+def timeline(path, key):
+    # Номер заказа приводит к его trace; записи без trace (например, фоновые) находятся по самому номеру.
+    # Trace тоже бывает из одних цифр — ищем под обоими ключами
+    records = lookup(path, key)
+    if key.isdigit():
+        records.update(lookup(path, f"#{key}"))
+    for trace in {record["trace"] for record in records.values() if record.get("trace")} - {key}:
+        records.update(lookup(path, trace))
+    return sorted(records.values(), key=lambda record: record["ts"])
+
+
+def format_record(record):
+    ts = datetime.fromtimestamp(record["ts"]).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+    skip = {"ts", "level", "msg", "event", "trace", "exception"}
+    fields = " ".join(f"{key}={value}" for key, value in record.items() if key not in skip)
+    line = f"{ts} {record.get('trace') or '-':16} {record['msg']:18} {fields}"
+    if record["level"] not in ("INFO", "DEBUG"):
+        line += f" [{record['level']}]"
+    if record.get("exception"):
+        line += "\n" + record["exception"].rstrip()
+    return line
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Хронология заказа из журнала событий")
+    parser.add_argument("key", help="trace id или номер заказа")
+    parser.add_argument("--log", default=EVENT_LOG or "logs/events.jsonl")
+    args = parser.parse_args()
+    records = timeline(args.log, args.key)
+    if not records:
+        print(f"В журнале нет записей для {args.key}")
+        return 1
+    for record in records:
+        print(format_record(record))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
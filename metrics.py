@@ -0,0 +1,260 @@
+import os
+import functools
+import asyncio
+from bisect import bisect_left
+from time import perf_counter
+
+from aiohttp import web
+from telegram.error import TelegramError
+from telegram.ext import ConversationHandler
+from telegram.request import HTTPXRequest
+
+from dispatch import dispatcher
+from eventlog import event
+from render import render_cache
+
+# 0 — отдельный сервер не поднимаем (в режиме webhook /metrics есть и на его порту)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "0.0.0.0")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Секунды: от быстрых ответов из кэша до правок, застрявших во flood control
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self.values = {}
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        for labels, value in sorted(self.values.items()):
+            yield f"{self.name}{_labels(self.label_names, labels)} {value}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self.buckets = tuple(buckets)
+        # labels -> [счётчики по корзинам + +Inf, сумма]; накопительные значения считаем только при выдаче
+        self.values = {}
+
+    def observe(self, value, *labels):
+        series = self.values.get(labels)
+        if series is None:
+            series = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self):
+        for labels, (counts, total) in sorted(self.values.items()):
+            running = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                running += count
+                le = _labels((*self.label_names, "le"), (*labels, bound))
+                yield f"{self.name}_bucket{le} {running}"
+            yield f"{self.name}_sum{_labels(self.label_names, labels)} {total}"
+            yield f"{self.name}_count{_labels(self.label_names, labels)} {running}"
+
+
+class Gauge:
+    # Значение читается в момент выдачи: на горячем пути ничего не считаем
+    def __init__(self, name, help, read, kind="gauge"):
+        self.name = name
+        self.help = help
+        self.read = read
+        self.kind = kind
+
+    def render(self):
+        yield f"{self.name} {self.read()}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+handler_seconds = registry.add(Histogram(
+    "bot_handler_seconds", "Время обработки апдейта обработчиком", ("handler",)))
+handler_errors = registry.add(Counter(
+    "bot_handler_errors_total", "Исключения, вылетевшие из обработчиков", ("handler", "error")))
+api_seconds = registry.add(Histogram(
+    "bot_api_request_seconds", "Длительность вызовов Bot API", ("method",)))
+api_requests = registry.add(Counter(
+    "bot_api_requests_total", "Вызовы Bot API по методу и результату (включая потом проглоченные ошибки)",
+    ("method", "result")))
+effect_errors = registry.add(Counter(
+    "bot_effect_errors_total", "Вызовы API из конвейера обработчика, закончившиеся ошибкой (после повторов)",
+    ("effect", "error")))
+backlog_updates = registry.add(Counter(
+    "bot_backlog_updates_total", "Апдейты, накопившиеся за время простоя: поставлены в очередь или схлопнуты",
+    ("result",)))
+idle_evictions = registry.add(Counter(
+    "bot_idle_evictions_total", "Черновики и диалоги сотрудников, вычищенные после простоя", ("kind",)))
+sla_breaches = registry.add(Counter(
+    "bot_sla_breaches_total", "Заказы, не выданные в срок зоны: напоминание в зоне или эскалация в general",
+    ("zone", "stage")))
+submit_duplicates = registry.add(Counter(
+    "bot_submit_duplicates_total", "Повторные нажатия \"Отправить\" с уже отправленным составом"))
+db_seconds = registry.add(Histogram(
+    "bot_db_query_seconds", "Длительность обращений к базе", ("query",)))
+registry.add(Gauge(
+    "bot_dispatch_queue_depth", "Вызовы Bot API, ждущие своей очереди в диспетчере", lambda: dispatcher.pending))
+registry.add(Gauge(
+    "bot_render_skipped_total", "Правки меню, пропущенные как не меняющие сообщение",
+    lambda: render_cache.skipped, kind="counter"))
+
+
+# ----------- Обработчики -----------
+
+def timed_handler(callback, name=None):
+    name = name or callback.__name__
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception as exc:
+            handler_errors.inc(name, type(exc).__name__)
+            raise
+        finally:
+            handler_seconds.observe(perf_counter() - started, name)
+
+    # Не по __wrapped__: его ставит любой декоратор на functools.wraps (например, pipelined)
+    wrapper.timed = True
+    return wrapper
+
+
+def instrument_handlers(application):
+    # Оборачиваем все зарегистрированные обработчики, включая шаги ConversationHandler
+    for handlers in application.handlers.values():
+        _instrument(handlers)
+
+
+def _instrument(handlers):
+    for handler in handlers:
+        if isinstance(handler, ConversationHandler):
+            _instrument(handler.entry_points)
+            for state_handlers in handler.states.values():
+                _instrument(state_handlers)
+            _instrument(handler.fallbacks)
+            continue
+        table = getattr(handler.callback, "table", None)
+        if table is not None:
+            # Общий диспетчер колбэков: меряем конкретные действия, а не сам диспетчер
+            for action, callback in table.items():
+                if not getattr(callback, "timed", False):
+                    table[action] = timed_handler(callback)
+        elif not getattr(handler.callback, "timed", False):
+            handler.callback = timed_handler(handler.callback)
+
+
+# ----------- Bot API -----------
+
+class MetricsRequest(HTTPXRequest):
+    # Все исходящие вызовы бота проходят здесь: ошибки считаются до того, как их проглотит обработчик
+    async def post(self, url, request_data=None, *args, **kwargs):
+        method = url.rsplit("/", 1)[-1]
+        started = perf_counter()
+        result = "ok"
+        try:
+            return await super().post(url, request_data, *args, **kwargs)
+        except TelegramError as exc:
+            result = type(exc).__name__
+            raise
+        finally:
+            elapsed = perf_counter() - started
+            api_seconds.observe(elapsed, method)
+            api_requests.inc(method, result)
+            # Long polling в журнал не пишем: он ничего не говорит о заказах
+            if method != "getUpdates":
+                event("api", method=method, result=result, ms=round(elapsed * 1000, 1))
+
+
+# ----------- База -----------
+
+def timed_query(func):
+    name = func.__name__
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                db_seconds.observe(perf_counter() - started, name)
+    else:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                db_seconds.observe(perf_counter() - started, name)
+    return wrapper
+
+
+# ----------- /metrics -----------
+
+async def metrics_view(request):
+    return web.Response(body=registry.render().encode(), headers={"Content-Type": CONTENT_TYPE})
+
+
+class MetricsServer:
+    def __init__(self):
+        self._runner = None
+
+    async def start(self, listen=METRICS_LISTEN, port=METRICS_PORT):
+        if self._runner is not None or not port:
+            return
+        app = web.Application()
+        app.router.add_get("/metrics", metrics_view)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, listen, port).start()
+
+    async def stop(self):
+        if self._runner is None:
+            return
+        await self._runner.cleanup()
+        self._runner = None
+
+
+metrics_server = MetricsServer()
@@ -0,0 +1,183 @@
+import os
+import json
+import random
+import asyncio
+from time import time
+
+from loguru import logger
+from telegram.error import BadRequest, Forbidden
+
+from db import get_due_outbox, get_next_outbox_due, get_order, save_outbox_results, save_outbox_sent
+from dispatch import dispatcher, PRIORITY_ORDER, GROUP_RATE_PER_MIN
+from eventlog import bind_trace, event
+from routing import router
+
+# Пачка — примерно минута отправок в группу (у заказа два поста): дольше строки не ждут своей очереди
+OUTBOX_BATCH = int(os.getenv("OUTBOX_BATCH", str(max(1, int(GROUP_RATE_PER_MIN // 2)))))
+OUTBOX_IDLE_POLL = float(os.getenv("OUTBOX_IDLE_POLL", "30"))
+OUTBOX_BACKOFF_BASE = float(os.getenv("OUTBOX_BACKOFF_BASE", "1"))
+OUTBOX_BACKOFF_MAX = float(os.getenv("OUTBOX_BACKOFF_MAX", "300"))
+# Ошибки вида "чат/топик не найден" не лечатся повтором: после стольких попыток строка помечается failed
+OUTBOX_MAX_PERMANENT_ATTEMPTS = int(os.getenv("OUTBOX_MAX_PERMANENT_ATTEMPTS", "5"))
+
+
+def backoff(attempts):
+    delay = min(OUTBOX_BACKOFF_MAX, OUTBOX_BACKOFF_BASE * 2 ** (attempts - 1))
+    return delay * random.uniform(0.8, 1.2)
+
+
+class Outbox:
+    def __init__(self):
+        self.bot = None
+        self.build_markup = None
+        self._wake = asyncio.Event()
+        self._task = None
+
+    async def start(self, bot, build_markup):
+        if self._task is not None:
+            return
+        self.bot = bot
+        self.build_markup = build_markup
+        # Event привязывается к циклу событий: при повторном запуске приложения (тесты) — новый.
+        # Первый проход цикла переотправляет всё, что осталось pending до рестарта
+        self._wake = asyncio.Event()
+        self._wake.set()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def notify(self):
+        self._wake.set()
+
+    async def _run(self):
+        while True:
+            try:
+                drained = await self.drain_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # БД недоступна — не крутимся вхолостую
+                logger.exception("outbox drain failed")
+                await asyncio.sleep(OUTBOX_BACKOFF_BASE)
+                continue
+            if drained >= OUTBOX_BATCH:
+                # Копился бэклог — сразу берём следующую пачку
+                continue
+            await self._sleep_until_due()
+
+    async def _sleep_until_due(self):
+        timeout = OUTBOX_IDLE_POLL
+        try:
+            due = await get_next_outbox_due()
+        except Exception:
+            due = None
+        if due is not None:
+            timeout = min(timeout, max(0.0, due - time()))
+        try:
+            await asyncio.wait_for(self._wake.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._wake.clear()
+
+    async def drain_once(self):
+        rows = await get_due_outbox(time(), OUTBOX_BATCH)
+        if not rows:
+            return 0
+        # Каждая строка сохраняет свой итог сама, как только закончит: рестарт посреди пачки
+        # не забывает уже ушедшие посты и не шлёт их второй раз
+        results = await asyncio.gather(*(self._deliver(row) for row in rows), return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                logger.opt(exception=result).error("outbox row not saved")
+        return len(rows)
+
+    async def _deliver(self, row):
+        outbox_id, order_id, _, payload, sent, attempts, trace = row
+        # Каждая доставка — своя задача в gather: trace не смешивается с соседними
+        bind_trace(trace)
+        sends = json.loads(payload)
+        # Корзина: {"orders": [...], "sends": [...]}, у одиночного заказа — просто список отправок
+        order_ids = [order_id]
+        if isinstance(sends, dict):
+            order_ids, sends = sends["orders"], sends["sends"]
+        sent = json.loads(sent)
+        markup = self.build_markup(order_ids)
+        # Уже доставленные части не переотправляем: ключ — индекс поста внутри заказа
+        pending = [(str(i), send) for i, send in enumerate(sends) if str(i) not in sent]
+
+        async def post(key, send):
+            # Текст заказа — свободный ввод сотрудника: без parse_mode, "<" и "&" в нём не ломают отправку
+            message = await dispatcher.submit(
+                send["chat_id"],
+                lambda: self.bot.send_message(reply_markup=markup, **send),
+                priority=PRIORITY_ORDER
+            )
+            sent[key] = message.message_id
+            try:
+                # Второй пост строки — копия в general
+                await save_outbox_sent(outbox_id, json.dumps(sent), order_ids, key == "1", message.message_id)
+            except Exception:
+                # Итог строки всё равно запишется ниже; не вышло и там — пост повторится после рестарта
+                logger.exception("outbox progress not saved")
+
+        results = await asyncio.gather(*(post(key, send) for key, send in pending), return_exceptions=True)
+
+        error = None
+        permanent = False
+        for result in results:
+            if isinstance(result, BaseException):
+                error = f"{type(result).__name__}: {result}"
+                permanent = permanent or isinstance(result, (BadRequest, Forbidden))
+
+        attempts += 1
+        if len(sent) == len(sends):
+            message_ids = [sent.get("0"), sent.get("1")]
+            event("order.delivered", order_ids=order_ids, attempts=attempts, message_ids=message_ids)
+            await save_outbox_results(
+                [("delivered", json.dumps(sent), attempts, 0, None, outbox_id)],
+                [(*message_ids, order_id) for order_id in order_ids]
+            )
+        elif permanent and attempts >= OUTBOX_MAX_PERMANENT_ATTEMPTS:
+            logger.error("order delivery failed for good: {}", error, order_ids=order_ids, attempts=attempts)
+            await save_outbox_results([("failed", json.dumps(sent), attempts, 0, error, outbox_id)], [])
+            await self._report_failure(order_ids, sends, sent)
+        else:
+            logger.warning("order delivery will be retried: {}", error, order_ids=order_ids, attempts=attempts)
+            await save_outbox_results(
+                [("pending", json.dumps(sent), attempts, time() + backoff(attempts), error, outbox_id)], []
+            )
+
+    async def _report_failure(self, order_ids, sends, sent):
+        # Сотрудник уже видел "Заказ отправлен": пишем ему в личку и в general, если упал не general
+        order = await get_order(order_ids[0])
+        if order is None:
+            return
+        user_id, table = order[1], order[4]
+        what = f"кальянов: {len(order_ids)}" if len(order_ids) > 1 else "кальян"
+        text = f"⚠️ Заказ на стол {table} ({what}) не дошёл до кальянной. Передайте его заново."
+        targets = [dict(chat_id=user_id)]
+        general_topic_id = router.topics.get("general")
+        if general_topic_id is not None and sends:
+            failed_threads = {send.get("message_thread_id") for i, send in enumerate(sends) if str(i) not in sent}
+            if general_topic_id not in failed_threads:
+                targets.append(dict(chat_id=sends[0]["chat_id"], message_thread_id=general_topic_id))
+        for target in targets:
+            try:
+                await dispatcher.submit(
+                    target["chat_id"],
+                    lambda target=target: self.bot.send_message(text=text, **target),
+                    priority=PRIORITY_ORDER
+                )
+            except Exception:
+                logger.exception("order failure notice not sent", chat_id=target["chat_id"])
+
+
+outbox = Outbox()
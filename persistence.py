@@ -0,0 +1,163 @@
+import os
+import json
+import pickle
+import asyncio
+from time import time
+
+from loguru import logger
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from db import db
+
+# PTB отдаёт изменения пачкой раз в интервал, мы пишем каждую пачку одной транзакцией
+PERSISTENCE_INTERVAL = float(os.getenv("PERSISTENCE_INTERVAL", "5"))
+# Пауза перед повтором, если пачка не записалась
+PERSISTENCE_RETRY = float(os.getenv("PERSISTENCE_RETRY", "5"))
+
+SQL_SELECT_USER_DATA = "SELECT data FROM user_data WHERE user_id = ?"
+SQL_UPSERT_USER_DATA = (
+    "INSERT INTO user_data (user_id, data, updated_at) VALUES (?, ?, ?) "
+    "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at"
+)
+SQL_DELETE_USER_DATA = "DELETE FROM user_data WHERE user_id = ?"
+SQL_SELECT_CONVERSATIONS = "SELECT key, state FROM conversations WHERE name = ?"
+SQL_UPSERT_CONVERSATION = (
+    "INSERT INTO conversations (name, key, state) VALUES (?, ?, ?) "
+    "ON CONFLICT(name, key) DO UPDATE SET state = excluded.state"
+)
+SQL_DELETE_CONVERSATION = "DELETE FROM conversations WHERE name = ? AND key = ?"
+
+
+class SQLitePersistence(BasePersistence):
+    def __init__(self, update_interval=PERSISTENCE_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self._loaded_users = set()
+        self._pending_users = {}
+        self._pending_conversations = {}
+        self._flush_task = None
+        self._retrying = False
+
+    # --- загрузка ---
+
+    async def get_user_data(self):
+        # user_data поднимаем лениво в refresh_user_data: старт не зависит от числа сотрудников
+        await db.open()
+        return {}
+
+    async def refresh_user_data(self, user_id, user_data):
+        if user_id in self._loaded_users:
+            return
+        self._loaded_users.add(user_id)
+        row = await db.fetchone(SQL_SELECT_USER_DATA, (user_id,))
+        if row and not user_data:
+            user_data.update(pickle.loads(row[0]))
+
+    async def get_conversations(self, name):
+        # Храним только незавершённые диалоги, поэтому грузить их целиком дёшево
+        await db.open()
+        rows = await db.fetchall(SQL_SELECT_CONVERSATIONS, (name,))
+        return {tuple(json.loads(key)): pickle.loads(state) for key, state in rows}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    # --- запись ---
+
+    async def update_user_data(self, user_id, data):
+        self._loaded_users.add(user_id)
+        self._pending_users[user_id] = data
+        self._schedule_flush()
+
+    async def drop_user_data(self, user_id):
+        self._loaded_users.discard(user_id)
+        self._pending_users[user_id] = None
+        self._schedule_flush()
+
+    async def update_conversation(self, name, key, new_state):
+        self._pending_conversations[(name, json.dumps(list(key)))] = new_state
+        self._schedule_flush()
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    def _schedule_flush(self):
+        # Все update_* одного прохода update_persistence попадают в одну транзакцию
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._write_pending())
+
+    async def _write_pending(self):
+        # Сбой записи не теряет пачку и не ждёт следующего апдейта: повторяем, пока не запишется.
+        # Изменения, пришедшие за паузу, копятся в буфере и уходят тем же повтором
+        await asyncio.sleep(0)
+        while True:
+            try:
+                await self._write()
+                return
+            except Exception:
+                logger.exception("persistence write failed, retrying in {}s", PERSISTENCE_RETRY)
+            self._retrying = True
+            try:
+                await asyncio.sleep(PERSISTENCE_RETRY)
+            finally:
+                self._retrying = False
+
+    async def _write(self):
+        users, self._pending_users = self._pending_users, {}
+        conversations, self._pending_conversations = self._pending_conversations, {}
+        if not users and not conversations:
+            return
+        now = int(time())
+        upserts = [(uid, pickle.dumps(data), now) for uid, data in users.items() if data is not None]
+        deletes = [(uid,) for uid, data in users.items() if data is None]
+        conv_upserts = [(name, key, pickle.dumps(state)) for (name, key), state in conversations.items()
+                        if state is not None]
+        conv_deletes = [(name, key) for (name, key), state in conversations.items() if state is None]
+        try:
+            async with db.writer() as conn:
+                if upserts:
+                    await conn.executemany(SQL_UPSERT_USER_DATA, upserts)
+                if deletes:
+                    await conn.executemany(SQL_DELETE_USER_DATA, deletes)
+                if conv_upserts:
+                    await conn.executemany(SQL_UPSERT_CONVERSATION, conv_upserts)
+                if conv_deletes:
+                    await conn.executemany(SQL_DELETE_CONVERSATION, conv_deletes)
+        except BaseException:
+            # Пачку не теряем: возвращаем в буфер, более свежие значения важнее
+            self._pending_users = {**users, **self._pending_users}
+            self._pending_conversations = {**conversations, **self._pending_conversations}
+            raise
+
+    async def flush(self):
+        task = self._flush_task
+        if task is not None and not task.done():
+            if self._retrying:
+                # На останове паузу перед повтором не ждём: буфер пишется сразу ниже
+                task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        await self._write()
@@ -0,0 +1,65 @@
+import os
+from collections import OrderedDict
+
+from telegram.error import BadRequest
+
+RENDER_CACHE_SIZE = int(os.getenv("RENDER_CACHE_SIZE", "10000"))
+
+
+class RenderCache:
+    # Последние текст и клавиатура каждого сообщения меню: одинаковую правку не шлём в API
+    def __init__(self, size=RENDER_CACHE_SIZE):
+        self.size = size
+        self._last = OrderedDict()
+        self.skipped = 0
+
+    def is_current(self, chat_id, message_id, text, reply_markup):
+        last = self._last.get((chat_id, message_id))
+        return last is not None and last[0] == text and last[1] == reply_markup
+
+    def remember(self, chat_id, message_id, text, reply_markup):
+        key = (chat_id, message_id)
+        self._last[key] = (text, reply_markup)
+        self._last.move_to_end(key)
+        if len(self._last) > self.size:
+            self._last.popitem(last=False)
+
+    def forget(self, chat_id, message_id):
+        self._last.pop((chat_id, message_id), None)
+
+
+render_cache = RenderCache()
+
+
+def remember_message(message, reply_markup=None):
+    render_cache.remember(message.chat_id, message.message_id, message.text, reply_markup)
+
+
+async def edit_message(bot, chat_id, message_id, text, reply_markup=None):
+    # Возвращает False, если правка не понадобилась
+    if render_cache.is_current(chat_id, message_id, text, reply_markup):
+        render_cache.skipped += 1
+        return False
+    try:
+        await bot.edit_message_text(text, chat_id=chat_id, message_id=message_id, reply_markup=reply_markup)
+    except BadRequest as exc:
+        if "not modified" not in str(exc).lower():
+            render_cache.forget(chat_id, message_id)
+            raise
+    render_cache.remember(chat_id, message_id, text, reply_markup)
+    return True
+
+
+async def edit_reply_markup(bot, chat_id, message_id, reply_markup):
+    # Правка только клавиатуры: текст сообщения в кэше не храним
+    if render_cache.is_current(chat_id, message_id, None, reply_markup):
+        render_cache.skipped += 1
+        return False
+    try:
+        await bot.edit_message_reply_markup(chat_id=chat_id, message_id=message_id, reply_markup=reply_markup)
+    except BadRequest as exc:
+        if "not modified" not in str(exc).lower():
+            render_cache.forget(chat_id, message_id)
+            raise
+    render_cache.remember(chat_id, message_id, None, reply_markup)
+    return True
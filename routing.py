@@ -0,0 +1,131 @@
+import os
+import json
+import asyncio
+from bisect import bisect_right
+
+from loguru import logger
+
+ZONES_FILE = os.getenv("ZONES_FILE", "config/zones.json")
+ZONES_RELOAD_INTERVAL = float(os.getenv("ZONES_RELOAD_INTERVAL", "5"))
+# Сколько секунд заказ может ждать выдачи в зоне без своего "sla" в раскладке
+SLA_DEFAULT = int(os.getenv("SLA_DEFAULT", "900"))
+
+# Раскладка по умолчанию, если файла нет: совпадает с config/zones.json из репозитория
+DEFAULT_LAYOUT = {
+    "topics": {"1 Зона": 5, "2 Зона": 2, "2 Этаж": 6, "general": 2446094747},
+    "zones": [
+        {"name": "1 Зона", "topic": "1 Зона", "ranges": [[1, 16]], "tables": ["101", "102", "103"], "sla": 900},
+        {"name": "2 Зона", "topic": "2 Зона", "ranges": [[17, 32]], "tables": ["104", "105"], "sla": 900},
+        {"name": "2 Этаж", "topic": "2 Этаж", "ranges": [[33, 47]], "tables": ["201", "777"], "sla": 1200},
+    ],
+    "fallback": {"name": "General", "topic": "general"},
+}
+
+
+class ZoneTable:
+    # Скомпилированная раскладка: dict для именованных столов + отсортированные интервалы для номеров
+    __slots__ = ("topics", "named", "starts", "ends", "targets", "fallback", "zones")
+
+    def __init__(self, layout):
+        self.topics = dict(layout["topics"])
+        fallback = layout.get("fallback", {"name": "General", "topic": "general"})
+        self.fallback = (fallback["name"], self.topics.get(fallback["topic"]))
+        # Имя зоны -> (топик, SLA): по ним напоминают о заказах, которые уже записаны с именем зоны
+        self.zones = {fallback["name"]: (self.fallback[1], int(fallback.get("sla", SLA_DEFAULT)))}
+        self.named = {}
+        intervals = []
+        for zone in layout["zones"]:
+            target = (zone["name"], self.topics.get(zone.get("topic", zone["name"])))
+            self.zones[zone["name"]] = (target[1], int(zone.get("sla", SLA_DEFAULT)))
+            for table in zone.get("tables", []):
+                table = str(table).strip()
+                if table in self.named:
+                    raise ValueError(f"Стол {table} указан в нескольких зонах")
+                self.named[table] = target
+            for low, high in zone.get("ranges", []):
+                if low > high:
+                    raise ValueError(f"Пустой диапазон {low}-{high} в зоне {zone['name']}")
+                intervals.append((low, high, target))
+        intervals.sort(key=lambda item: item[0])
+        for (_, prev_high, prev), (low, _, cur) in zip(intervals, intervals[1:]):
+            if low <= prev_high:
+                raise ValueError(f"Диапазоны зон {prev[0]} и {cur[0]} пересекаются")
+        self.starts = [low for low, _, _ in intervals]
+        self.ends = [high for _, high, _ in intervals]
+        self.targets = [target for _, _, target in intervals]
+
+    def lookup(self, table_number: str):
+        table_number = table_number.strip()
+        target = self.named.get(table_number)
+        if target is not None:
+            return target
+        try:
+            num = int(table_number)
+        except ValueError:
+            return self.fallback
+        i = bisect_right(self.starts, num) - 1
+        if i >= 0 and num <= self.ends[i]:
+            return self.targets[i]
+        return self.fallback
+
+
+class ZoneRouter:
+    def __init__(self, path=ZONES_FILE):
+        self.path = path
+        self.table = ZoneTable(DEFAULT_LAYOUT)
+        self._mtime = None
+        self._task = None
+
+    @property
+    def topics(self):
+        return self.table.topics
+
+    def lookup(self, table_number: str):
+        return self.table.lookup(table_number)
+
+    def zone(self, name):
+        # Зону могли переименовать, пока заказ ждал: тогда напоминание идёт в general с SLA по умолчанию
+        table = self.table
+        return table.zones.get(name) or (table.topics.get("general"), SLA_DEFAULT)
+
+    def reload(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        if mtime == self._mtime:
+            return False
+        with open(self.path, encoding="utf-8") as f:
+            table = ZoneTable(json.load(f))
+        # Подмена одной ссылкой: обработчики видят либо старую, либо новую раскладку целиком
+        self.table = table
+        self._mtime = mtime
+        return True
+
+    async def start(self):
+        if self._task is not None:
+            return
+        self.reload()
+        self._task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(ZONES_RELOAD_INTERVAL)
+            try:
+                self.reload()
+            except (OSError, ValueError, KeyError, TypeError) as exc:
+                # Битый файл — продолжаем работать на прежней раскладке
+                logger.warning("{} not reloaded: {!r}", self.path, exc)
+
+
+router = ZoneRouter()
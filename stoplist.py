@@ -0,0 +1,246 @@
+import os
+import re
+import asyncio
+import tempfile
+
+from loguru import logger
+
+STOPLIST_FILE = os.getenv("STOPLIST_FILE", "config/stoplist.txt")
+STOPLIST_RELOAD_INTERVAL = float(os.getenv("STOPLIST_RELOAD_INTERVAL", "5"))
+# Короче этого слово сравнивается только целиком, длиннее — по основе и окончанию из списка ниже
+STOPLIST_MIN_STEM = 4
+
+TOKEN_RE = re.compile(r"[^\W_]+")
+
+WHOLE = frozenset({""})
+# Окончания существительного: "мята" ловит "мятой", но не "мятая", "кола" — "колой", но не "колада".
+# И прилагательное от него: "мятный", "лаймовый"
+NOUN_ENDINGS = frozenset({
+    "", "а", "я", "ы", "и", "у", "ю", "е", "о", "ь", "й", "ой", "ей", "ою", "ею", "ью",
+    "ом", "ем", "ам", "ям", "ами", "ями", "ах", "ях", "ов", "ев",
+})
+ADJ_ENDINGS = frozenset({
+    "ый", "ий", "ой", "ая", "яя", "ое", "ее", "ые", "ие", "ого", "его", "ому", "ему",
+    "ым", "им", "ую", "юю", "ых", "их", "ыми", "ими",
+})
+NOUN_ENDINGS |= {suffix + ending for suffix in ("н", "нн", "ов", "ев") for ending in ADJ_ENDINGS}
+VOWELS = set("аяыиуюеоэьй")
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.casefold().replace("ё", "е"))
+
+
+def stem(token):
+    # (основа, допустимые окончания): грубо, но без словарей
+    if len(token) < STOPLIST_MIN_STEM:
+        return token, WHOLE
+    if token[-2:] in ADJ_ENDINGS:
+        return token[:-2], ADJ_ENDINGS
+    if token[-1] in VOWELS:
+        return token[:-1], NOUN_ENDINGS
+    return token, NOUN_ENDINGS
+
+
+def part_matches(token, part):
+    base, endings = part
+    return token.startswith(base) and token[len(base):] in endings
+
+
+def entry_key(raw):
+    return tuple(stem(t) for t in tokenize(raw))
+
+
+class _Node:
+    __slots__ = ("children", "entries")
+
+    def __init__(self):
+        self.children = {}
+        self.entries = set()
+
+
+class StopListIndex:
+    # Префиксное дерево по основе первого слова каждой позиции; окончание и остальные слова проверяются по месту
+    def __init__(self):
+        self.root = _Node()
+        self.entries = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, raw):
+        tokens = entry_key(raw)
+        if not tokens or tokens in self.entries:
+            return False
+        self.entries[tokens] = raw.strip()
+        node = self.root
+        for ch in tokens[0][0]:
+            node = node.children.setdefault(ch, _Node())
+        node.entries.add(tokens)
+        return True
+
+    def remove(self, raw):
+        tokens = entry_key(raw)
+        if tokens not in self.entries:
+            return False
+        del self.entries[tokens]
+        path = [self.root]
+        for ch in tokens[0][0]:
+            path.append(path[-1].children[ch])
+        path[-1].entries.discard(tokens)
+        # Подчищаем опустевшие ветки
+        for ch, parent, node in zip(reversed(tokens[0][0]), reversed(path[:-1]), reversed(path[1:])):
+            if node.entries or node.children:
+                break
+            del parent.children[ch]
+        return True
+
+    def match(self, text):
+        tokens = tokenize(text)
+        found = []
+        for i, token in enumerate(tokens):
+            node = self.root
+            for ch in token:
+                node = node.children.get(ch)
+                if node is None:
+                    break
+                for entry in node.entries:
+                    if self._tail_matches(entry, tokens, i):
+                        found.append(self.entries[entry])
+        return list(dict.fromkeys(found))
+
+    @staticmethod
+    def _tail_matches(entry, tokens, start):
+        if start + len(entry) > len(tokens):
+            return False
+        return all(part_matches(tokens[start + k], part) for k, part in enumerate(entry))
+
+
+class StopList:
+    def __init__(self, path=STOPLIST_FILE):
+        self.path = path
+        self.index = StopListIndex()
+        self._lines = []
+        self._mtime = None
+        self._task = None
+        self._lock = asyncio.Lock()
+
+    def check(self, text):
+        if not text or not self.index.entries:
+            return []
+        return self.index.match(text)
+
+    @property
+    def items(self):
+        return list(self._lines)
+
+    def _read(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                content = f.read()
+        except FileNotFoundError:
+            return []
+        return [line.strip() for line in content.splitlines() if line.strip() and not line.lstrip().startswith("#")]
+
+    def _apply(self, lines):
+        # Инкрементально: в индекс уходят только добавленные и удалённые позиции
+        old = {entry_key(raw): raw for raw in self._lines}
+        new = {}
+        for raw in lines:
+            new.setdefault(entry_key(raw), raw)
+        for key in old.keys() - new.keys():
+            self.index.remove(old[key])
+        for key, raw in new.items():
+            if key not in old:
+                self.index.add(raw)
+        self._lines = lines
+
+    def reload(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._mtime:
+            return False
+        self._apply(self._read())
+        self._mtime = mtime
+        return True
+
+    def _write(self, lines):
+        # Комментарии и пустые строки файла остаются на своих местах, убранные позиции выпадают,
+        # новые дописываются в конец
+        wanted = {entry_key(line): line for line in lines}
+        content = []
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                existing = f.read().splitlines()
+            mode = os.stat(self.path).st_mode
+        except FileNotFoundError:
+            existing = []
+            mode = None
+        for raw in existing:
+            line = raw.strip()
+            if not line or line.startswith("#"):
+                content.append(raw)
+            elif entry_key(line) in wanted:
+                content.append(wanted.pop(entry_key(line)))
+        content.extend(wanted.values())
+        # Временный файл и rename: читатель видит либо старый стоп-лист, либо новый целиком.
+        # Каталог config смонтирован целиком, так что rename работает и в контейнере
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".stoplist-")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write("".join(f"{line}\n" for line in content))
+                f.flush()
+                os.fsync(f.fileno())
+            if mode is not None:
+                os.chmod(tmp, mode)
+            os.replace(tmp, self.path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+    async def edit(self, add=(), remove=()):
+        async with self._lock:
+            self.reload()
+            remove_keys = {entry_key(raw) for raw in remove}
+            lines = [line for line in self._lines if entry_key(line) not in remove_keys]
+            keys = {entry_key(line) for line in lines}
+            for raw in add:
+                raw = raw.strip()
+                if raw and entry_key(raw) and entry_key(raw) not in keys:
+                    lines.append(raw)
+                    keys.add(entry_key(raw))
+            await asyncio.to_thread(self._write, lines)
+            self._apply(lines)
+            self._mtime = os.stat(self.path).st_mtime_ns
+            return lines
+
+    async def start(self):
+        if self._task is not None:
+            return
+        self.reload()
+        self._task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(STOPLIST_RELOAD_INTERVAL)
+            try:
+                self.reload()
+            except OSError as exc:
+                logger.warning("{} not reloaded: {!r}", self.path, exc)
+
+
+stoplist = StopList()
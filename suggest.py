@@ -0,0 +1,170 @@
+import os
+import asyncio
+from time import time
+
+from loguru import logger
+
+from db import db
+from stoplist import tokenize
+
+# Вес заказа убывает вдвое за AROMA_HALF_LIFE_DAYS: сезонные вкусы уходят из подсказок сами
+AROMA_HALF_LIFE_DAYS = float(os.getenv("AROMA_HALF_LIFE_DAYS", "14"))
+AROMA_SUGGESTIONS = int(os.getenv("AROMA_SUGGESTIONS", "6"))
+# Как часто изменившиеся веса сбрасываются в базу; при остановке сбрасываются всегда
+AROMA_CHECKPOINT_INTERVAL = float(os.getenv("AROMA_CHECKPOINT_INTERVAL", "60"))
+# После стольких периодов полураспада отсчёт весов переносится, чтобы 2**x не переполнился
+REBASE_AFTER = 512
+
+SQL_SELECT_AROMAS = "SELECT key, display, score, updated_at FROM aroma_stats"
+SQL_UPSERT_AROMA = (
+    "INSERT INTO aroma_stats (key, display, score, updated_at) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT(key) DO UPDATE SET display = excluded.display, score = excluded.score, "
+    "updated_at = excluded.updated_at"
+)
+SQL_HAS_AROMAS = "SELECT 1 FROM aroma_stats LIMIT 1"
+SQL_SELECT_ORDER_AROMAS = "SELECT aroma, created_at FROM orders WHERE aroma IS NOT NULL ORDER BY id"
+
+
+def aroma_key(text):
+    # "Двойное  Яблоко" и "двойное яблоко" — одна позиция
+    return " ".join(tokenize(text or ""))
+
+
+class _Aroma:
+    __slots__ = ("key", "words", "weight", "variants")
+
+    def __init__(self, key):
+        self.key = key
+        self.words = key.split()
+        self.weight = 0.0
+        # Написание -> вес: на кнопке показываем самое частое
+        self.variants = {}
+
+    @property
+    def display(self):
+        return max(self.variants, key=self.variants.get)
+
+    def matches(self, prefix_words):
+        return all(any(word.startswith(p) for word in self.words) for p in prefix_words)
+
+
+class AromaSuggestions:
+    # Прямое затухание: заказ в момент t весит 2**((t - landmark) / half_life), поэтому веса
+    # не пересчитываются со временем и порядок позиций меняется только при новых заказах
+    def __init__(self, half_life_days=AROMA_HALF_LIFE_DAYS):
+        self.half_life = half_life_days * 86400
+        self.landmark = time()
+        self.entries = {}
+        self._dirty = set()
+        self._task = None
+
+    def _weight(self, ts):
+        return 2 ** ((ts - self.landmark) / self.half_life)
+
+    def _rebase(self, now):
+        factor = self._weight(now)
+        for entry in self.entries.values():
+            entry.weight /= factor
+            for display in entry.variants:
+                entry.variants[display] /= factor
+        self.landmark = now
+
+    def record(self, text, ts=None):
+        key = aroma_key(text)
+        if not key:
+            return
+        ts = time() if ts is None else ts
+        if (ts - self.landmark) / self.half_life > REBASE_AFTER:
+            self._rebase(ts)
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = _Aroma(key)
+        added = self._weight(ts)
+        entry.weight += added
+        display = " ".join(text.split())
+        entry.variants[display] = entry.variants.get(display, 0.0) + added
+        self._dirty.add(key)
+
+    def known(self, text):
+        return aroma_key(text) in self.entries
+
+    def top(self, prefix="", limit=AROMA_SUGGESTIONS, skip=None):
+        # prefix — начала слов в любом порядке: "яб дв" находит "Двойное яблоко"
+        prefix_words = tokenize(prefix) if prefix else []
+        candidates = [e for e in self.entries.values() if not prefix_words or e.matches(prefix_words)]
+        candidates.sort(key=lambda e: e.weight, reverse=True)
+        found = []
+        for entry in candidates:
+            display = entry.display
+            if skip is not None and skip(display):
+                continue
+            found.append(display)
+            if len(found) >= limit:
+                break
+        return found
+
+    # ----------- База -----------
+
+    def load(self, rows):
+        # score — вес на момент updated_at в "сегодняшних" единицах
+        for key, display, score, updated_at in rows:
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = self.entries[key] = _Aroma(key)
+            weight = score * self._weight(updated_at)
+            entry.weight += weight
+            entry.variants[display] = entry.variants.get(display, 0.0) + weight
+
+    async def checkpoint(self):
+        if not self._dirty:
+            return 0
+        keys, self._dirty = self._dirty, set()
+        now = int(time())
+        scale = self._weight(now)
+        rows = [(key, self.entries[key].display, self.entries[key].weight / scale, now) for key in keys]
+        try:
+            async with db.writer() as conn:
+                await conn.executemany(SQL_UPSERT_AROMA, rows)
+        except Exception:
+            # Не записали — попробуем в следующий раз
+            self._dirty |= keys
+            raise
+        return len(rows)
+
+    async def _backfill(self):
+        # Первый запуск: историю берём из уже сохранённых заказов
+        if await db.fetchone(SQL_HAS_AROMAS):
+            return
+        for aroma, created_at in await db.fetchall(SQL_SELECT_ORDER_AROMAS):
+            self.record(aroma, created_at)
+
+    async def start(self):
+        if self._task is not None:
+            return
+        self.load(await db.fetchall(SQL_SELECT_AROMAS))
+        await self._backfill()
+        await self.checkpoint()
+        self._task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await self.checkpoint()
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(AROMA_CHECKPOINT_INTERVAL)
+            try:
+                await self.checkpoint()
+            except Exception:
+                # Не записанные ароматики остаются в _dirty и уйдут со следующей попыткой
+                logger.exception("aroma checkpoint failed")
+
+
+aroma_suggestions = AromaSuggestions()
@@ -0,0 +1,119 @@
+import os
+import asyncio
+from collections.abc import MutableMapping
+from time import monotonic
+
+from loguru import logger
+from telegram.ext import ConversationHandler
+
+from drafts import get_draft
+from metrics import idle_evictions
+
+# Сколько секунд без единого апдейта черновик и незавершённый диалог сотрудника живут в памяти; 0 — вечно
+IDLE_TTL = int(os.getenv("IDLE_TTL", "43200"))
+IDLE_SWEEP_INTERVAL = float(os.getenv("IDLE_SWEEP_INTERVAL", "300"))
+
+
+def conversation_states(conv):
+    # Публичного способа завершить чужой диалог у PTB нет: состояния лежат в приватном
+    # ConversationHandler._conversations, ключ — (chat_id, user_id). Все обращения к нему — только здесь.
+    # Уберут в новой версии PTB — диалоги просто перестанут вычищаться
+    states = getattr(conv, "_conversations", None)
+    if not isinstance(states, MutableMapping):
+        logger.warning("ConversationHandler {} has no _conversations, idle conversations are not swept", conv.name)
+        return None
+    return states
+
+
+class IdleSweeper:
+    # Сотрудник, ушедший со смены посреди заказа, больше не держит в памяти черновик и состояние диалога:
+    # раз в интервал всё, что не трогали дольше IDLE_TTL, удаляется и из памяти, и из базы
+    def __init__(self, ttl=IDLE_TTL, interval=IDLE_SWEEP_INTERVAL):
+        self.ttl = ttl
+        self.interval = interval
+        self.last_seen = {}
+        self.evicted = 0
+        self._application = None
+        self._conversations = []
+        self._task = None
+
+    def touch(self, user_id, now=None):
+        self.last_seen[user_id] = monotonic() if now is None else now
+
+    async def start(self, application):
+        if self._task is not None or self.ttl <= 0:
+            return
+        self._application = application
+        self._conversations = [
+            handler for handlers in application.handlers.values() for handler in handlers
+            if isinstance(handler, ConversationHandler) and conversation_states(handler) is not None
+        ]
+        # Диалоги, поднятые из базы при старте: их владельцы ещё ничего не присылали, отсчёт — с подъёма
+        now = monotonic()
+        for conv in self._conversations:
+            for key in conversation_states(conv) or ():
+                self.last_seen.setdefault(key[-1], now)
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except Exception:
+                logger.exception("idle sweep failed")
+
+    async def sweep(self, now=None):
+        now = monotonic() if now is None else now
+        idle = {uid for uid, seen in self.last_seen.items() if now - seen >= self.ttl}
+        if not idle:
+            return 0
+        application = self._application
+        for uid in idle:
+            del self.last_seen[uid]
+            if uid in application.user_data:
+                # Из базы запись удалит ближайший update_persistence
+                application.drop_user_data(uid)
+                idle_evictions.inc("user_data")
+        for conv in self._conversations:
+            # Словарь берём заново: PTB подменяет его, когда поднимает диалоги из базы
+            states = conversation_states(conv)
+            if states is None:
+                continue
+            for key in [key for key in states if key[-1] in idle]:
+                del states[key]
+                idle_evictions.inc("conversation")
+                if conv.persistent and application.persistence is not None:
+                    await application.persistence.update_conversation(conv.name, key, None)
+        self.evicted += len(idle)
+        return len(idle)
+
+
+idle_sweeper = IdleSweeper()
+
+
+async def track_activity(update, context):
+    # Группа -1: видит каждый апдейт раньше остальных обработчиков и ничего не перехватывает
+    user = update.effective_user
+    if user is None:
+        return
+    idle_sweeper.touch(user.id)
+    query = update.callback_query
+    if query is not None and query.message is not None and query.message.chat.type == "private":
+        # Черновик могли вычистить, а меню у сотрудника осталось: следующая правка пойдёт в него
+        order = get_draft(context)
+        if order.order_msg_id is None:
+            order.order_msg_id = query.message.message_id
+
+# Сама отметка не меряется: она есть у каждого апдейта и ничего не говорит о задержках
+track_activity.timed = True
@@ -0,0 +1,96 @@
+# Настоящий bot1 против подделки Bot API: сотрудник жмёт кнопки и пишет в личку,
+# тест смотрит, что бот ответил и что записал в базу
+import asyncio
+import sqlite3
+from contextlib import asynccontextmanager
+
+from aiohttp import web
+
+from benchmarks.fake_bot_api import FakeBotApi
+
+STAFF = 1000
+
+
+class RecordingBotApi(FakeBotApi):
+    # Запоминает ответы на колбэки; fail(params) — ошибка Bot API для отправки, которая должна упасть
+    def __init__(self, fail=None):
+        super().__init__()
+        self.answers = {}
+        self.fail = fail
+
+    def _answerCallbackQuery(self, params):
+        self.answers[params["callback_query_id"]] = params.get("text")
+        return True
+
+    async def handle(self, request):
+        if self.fail is not None and request.match_info["method"] == "sendMessage":
+            description = self.fail(dict(await request.post()))
+            if description:
+                self.calls["sendMessage"] += 1
+                return web.json_response({"ok": False, "error_code": 400, "description": description}, status=400)
+        return await super().handle(request)
+
+
+def user():
+    return {"id": STAFF, "is_bot": False, "first_name": "staff", "username": "staff"}
+
+
+def tap(api, message_id, data, chat_id=STAFF):
+    update_id = api.next_update_id()
+    api.push({"update_id": update_id, "callback_query": {
+        "id": str(update_id), "from": user(), "chat_instance": str(chat_id),
+        "data": data, "message": api.message(chat_id, message_id),
+    }})
+    return str(update_id)
+
+
+def type_text(api, text):
+    api.push({"update_id": api.next_update_id(), "message": {
+        "message_id": api.new_message_id(STAFF), "date": 0,
+        "chat": {"id": STAFF, "type": "private"}, "from": user(), "text": text,
+    }})
+
+
+def fill_hookah(api, menu_id, aroma, table=None):
+    import bot1
+    import callbacks as cb
+    from callbacks import encode
+
+    if table is not None:
+        tap(api, menu_id, encode(cb.EDIT, "table"))
+        type_text(api, table)
+    tap(api, menu_id, encode(cb.AROMA, aroma))
+    tap(api, menu_id, encode(cb.EDIT, "strength"))
+    tap(api, menu_id, encode(cb.STRENGTH, bot1.STRENGTH_KEYBOARD.inline_keyboard[0][0].text))
+
+
+async def answered(api, taps):
+    while not all(tap_id in api.answers for tap_id in taps):
+        await asyncio.sleep(0.01)
+
+
+def query(sql, params=()):
+    with sqlite3.connect("templates.db") as conn:
+        return conn.execute(sql, params).fetchall()
+
+
+@asynccontextmanager
+async def running_bot(api, port):
+    import bot1
+    from telegram.ext import Application
+
+    base_url = await api.start(port=port)
+    app = bot1.build_application(Application.builder().token("123:test").base_url(base_url))
+    await app.initialize()
+    await app.post_init(app)
+    await app.updater.start_polling(poll_interval=0.0)
+    await app.start()
+    try:
+        yield app
+    finally:
+        await app.updater.stop()
+        await app.stop()
+        await app.post_stop(app)
+        await app.shutdown()
+        await app.post_shutdown(app)
+        await api.stop()
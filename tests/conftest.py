@@ -0,0 +1,8 @@
+import os
+import sys
+
+# Модули бота лежат в корне репозитория и читают настройки при импорте
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "123:test")
+os.environ.setdefault("TARGET_CHAT_ID", "-100500")
+os.environ.setdefault("METRICS_PORT", "0")
@@ -0,0 +1,32 @@
+# Раскладки для проверки маршрутизации: прежняя цепочка if-ов из bot1 — эталон для DEFAULT_LAYOUT,
+# большая синтетическая — для индекса интервалов. Ими же пользуется benchmarks/bench_routing.py
+from routing import DEFAULT_LAYOUT
+
+TOPICS = DEFAULT_LAYOUT["topics"]
+
+
+def legacy_get_zone_and_topic_id(table_number: str):
+    table_number = table_number.strip()
+    try:
+        num = int(table_number)
+    except ValueError:
+        num = None
+    if (num is not None and 1 <= num <= 16) or table_number in ["101", "102", "103"]:
+        return "1 Зона", TOPICS["1 Зона"]
+    if (num is not None and 17 <= num <= 32) or table_number in ["104", "105"]:
+        return "2 Зона", TOPICS["2 Зона"]
+    if (num is not None and 33 <= num <= 47) or table_number in ["201", "777"]:
+        return "2 Этаж", TOPICS["2 Этаж"]
+    return "General", TOPICS["general"]
+
+
+def big_layout(zones=2000):
+    layout = {"topics": {"general": 1}, "zones": [], "fallback": {"name": "General", "topic": "general"}}
+    for i in range(zones):
+        layout["topics"][f"z{i}"] = i + 10
+        layout["zones"].append({
+            "name": f"z{i}",
+            "ranges": [[i * 100 + 1, i * 100 + 50]],
+            "tables": [f"T{i}-{j}" for j in range(5)],
+        })
+    return layout
@@ -0,0 +1,25 @@
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import analytics
+from analytics import day_start, hour_start
+
+MOSCOW = ZoneInfo("Europe/Moscow")
+
+
+def test_day_buckets_follow_bar_timezone(monkeypatch):
+    monkeypatch.setattr(analytics, "TZ", MOSCOW)
+    # 05:30 по Москве — ещё прошлые рабочие сутки, 06:30 — уже новые; в UTC это 02:30 и 03:30
+    before = int(datetime(2026, 3, 10, 5, 30, tzinfo=MOSCOW).timestamp())
+    after = int(datetime(2026, 3, 10, 6, 30, tzinfo=MOSCOW).timestamp())
+    assert day_start(before) == int(datetime(2026, 3, 9, 6, tzinfo=MOSCOW).timestamp())
+    assert day_start(after) == int(datetime(2026, 3, 10, 6, tzinfo=MOSCOW).timestamp())
+    assert hour_start(after) == int(datetime(2026, 3, 10, 6, tzinfo=MOSCOW).timestamp())
+
+
+def test_day_start_across_dst(monkeypatch):
+    berlin = ZoneInfo("Europe/Berlin")
+    monkeypatch.setattr(analytics, "TZ", berlin)
+    # Ночь перевода часов: сутки всё равно начинаются в 06:00 по местному времени
+    ts = int(datetime(2026, 3, 29, 12, tzinfo=berlin).timestamp())
+    assert datetime.fromtimestamp(day_start(ts), berlin) == datetime(2026, 3, 29, 6, tzinfo=berlin)
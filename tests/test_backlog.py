@@ -0,0 +1,81 @@
+from datetime import datetime, timezone
+
+from telegram import CallbackQuery, Chat, InlineQuery, Message, Update, User
+
+import callbacks as cb
+from backlog import coalesce
+
+STAFF = User(1, "Staff", False)
+OTHER = User(2, "Other", False)
+CHAT = Chat(1, Chat.PRIVATE)
+DATE = datetime(2026, 1, 1, tzinfo=timezone.utc)
+ids = iter(range(1, 10 ** 6))
+
+
+def tap(message_id, data, user=STAFF):
+    message = Message(message_id, DATE, CHAT)
+    query = CallbackQuery(str(next(ids)), user, "chat", message=message, data=data)
+    return Update(next(ids), callback_query=query)
+
+
+def text(value, user=STAFF):
+    return Update(next(ids), message=Message(next(ids), DATE, CHAT, from_user=user, text=value))
+
+
+def inline(value, user=STAFF):
+    return Update(next(ids), inline_query=InlineQuery(str(next(ids)), user, value, ""))
+
+
+def test_keeps_last_choice_per_field():
+    updates = [
+        tap(10, cb.encode(cb.EDIT, "strength")),
+        tap(10, cb.encode(cb.STRENGTH, "Лёгкая")),
+        tap(10, cb.encode(cb.EDIT, "strength")),
+        tap(10, cb.encode(cb.STRENGTH, "Крепкая")),
+        tap(10, cb.encode(cb.BOWL, "Глина")),
+        # Другое сообщение и другой сотрудник — свои поля
+        tap(11, cb.encode(cb.STRENGTH, "Средняя")),
+        tap(10, cb.encode(cb.STRENGTH, "Средняя"), user=OTHER),
+        tap(10, cb.encode(cb.NOOP)),
+    ]
+    kept = coalesce(updates)
+    assert kept == [updates[i] for i in (3, 4, 5, 6, 7)]
+
+
+def test_state_changes_and_text_are_never_dropped():
+    updates = [
+        tap(10, cb.encode(cb.STRENGTH, "Лёгкая")),
+        tap(10, cb.encode(cb.CART_ADD)),
+        tap(10, cb.encode(cb.STRENGTH, "Крепкая")),
+        tap(10, cb.encode(cb.EDIT, "table")),
+        text("12"),
+        tap(10, cb.encode(cb.EDIT, "table")),
+        text("/start"),
+        tap(10, cb.encode(cb.SEND_ORDER)),
+        tap(10, cb.encode(cb.SEND_ORDER)),
+        tap(20, "order_done_5"),
+        tap(20, "order_done_5"),
+    ]
+    # Выбор поля перед добавлением в корзину уже в корзине: после неё он снова нужен
+    assert coalesce(updates) == updates
+
+
+def test_inline_queries_keep_last_per_user_and_order():
+    updates = [
+        inline("м"),
+        tap(10, cb.encode(cb.EDIT, "aroma")),
+        inline("м", user=OTHER),
+        inline("мя"),
+        tap(10, cb.encode(cb.AROMA, "Мята")),
+        inline("мят"),
+        text("unknown tap"),
+    ]
+    kept = coalesce(updates)
+    # Перерисовку меню перекрывает следующее нажатие на том же сообщении
+    assert kept == [updates[i] for i in (2, 4, 5, 6)]
+    assert [u.update_id for u in kept] == sorted(u.update_id for u in kept)
+
+
+def test_unknown_callback_data_is_kept():
+    updates = [tap(10, "garbage"), tap(10, cb.encode(cb.EDIT, "table")), tap(10, "garbage")]
+    assert coalesce(updates) == updates
@@ -0,0 +1,74 @@
+import pytest
+
+import callbacks as cb
+from callbacks import Callback, PayloadStore, decode, encode, matches
+
+
+def test_round_trip():
+    assert encode(cb.ORDER_DONE, 12345) == "1d:#3D7"
+    assert decode(encode(cb.ORDER_DONE, 12345)) == Callback(cb.ORDER_DONE, (12345,))
+    assert decode(encode(cb.QUICK_MENU, -3)) == Callback(cb.QUICK_MENU, (-3,))
+    assert decode(encode(cb.EDIT, "table")) == Callback(cb.EDIT, ("table",))
+    assert decode(encode(cb.MAIN_ORDER)) == Callback(cb.MAIN_ORDER, ())
+    # Двоеточие — разделитель: такая строка уходит в хранилище
+    data = encode(cb.AROMA, "Мята: двойная")
+    assert data.startswith("1o:@")
+    assert decode(data) == Callback(cb.AROMA, ("Мята: двойная",))
+
+
+def test_long_strings_fit_64_bytes():
+    aroma = "Двойное яблоко с мятой, лаймом и льдом"
+    data = encode(cb.CART_EDIT, 7, aroma)
+    assert len(data.encode()) <= cb.MAX_CALLBACK_BYTES
+    assert "@" in data
+    assert decode(data) == Callback(cb.CART_EDIT, (7, aroma))
+    # Короткая строка остаётся в самих данных
+    assert encode(cb.AROMA, "Мята") == "1o:'Мята"
+    with pytest.raises(ValueError):
+        encode(cb.ORDER_DONE, *range(10 ** 6, 10 ** 6 + 20))
+    with pytest.raises(TypeError):
+        encode(cb.NOOP, True)
+
+
+def test_store_eviction_and_ttl(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(cb, "monotonic", lambda: clock[0])
+    store = PayloadStore(size=2, ttl=60)
+    first, second = store.put("a"), store.put("b")
+    # Повторное значение — тот же ключ, и оно становится самым свежим
+    assert store.put("a") == first
+    third = store.put("c")
+    assert (store.get(first), store.get(second), store.get(third)) == ("a", None, "c")
+
+    clock[0] += 61
+    assert store.get(first) is None
+    assert store.put("a") != first
+
+    monkeypatch.setattr(cb, "payload_store", store)
+    data = encode(cb.AROMA, "Мята: двойная")
+    clock[0] += 61
+    # Кнопка пережила значение в хранилище: не распознана, а не упала
+    assert decode(data) is None
+    assert cb.action_of(data) == cb.AROMA
+
+
+def test_legacy_callback_data():
+    assert decode("main_order") == Callback(cb.MAIN_ORDER, ())
+    assert decode("quick_order_menu") == Callback(cb.QUICK_MENU, (0,))
+    assert decode("quick_order_page_2") == Callback(cb.QUICK_MENU, (2,))
+    assert decode("quick_order_apply_15") == Callback(cb.QUICK_APPLY, (15,))
+    assert decode("edit_aroma") == Callback(cb.EDIT, ("aroma",))
+    assert decode("strength_Средняя") == Callback(cb.STRENGTH, ("Средняя",))
+    assert decode("order_done_42") == Callback(cb.ORDER_DONE, (42,))
+    assert decode("order_done_42_7") == Callback(cb.ORDER_DONE_LEGACY, (42, 7))
+    for data in ("order_done_1_2_3", "order_done_x", "unknown", "", None, "1d:?x"):
+        assert decode(data) is None, data
+
+
+def test_matches():
+    check = matches(cb.ORDER_DONE, cb.ORDER_DONE_LEGACY)
+    assert check(encode(cb.ORDER_DONE, 1))
+    assert check("order_done_1_2")
+    assert not check(encode(cb.NOOP))
+    assert not check("garbage")
+    assert not check(None)
@@ -0,0 +1,66 @@
+import asyncio
+
+import outbox
+from botapi import RecordingBotApi, STAFF, answered, fill_hookah, query, running_bot, tap
+from routing import DEFAULT_LAYOUT
+
+API_PORT = 18098
+GROUP = -100500
+ZONE_TOPIC = DEFAULT_LAYOUT["topics"]["1 Зона"]
+GENERAL_TOPIC = DEFAULT_LAYOUT["topics"]["general"]
+
+
+def zone_topic_missing(params):
+    # Топик зоны удалили, а zones.json не поправили: пост туда не уйдёт никогда
+    if params.get("message_thread_id") == str(ZONE_TOPIC):
+        return "Bad Request: message thread not found"
+    return None
+
+
+async def until(check):
+    while not check():
+        await asyncio.sleep(0.01)
+
+
+async def cart_with_failed_zone_post():
+    import callbacks as cb
+    from callbacks import encode
+    from db import get_active_orders
+
+    api = RecordingBotApi(fail=zone_topic_missing)
+    async with running_bot(api, API_PORT):
+        menu_id = api._sendMessage({"chat_id": STAFF, "text": "Главное меню:"})["message_id"]
+        tap(api, menu_id, encode(cb.MAIN_ORDER))
+        fill_hookah(api, menu_id, "Мята", table="12")
+        tap(api, menu_id, encode(cb.CART_ADD))
+        fill_hookah(api, menu_id, "Арбуз")
+        tap(api, menu_id, encode(cb.SEND_ORDER))
+        await asyncio.wait_for(until(
+            lambda: query("SELECT status FROM outbox") == [("failed",)]
+        ), 30)
+        general_id = next(
+            message_id for (chat_id, message_id), stored in api.messages.items()
+            if chat_id == GROUP and stored["message_thread_id"] == GENERAL_TOPIC and stored.get("reply_markup")
+        )
+        active = await get_active_orders()
+
+        first, second = api.buttons(GROUP, general_id)
+        await asyncio.wait_for(answered(api, [tap(api, general_id, first["callback_data"], chat_id=GROUP)]), 30)
+        after_first = [button["text"] for button in api.buttons(GROUP, general_id)]
+        await asyncio.wait_for(answered(api, [tap(api, general_id, second["callback_data"], chat_id=GROUP)]), 30)
+        after_second = [button["text"] for button in api.buttons(GROUP, general_id)]
+        return general_id, active, after_first, after_second
+
+
+def test_cart_buttons_work_when_zone_post_failed(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(outbox, "OUTBOX_MAX_PERMANENT_ATTEMPTS", 1)
+    general_id, active, after_first, after_second = asyncio.run(cart_with_failed_zone_post())
+
+    # Копия в general записана сразу после отправки, хоть пост в зону и упал: тикер её видит
+    assert [(row[2], row[3]) for row in active] == [(None, general_id), (None, general_id)]
+    # Выдача первого кальяна меняет только его кнопку, второй по-прежнему можно отметить
+    assert after_first[0].startswith("1. Кальян отдан (") and after_first[0].endswith("назад)")
+    assert after_first[1].startswith("2. Кальян отдан") and "назад" not in after_first[1]
+    assert all(text.endswith("назад)") for text in after_second) and len(after_second) == 2
+    assert query("SELECT status, cart_id FROM orders ORDER BY id") == [("done", 1), ("done", 1)]
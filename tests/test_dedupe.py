@@ -0,0 +1,38 @@
+import asyncio
+
+from botapi import RecordingBotApi, STAFF, answered, fill_hookah, query, running_bot, tap
+
+API_PORT = 18096
+
+
+def orders():
+    return query("SELECT table_number, aroma FROM orders ORDER BY id")
+
+
+async def repeat_taps():
+    import callbacks as cb
+    from callbacks import encode
+
+    api = RecordingBotApi()
+    async with running_bot(api, API_PORT):
+        menu_id = api._sendMessage({"chat_id": STAFF, "text": "Главное меню:"})["message_id"]
+        tap(api, menu_id, encode(cb.MAIN_ORDER))
+        fill_hookah(api, menu_id, "Мята", table="12")
+        # Запара: "Отправить" жмут трижды, не дожидаясь ответа — апдейты приходят одной пачкой
+        first = [tap(api, menu_id, encode(cb.SEND_ORDER)) for _ in range(3)]
+        await asyncio.wait_for(answered(api, first), 30)
+        sent = orders()
+
+        # Другой аромат с того же меню — уже новый заказ
+        tap(api, menu_id, encode(cb.AROMA, "Арбуз"))
+        second = [tap(api, menu_id, encode(cb.SEND_ORDER)) for _ in range(2)]
+        await asyncio.wait_for(answered(api, second), 30)
+        return sent, orders(), [api.answers[tap_id] for tap_id in first + second]
+
+
+def test_repeat_taps_send_one_order(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    sent, total, answers = asyncio.run(repeat_taps())
+    assert sent == [("12", "Мята")]
+    assert total == [("12", "Мята"), ("12", "Арбуз")]
+    assert answers == [None, "Заказ уже отправлен", "Заказ уже отправлен", None, "Заказ уже отправлен"]
@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+from telegram.error import RetryAfter
+
+from dispatch import Dispatcher, PRIORITY_ORDER
+
+
+def test_stop_fails_every_pending_job():
+    async def main():
+        dispatcher = Dispatcher(workers=2)
+        await dispatcher.start()
+        started = asyncio.Semaphore(0)
+
+        async def hang():
+            started.release()
+            await asyncio.sleep(3600)
+
+        async def flood():
+            raise RetryAfter(3600)
+
+        running = dispatcher.submit(1, hang)
+        await started.acquire()
+        deferred = dispatcher.submit(-3, flood, priority=PRIORITY_ORDER)
+        while not dispatcher._deferred:
+            await asyncio.sleep(0)
+        dispatcher.submit(2, hang)
+        await started.acquire()
+        # Оба воркера заняты: эта ждёт в очереди
+        queued = dispatcher.submit(4, hang)
+        await dispatcher.stop(timeout=0.05)
+        return running, queued, deferred, dispatcher
+
+    running, queued, deferred, dispatcher = asyncio.run(main())
+    for future in (running, queued, deferred):
+        with pytest.raises(RuntimeError):
+            future.result()
+    assert dispatcher.pending == 0
+
+
+def test_stop_waits_for_queue_first():
+    async def main():
+        dispatcher = Dispatcher(workers=2)
+        await dispatcher.start()
+
+        async def call():
+            await asyncio.sleep(0.01)
+            return "ok"
+
+        futures = [dispatcher.submit(i, call) for i in range(5)]
+        await dispatcher.stop()
+        return [future.result() for future in futures]
+
+    assert asyncio.run(main()) == ["ok"] * 5
@@ -0,0 +1,59 @@
+import pickle
+from types import SimpleNamespace
+
+from drafts import DRAFT_CHOICES, STRENGTHS, OrderDraft, get_draft, pack_item, unpack_item
+
+MINT = ("Мята", STRENGTHS[4], "Фанел", DRAFT_CHOICES[1])
+MELON = ("Арбуз", STRENGTHS[0], None, None)
+MANGO = ("Манго", None, "Фрукт", DRAFT_CHOICES[0])
+
+
+def test_pack_unpack():
+    assert pack_item(MINT) == ("Мята", 4, "Фанел", 1)
+    assert unpack_item(pack_item(MINT)) == MINT
+    # Значение не с кнопки (из старого шаблона) хранится как есть
+    assert pack_item(("Мята", "Очень крепкий", None, None)) == ("Мята", "Очень крепкий", None, None)
+
+    order = OrderDraft(10)
+    order.table = "12"
+    order.set_item(MINT)
+    order.trace_id = "t1"
+    assert order._strength == 4 and order.strength == STRENGTHS[4]
+    restored = pickle.loads(pickle.dumps(order))
+    assert (restored.order_msg_id, restored.table, restored.item(), restored.trace_id) == (10, "12", MINT, "t1")
+
+    # Черновик, сохранённый до появления trace_id
+    old = OrderDraft.__new__(OrderDraft)
+    old.__setstate__(order.__getstate__()[:-1])
+    assert (old.item(), old.trace_id) == (MINT, None)
+
+
+def test_legacy_user_data():
+    user_data = {"order_msg_id": 3, "table": "7", "aroma": "Мята", "cart": [MELON], "keep": 1}
+    order = get_draft(SimpleNamespace(user_data=user_data))
+    assert user_data == {"order": order, "keep": 1}
+    assert (order.order_msg_id, order.table, order.items()) == (3, "7", [MELON, ("Мята", None, None, None)])
+
+
+def test_cart_stash_take():
+    order = OrderDraft()
+    order.set_item(MINT)
+    order.stash()
+    assert not order.has_item() and order.cart_items() == [MINT]
+    order.set_item(MELON)
+    order.stash()
+    order.set_item(MANGO)
+    assert order.items() == [MINT, MELON, MANGO]
+
+    # Текущий черновик встаёт в конец корзины, взятый — в черновик на своё место
+    assert order.take(0) == 0
+    assert order.item() == MINT and order.cart_items() == [MELON, MANGO]
+    assert order.items() == [MINT, MELON, MANGO]
+    # Номер — в корзине без черновика: первый кальян возвращается на своё место, взят третий
+    assert order.take(1) == 2
+    assert order.item() == MANGO and order.cart_items() == [MINT, MELON]
+    assert order.items() == [MINT, MELON, MANGO]
+    order.strength = STRENGTHS[2]
+    order.stash()
+    assert order.cart_items() == [MINT, MELON, ("Манго", STRENGTHS[2], "Фрукт", DRAFT_CHOICES[0])]
+    assert order.cart_index is None
@@ -0,0 +1,58 @@
+import asyncio
+
+import effects
+from dispatch import dispatcher, PRIORITY_UI
+from effects import Effects
+from metrics import effect_errors
+
+
+class Bot:
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.edits = []
+
+    async def edit_message_text(self, text, chat_id, message_id, reply_markup=None):
+        if text == "old":
+            await asyncio.sleep(self.delay)
+        self.edits.append(text)
+
+
+def edit_twice(monkeypatch, bot, chat_id, block=0):
+    # Первое нажатие правит меню через очередь и не дожидается её, второе — напрямую
+    monkeypatch.setattr(effects, "EFFECT_MAX_RETRY_WAIT", 0.02)
+
+    async def main():
+        await dispatcher.start()
+        dispatcher.bucket(chat_id).block(block)
+        try:
+            first = Effects(bot)
+            queued = first.edit(chat_id, 10, "old", priority=PRIORITY_UI)
+            await first.flush()
+            second = Effects(bot)
+            second.edit(chat_id, 10, "new")
+            await second.flush()
+            await asyncio.sleep(block + 0.1)
+            return queued.result()
+        finally:
+            await dispatcher.stop()
+
+    errors = dict(effect_errors.values)
+    result = asyncio.run(main())
+    assert effect_errors.values == errors
+    return result
+
+
+def test_stale_queued_edit_is_dropped(monkeypatch):
+    bot = Bot()
+    # Лимит чата держит правку в очереди дольше, чем её ждёт обработчик
+    assert edit_twice(monkeypatch, bot, 7001, block=0.2) is None
+    assert bot.edits == ["new"]
+    assert not effects._queued
+
+
+def test_direct_edit_waits_for_sent_queued_edit(monkeypatch):
+    bot = Bot(delay=0.1)
+    # Запрос из очереди уже ушёл: прямая правка ложится после него, а не под него
+    assert edit_twice(monkeypatch, bot, 7002) is None
+    assert bot.edits == ["old", "new"]
+    assert not effects._queued
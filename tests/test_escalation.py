@@ -0,0 +1,148 @@
+import asyncio
+
+import escalation
+from botapi import query
+from db import close_db, complete_order, create_cart, create_order, init_db, set_order_messages, set_orders_escalated
+from escalation import ESCALATION, REMINDER, Escalator
+from routing import router
+
+CHAT = -100500
+T0 = 1_700_000_000
+ZONE = "1 Зона"
+
+
+class Bot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, message_thread_id=None, reply_parameters=None):
+        reply_to = reply_parameters.message_id if reply_parameters is not None else None
+        self.sent.append((message_thread_id, reply_to, text))
+
+
+class Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+async def advance(escalator, clock, now):
+    # Что сделал бы цикл, проснувшись в now
+    clock.now = now
+    await escalator.fire(escalator.pop_due(now), now)
+    # Напоминание уходит задачей диспетчера
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def escalated():
+    return query("SELECT escalated FROM orders ORDER BY id")
+
+
+def run(monkeypatch, tmp_path, scenario):
+    monkeypatch.chdir(tmp_path)
+    clock = Clock(T0)
+    monkeypatch.setattr(escalation, "time", clock)
+
+    async def main():
+        await init_db()
+        try:
+            return await scenario(clock)
+        finally:
+            await close_db()
+
+    return asyncio.run(main())
+
+
+def test_reminder_then_escalation(monkeypatch, tmp_path):
+    topic, sla = router.zone(ZONE)
+
+    async def scenario(clock):
+        bot = Bot()
+        escalator = Escalator()
+        escalator.bot, escalator.chat_id = bot, CHAT
+        order_ids = await create_cart(1, "staff", ZONE, "12", [("Мята",) * 4, ("Арбуз",) * 4], T0, [])
+        for order_id in order_ids:
+            await set_order_messages(order_id, 111, 222)
+            escalator.add(order_id, ZONE, "12", T0)
+        single = await create_order(1, "staff", ZONE, "3", "Манго", None, None, None, T0 + 30)
+        escalator.add(single, ZONE, "3", T0 + 30)
+
+        steps = []
+        for now in (T0 + sla - 1, T0 + sla, T0 + sla + 30, T0 + 2 * sla, T0 + 2 * sla + 30):
+            await advance(escalator, clock, now)
+            steps.append((list(bot.sent), escalated()))
+            bot.sent.clear()
+        return steps, len(escalator)
+
+    steps, left = run(monkeypatch, tmp_path, scenario)
+    general = router.topics["general"]
+    assert steps[0] == ([], [(0,), (0,), (0,)])
+    # Корзина — одно напоминание в топик зоны ответом на свой пост
+    (reminder,), stages = steps[1]
+    assert reminder[:2] == (topic, 111) and "Стол 12" in reminder[2] and "кальянов: 2" in reminder[2]
+    assert stages == [(1,), (1,), (0,)]
+    (single,), stages = steps[2]
+    assert single[:2] == (topic, None) and "Стол 3" in single[2]
+    assert stages == [(1,), (1,), (1,)]
+    # Второй SLA — в general, ответом на копию заказа там
+    (escalation_post,), stages = steps[3]
+    assert escalation_post[:2] == (general, 222) and escalation_post[2].startswith("🚨 1 Зона, стол 12")
+    assert stages == [(2,), (2,), (1,)]
+    assert len(steps[4][0]) == 1 and steps[4][1] == [(2,), (2,), (2,)]
+    assert left == 0
+
+
+def test_restart_resumes_from_escalated_column(monkeypatch, tmp_path):
+    _, sla = router.zone(ZONE)
+
+    async def scenario(clock):
+        reminded = await create_order(1, "staff", ZONE, "12", "Мята", None, None, None, T0)
+        fresh = await create_order(1, "staff", ZONE, "3", "Арбуз", None, None, None, T0)
+        done = await create_order(1, "staff", ZONE, "7", "Манго", None, None, None, T0)
+        old = await create_order(1, "staff", ZONE, "9", "Лимон", None, None, None, T0 - escalation.SLA_LOOKBACK - 1)
+        await set_orders_escalated([(1, reminded), (2, done)])
+
+        # Бот лежал дольше первого SLA
+        clock.now = T0 + sla + 60
+        bot = Bot()
+        escalator = Escalator()
+        await escalator.start(bot, CHAT)
+        await escalator.stop()
+        loaded = sorted((entry[2], entry[0] - T0, entry[6]) for entry in escalator._heap)
+
+        await advance(escalator, clock, clock.now)
+        return (reminded, fresh, old), loaded, bot.sent
+
+    (reminded, fresh, old), loaded, sent = run(monkeypatch, tmp_path, scenario)
+    # Напомненный ждёт только эскалации, выданный и слишком старый не поднимаются
+    assert loaded == [(reminded, 2 * sla, ESCALATION), (fresh, sla, REMINDER)]
+    assert [text.split(" ждёт")[0] for _, _, text in sent] == ["⏰ Стол 3"]
+
+
+def test_completion_cancels_reminders(monkeypatch, tmp_path):
+    _, sla = router.zone(ZONE)
+
+    async def scenario(clock):
+        bot = Bot()
+        escalator = Escalator()
+        escalator.bot, escalator.chat_id = bot, CHAT
+        first = await create_order(1, "staff", ZONE, "12", "Мята", None, None, None, T0)
+        second = await create_order(1, "staff", ZONE, "3", "Арбуз", None, None, None, T0)
+        escalator.add(first, ZONE, "12", T0)
+        escalator.add(second, ZONE, "3", T0)
+
+        await complete_order(first, T0 + 60)
+        removed = escalator.remove(first)
+        # Выдан в другом процессе: запись осталась, но заказ в базе уже не open
+        await complete_order(second, T0 + 60)
+        await advance(escalator, clock, T0 + 2 * sla)
+        return removed, bot.sent, len(escalator), escalator.next_deadline()
+
+    removed, sent, left, deadline = run(monkeypatch, tmp_path, scenario)
+    assert removed
+    assert sent == []
+    assert (left, deadline) == (0, None)
+    assert escalated() == [(0,), (0,)]
@@ -0,0 +1,87 @@
+import os
+import sys
+import json
+import subprocess
+
+from loguru import logger
+
+import eventlog
+from eventlog import JsonLinesSink, bind_trace, event, index_path, lookup, rotated_path, timeline
+
+
+def write_events(path, events, **kwargs):
+    sink = JsonLinesSink(str(path), **kwargs)
+    sink.start()
+    handler_id = logger.add(sink, level="DEBUG", format="{message}", filter=lambda record: "event" in record["extra"])
+    try:
+        for trace, name, fields in events:
+            bind_trace(trace)
+            event(name, **fields)
+    finally:
+        logger.remove(handler_id)
+        sink.stop()
+        bind_trace(None)
+    return sink
+
+
+def shift(orders, per_order):
+    # Заказы вперемешку: шаг каждого по очереди, в конце — выдача
+    events = []
+    for step in range(per_order):
+        for order_id in range(1, orders + 1):
+            name = "order.done" if step == per_order - 1 else "order.field"
+            fields = {"order_id": order_id} if name == "order.done" else {"step": step}
+            events.append((f"trace{order_id:04d}", name, fields))
+    return events
+
+
+def test_rotation_keeps_backups_and_offsets(tmp_path):
+    path = tmp_path / "events.jsonl"
+    sink = write_events(path, shift(orders=20, per_order=10), max_bytes=4096, backups=2)
+
+    assert sink.written == 200 and sink.dropped == 0
+    files = [str(path), rotated_path(str(path), 1), rotated_path(str(path), 2)]
+    assert all(os.path.exists(name) and os.path.exists(index_path(name)) for name in files)
+    assert not os.path.exists(rotated_path(str(path), 3))
+    for name in files:
+        data = open(name, "rb").read()
+        assert 0 < len(data) <= 4096
+        # Каждое смещение индекса — начало строки с этим ключом
+        for line in open(index_path(name), encoding="utf-8"):
+            key, offset = line.rstrip("\n").split("\t")
+            assert offset == "0" or data[int(offset) - 1:int(offset)] == b"\n"
+            record = json.loads(data[int(offset):data.index(b"\n", int(offset))])
+            assert key in (record["trace"], f"#{record.get('order_id')}")
+
+
+def test_lookup_by_trace_and_order_number(tmp_path, monkeypatch, capsys):
+    path = tmp_path / "events.jsonl"
+    events = shift(orders=5, per_order=4)
+    # Фоновая запись без trace находится только по номеру заказа
+    events.append((None, "order.delivered", {"order_ids": [3, 4]}))
+    write_events(path, events, max_bytes=2048, backups=5)
+    assert os.path.exists(rotated_path(str(path), 1))
+
+    assert [record["msg"] for record in lookup(str(path), "trace0003").values()] == ["order.field"] * 3 + ["order.done"]
+    records = timeline(str(path), "3")
+    assert [(record["trace"], record["msg"]) for record in records] == (
+        [("trace0003", "order.field")] * 3 + [("trace0003", "order.done"), (None, "order.delivered")]
+    )
+    assert [record["step"] for record in records[:3]] == [0, 1, 2]
+    assert timeline(str(path), "trace0003") == records[:4]
+    assert timeline(str(path), "99") == []
+
+    monkeypatch.setattr(sys, "argv", ["eventlog", "3", "--log", str(path)])
+    assert eventlog.main() == 0
+    assert capsys.readouterr().out.count("\n") == 5
+    monkeypatch.setattr(sys, "argv", ["eventlog", "99", "--log", str(path)])
+    assert eventlog.main() == 1
+
+
+def test_import_leaves_logging_alone():
+    code = (
+        "import logging; from loguru import logger; logging.basicConfig(); handlers = logging.getLogger().handlers[:]; "
+        "ids = list(logger._core.handlers); import eventlog; "
+        "assert logging.getLogger().handlers == handlers and list(logger._core.handlers) == ids"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True, cwd=os.path.dirname(os.path.dirname(__file__)))
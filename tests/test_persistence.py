@@ -0,0 +1,56 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import persistence
+from persistence import SQLitePersistence
+
+
+class FlakyDb:
+    # Первые failures записей падают, остальные копят выполненные запросы
+    def __init__(self, failures):
+        self.failures = failures
+        self.written = []
+
+    @asynccontextmanager
+    async def writer(self):
+        if self.failures:
+            self.failures -= 1
+            raise OSError("database is locked")
+        yield self
+
+    async def executemany(self, sql, rows):
+        self.written.extend(rows)
+
+
+def test_failed_write_is_retried_without_new_updates(monkeypatch):
+    db = FlakyDb(failures=2)
+    monkeypatch.setattr(persistence, "db", db)
+    monkeypatch.setattr(persistence, "PERSISTENCE_RETRY", 0.01)
+
+    async def main():
+        store = SQLitePersistence()
+        await store.update_user_data(1, {"table": "12"})
+        await asyncio.sleep(0.005)
+        # Пока пачка ждёт повтора, приходят новые изменения: они уходят тем же повтором
+        await store.update_user_data(2, {"table": "33"})
+        await store._flush_task
+        return store
+
+    store = asyncio.run(main())
+    assert sorted(uid for uid, _, _ in db.written) == [1, 2]
+    assert not store._pending_users
+
+
+def test_flush_skips_retry_pause(monkeypatch):
+    db = FlakyDb(failures=1)
+    monkeypatch.setattr(persistence, "db", db)
+    monkeypatch.setattr(persistence, "PERSISTENCE_RETRY", 3600)
+
+    async def main():
+        store = SQLitePersistence()
+        await store.update_conversation("order", (1, 1), 3)
+        await asyncio.sleep(0.01)
+        await asyncio.wait_for(store.flush(), 1)
+
+    asyncio.run(main())
+    assert [name for name, _, _ in db.written] == ["order"]
@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
+
+import render
+from render import RenderCache, edit_message, edit_reply_markup
+
+
+def keyboard(text):
+    return InlineKeyboardMarkup([[InlineKeyboardButton(text, callback_data="1f")]])
+
+
+class Bot:
+    # errors — по вызову: текст BadRequest или None для успешной правки
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.calls = []
+
+    async def edit_message_text(self, text, chat_id, message_id, reply_markup=None):
+        self.calls.append(("text", message_id, text))
+        error = self.errors.pop(0) if self.errors else None
+        if error:
+            raise BadRequest(error)
+
+    async def edit_message_reply_markup(self, chat_id, message_id, reply_markup=None):
+        self.calls.append(("markup", message_id, reply_markup))
+        error = self.errors.pop(0) if self.errors else None
+        if error:
+            raise BadRequest(error)
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = RenderCache(size=2)
+    monkeypatch.setattr(render, "render_cache", cache)
+    return cache
+
+
+def test_same_render_is_skipped(cache):
+    bot = Bot()
+
+    async def main():
+        return [
+            await edit_message(bot, 1, 10, "Меню", keyboard("Стол: 12")),
+            # Разметка собрана заново, но та же: правка не нужна
+            await edit_message(bot, 1, 10, "Меню", keyboard("Стол: 12")),
+            await edit_message(bot, 1, 10, "Меню", keyboard("Стол: 7")),
+            await edit_reply_markup(bot, 1, 11, keyboard("1")),
+            await edit_reply_markup(bot, 1, 11, keyboard("1")),
+        ]
+
+    assert asyncio.run(main()) == [True, False, True, True, False]
+    assert [call[:2] for call in bot.calls] == [("text", 10), ("text", 10), ("markup", 11)]
+    assert cache.skipped == 2
+
+
+def test_failed_edit_forgets_message(cache):
+    bot = Bot(errors=[None, "Message to edit not found"])
+
+    async def main():
+        await edit_message(bot, 1, 10, "Меню", keyboard("Стол: 12"))
+        with pytest.raises(BadRequest):
+            await edit_message(bot, 1, 10, "Меню", keyboard("Стол: 7"))
+        # Что на экране после ошибки, неизвестно: та же правка уходит снова
+        return await edit_message(bot, 1, 10, "Меню", keyboard("Стол: 12"))
+
+    assert asyncio.run(main()) is True
+    assert len(bot.calls) == 3
+
+
+def test_not_modified_counts_as_current(cache):
+    bot = Bot(errors=["Bad Request: message is not modified"])
+
+    async def main():
+        await edit_message(bot, 1, 10, "Меню", None)
+        return await edit_message(bot, 1, 10, "Меню", None)
+
+    assert asyncio.run(main()) is False
+    assert len(bot.calls) == 1
+
+
+def test_least_recent_message_is_evicted(cache):
+    cache.remember(1, 10, "a", None)
+    cache.remember(1, 11, "b", None)
+    cache.remember(1, 10, "a", None)
+    cache.remember(1, 12, "c", None)
+    assert [cache.is_current(1, message_id, text, None) for message_id, text in ((10, "a"), (11, "b"), (12, "c"))] == [
+        True, False, True
+    ]
@@ -0,0 +1,76 @@
+import os
+import json
+import random
+import string
+
+import pytest
+
+from routing import DEFAULT_LAYOUT, ZoneRouter, ZoneTable
+from routing_layouts import big_layout, legacy_get_zone_and_topic_id
+
+ZONES_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config", "zones.json")
+
+
+def random_table(rng):
+    kind = rng.random()
+    if kind < 0.5:
+        return str(rng.randint(-50, 1000))
+    if kind < 0.7:
+        return rng.choice([" ", "", "0", "+"]) + str(rng.randint(0, 250)) + rng.choice(["", " ", "\n"])
+    alphabet = string.ascii_letters + string.digits + " -_+абв"
+    return "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 6)))
+
+
+def test_default_layout_matches_legacy_routing():
+    table = ZoneTable(DEFAULT_LAYOUT)
+    for num in range(-100, 2000):
+        for text in (str(num), f" {num} ", f"0{num}"):
+            assert table.lookup(text) == legacy_get_zone_and_topic_id(text), text
+    rng = random.Random(42)
+    for _ in range(200_000):
+        text = random_table(rng)
+        assert table.lookup(text) == legacy_get_zone_and_topic_id(text), repr(text)
+
+
+def test_repo_layout_matches_default():
+    with open(ZONES_FILE, encoding="utf-8") as f:
+        layout = json.load(f)
+    assert layout == DEFAULT_LAYOUT
+
+
+def test_interval_index_matches_linear_scan():
+    # Большая раскладка: бинарный поиск по интервалам против прохода по всем зонам
+    layout = big_layout(300)
+    table = ZoneTable(layout)
+    rng = random.Random(7)
+    for _ in range(20_000):
+        num = rng.randint(-10, 300 * 100 + 10)
+        expected = ("General", 1)
+        for zone in layout["zones"]:
+            low, high = zone["ranges"][0]
+            if low <= num <= high:
+                expected = (zone["name"], layout["topics"][zone["name"]])
+        assert table.lookup(str(num)) == expected, num
+    assert table.lookup("T5-3") == ("z5", 15)
+
+
+def test_invalid_layouts_rejected():
+    overlapping = {"topics": {}, "zones": [{"name": "a", "ranges": [[1, 10]]}, {"name": "b", "ranges": [[10, 20]]}]}
+    with pytest.raises(ValueError):
+        ZoneTable(overlapping)
+    duplicated = {"topics": {}, "zones": [{"name": "a", "tables": ["VIP"]}, {"name": "b", "tables": [" VIP "]}]}
+    with pytest.raises(ValueError):
+        ZoneTable(duplicated)
+    with pytest.raises(ValueError):
+        ZoneTable({"topics": {}, "zones": [{"name": "a", "ranges": [[5, 1]]}]})
+
+
+def test_router_reloads_changed_file(tmp_path):
+    path = tmp_path / "zones.json"
+    router = ZoneRouter(str(path))
+    assert not router.reload()
+    layout = {"topics": {"general": 1, "VIP": 9}, "zones": [{"name": "VIP", "tables": ["VIP"]}]}
+    path.write_text(json.dumps(layout), encoding="utf-8")
+    assert router.reload()
+    assert router.lookup("VIP") == ("VIP", 9)
+    assert not router.reload()
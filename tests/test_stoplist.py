@@ -0,0 +1,35 @@
+import asyncio
+
+from stoplist import StopList
+
+
+def test_edit_keeps_comments_and_replaces_file(tmp_path):
+    path = tmp_path / "stoplist.txt"
+    path.write_text("# Закончилось на складе\nМята\n\n# До поставки\nАрбуз\n", encoding="utf-8")
+    inode = path.stat().st_ino
+    stoplist = StopList(str(path))
+    stoplist.reload()
+
+    lines = asyncio.run(stoplist.edit(add=["Манго", "мята"], remove=["Арбуз"]))
+
+    assert lines == ["Мята", "Манго"]
+    assert path.read_text(encoding="utf-8") == "# Закончилось на складе\nМята\n\n# До поставки\nМанго\n"
+    # Новый файл, а не запись поверх старого: читатель не застанет его наполовину записанным
+    assert path.stat().st_ino != inode
+    assert [p.name for p in tmp_path.iterdir()] == ["stoplist.txt"]
+    assert stoplist.check("кальян с мятой")
+
+
+def test_match_word_forms_only():
+    stoplist = StopList()
+    stoplist._apply(["Лайм", "Кола", "Ель", "Чай", "Мята", "Двойное яблоко"])
+
+    assert stoplist.check("кальян с мятой") == ["Мята"]
+    assert stoplist.check("мятный, крепкий") == ["Мята"]
+    assert stoplist.check("лаймовый") == ["Лайм"]
+    assert stoplist.check("с колой") == ["Кола"]
+    assert stoplist.check("чай") == ["Чай"]
+    assert stoplist.check("двойная яблоком") == ["Двойное яблоко"]
+    # Другое слово с той же основой — не позиция стоп-листа
+    for text in ("Лайт", "Колада", "Пина колада", "Ельцин", "Чайная роза", "Мятая роза"):
+        assert stoplist.check(text) == [], text
@@ -0,0 +1,134 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import pytest
+
+import suggest
+from db import close_db, create_order, init_db
+from suggest import AromaSuggestions
+
+DAY = 86400
+T0 = 1_700_000_000
+
+
+class Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock(T0)
+    monkeypatch.setattr(suggest, "time", clock)
+    return clock
+
+
+def test_decay_halves_weight_every_half_life(clock):
+    aromas = AromaSuggestions(half_life_days=14)
+    aromas.record("Мята", T0)
+    aromas.record("Мята", T0)
+    aromas.record("Арбуз", T0 + 14 * DAY)
+    mint, melon = aromas.entries["мята"].weight, aromas.entries["арбуз"].weight
+    # Два заказа двухнедельной давности весят как один сегодняшний
+    assert mint == pytest.approx(melon)
+    aromas.record("Арбуз", T0 + 15 * DAY)
+    assert aromas.top() == ["Арбуз", "Мята"]
+    aromas.record("Мята", T0 + 15 * DAY)
+    aromas.record("Мята", T0 + 15 * DAY)
+    assert aromas.top() == ["Мята", "Арбуз"]
+
+
+def test_rebase_keeps_order(clock):
+    aromas = AromaSuggestions(half_life_days=1)
+    aromas.record("Мята", T0)
+    aromas.record("Арбуз", T0 + 10 * DAY)
+    landmark = aromas.landmark
+    # Через REBASE_AFTER периодов отсчёт переносится: 2**x не переполняется
+    aromas.record("Лайм", T0 + (suggest.REBASE_AFTER + 1) * DAY)
+    assert aromas.landmark > landmark
+    assert aromas.top() == ["Лайм", "Арбуз", "Мята"]
+    assert aromas.entries["лайм"].weight == pytest.approx(1.0)
+
+
+def test_ranking(clock):
+    aromas = AromaSuggestions()
+    for text in ("Двойное яблоко", "двойное  ЯБЛОКО", "Двойное яблоко", "Мята", "Мята лайм", "Манго", "Манго"):
+        aromas.record(text, T0)
+    aromas.record("", T0)
+
+    assert aromas.top() == ["Двойное яблоко", "Манго", "Мята", "Мята лайм"]
+    # Начала слов в любом порядке
+    assert aromas.top("яб дв") == ["Двойное яблоко"]
+    assert aromas.top("м") == ["Манго", "Мята", "Мята лайм"]
+    assert aromas.top("м", limit=2) == ["Манго", "Мята"]
+    # Стоп-лист пропускается, место занимает следующий
+    assert aromas.top("м", limit=2, skip=lambda text: text == "Манго") == ["Мята", "Мята лайм"]
+    assert aromas.known("мята  ЛАЙМ") and not aromas.known("лайм")
+
+
+def test_checkpoint_and_reload(monkeypatch, tmp_path, clock):
+    monkeypatch.chdir(tmp_path)
+
+    async def main():
+        await init_db()
+        try:
+            for aroma in ("Мята", "Арбуз", "Мята"):
+                await create_order(1, "staff", "1 Зона", "12", aroma, None, None, None, T0 - DAY)
+            first = AromaSuggestions()
+            # Первый запуск: история из заказов, сразу в базу
+            await first.start()
+            await first.stop()
+            first.record("Лайм", T0)
+            first.record("Лайм", T0)
+            first.record("Лайм", T0)
+            clock.now = T0 + DAY
+            saved = await first.checkpoint(), await first.checkpoint()
+
+            second = AromaSuggestions()
+            await second.start()
+            await second.stop()
+            return saved, first, second
+        finally:
+            await close_db()
+
+    saved, first, second = asyncio.run(main())
+    # Второй раз писать нечего: уходят только изменившиеся позиции
+    assert saved == (1, 0)
+    assert second.top() == first.top() == ["Лайм", "Мята", "Арбуз"]
+    # Веса считаются от своей точки отсчёта: сравниваем в единицах одного момента
+    for key, entry in first.entries.items():
+        now = T0 + DAY
+        assert second.entries[key].weight / second._weight(now) == pytest.approx(entry.weight / first._weight(now))
+
+
+def test_failed_checkpoint_keeps_changes(monkeypatch, clock):
+    class FlakyDb:
+        def __init__(self):
+            self.failures = 1
+            self.written = []
+
+        @asynccontextmanager
+        async def writer(self):
+            if self.failures:
+                self.failures -= 1
+                raise OSError("database is locked")
+            yield self
+
+        async def executemany(self, sql, rows):
+            self.written.extend(rows)
+
+    flaky = FlakyDb()
+    monkeypatch.setattr(suggest, "db", flaky)
+    aromas = AromaSuggestions()
+    aromas.record("Мята", T0)
+
+    async def main():
+        with pytest.raises(OSError):
+            await aromas.checkpoint()
+        return await aromas.checkpoint()
+
+    assert asyncio.run(main()) == 1
+    assert [row[:2] for row in flaky.written] == [("мята", "Мята")]
@@ -0,0 +1,67 @@
+import asyncio
+from time import monotonic
+from types import SimpleNamespace
+
+from telegram.ext import ConversationHandler
+
+import callbacks as cb
+from botapi import RecordingBotApi, STAFF, answered, fill_hookah, running_bot, tap, type_text
+from callbacks import encode
+from sweeper import IdleSweeper, conversation_states
+
+API_PORT = 18099
+
+
+async def evict_and_tap_old_menu():
+    from sweeper import idle_sweeper
+
+    api = RecordingBotApi()
+    async with running_bot(api, API_PORT) as app:
+        menu_id = api._sendMessage({"chat_id": STAFF, "text": "Главное меню:"})["message_id"]
+        tap(api, menu_id, encode(cb.MAIN_ORDER))
+        fill_hookah(api, menu_id, "Мята", table="12")
+        await asyncio.wait_for(answered(api, [tap(api, menu_id, encode(cb.EDIT, "bowl"))]), 30)
+        evicted = await idle_sweeper.sweep(monotonic() + idle_sweeper.ttl + 1)
+        left = dict(app.user_data), sum(len(conversation_states(conv)) for conv in idle_sweeper._conversations)
+
+        # Сотрудник вернулся к меню, которое висит в чате со вчерашней смены
+        await asyncio.wait_for(answered(api, [tap(api, menu_id, encode(cb.EDIT, "table"))]), 30)
+        prompt = api.messages[(STAFF, menu_id)]["text"]
+        type_text(api, "7")
+        await asyncio.wait_for(answered(api, [tap(api, menu_id, encode(cb.AROMA, "Арбуз"))]), 30)
+        order = app.user_data[STAFF]["order"]
+        return evicted, left, prompt, order.order_msg_id == menu_id, order.table, order.items()
+
+
+def test_evicted_user_restarts_from_old_menu(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    evicted, left, prompt, same_menu, table, items = asyncio.run(evict_and_tap_old_menu())
+
+    assert evicted == 1
+    assert left == ({}, 0)
+    assert prompt == "Введите номер стола:"
+    # Черновик начат заново в том же меню: от вчерашнего заказа ничего не осталось
+    assert same_menu
+    assert (table, items) == ("7", [("Арбуз", None, None, None)])
+
+
+def test_sweep_skips_conversations_without_private_storage():
+    conv = ConversationHandler([], {}, [], name="order")
+    del conv._conversations
+    dropped = []
+    application = SimpleNamespace(
+        handlers={0: [conv]}, user_data={5: {}}, persistence=None, drop_user_data=dropped.append
+    )
+
+    async def main():
+        sweeper = IdleSweeper(ttl=60, interval=3600)
+        await sweeper.start(application)
+        sweeper.touch(5, now=0)
+        try:
+            return sweeper._conversations, await sweeper.sweep(now=100)
+        finally:
+            await sweeper.stop()
+
+    assert conversation_states(conv) is None
+    assert asyncio.run(main()) == ([], 1)
+    assert dropped == [5]
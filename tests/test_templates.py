@@ -0,0 +1,97 @@
+import asyncio
+import sqlite3
+
+from db import close_db, db, init_db, save_template, search_templates
+
+
+def fts_match(text):
+    with sqlite3.connect("templates.db") as conn:
+        return [row[0] for row in conn.execute(
+            "SELECT rowid FROM templates_fts WHERE templates_fts MATCH ? ORDER BY rowid", (text,)
+        )]
+
+
+def run(monkeypatch, tmp_path, scenario):
+    monkeypatch.chdir(tmp_path)
+
+    async def main():
+        await init_db()
+        try:
+            return await scenario()
+        finally:
+            await close_db()
+
+    return asyncio.run(main())
+
+
+def labels(rows):
+    return [row[1] for row in rows]
+
+
+def test_search(monkeypatch, tmp_path):
+    async def scenario():
+        await save_template("Иван", "Мята", "Средний", "Фанел", None)
+        await save_template("Ёжик", "Арбуз", None, None, None)
+        await save_template("Мятный вечер", "Лайм", None, None, None)
+        await save_template("Пётр", "Двойное яблоко с мятой", None, None, None)
+        return [
+            await search_templates("ив мя"),
+            await search_templates("ежик"),
+            # Совпадение в названии весит больше, чем в аромате
+            await search_templates("мят"),
+            # Одна буква — самые свежие из подходящих
+            await search_templates("м"),
+            await search_templates(""),
+            await search_templates("", offset=1, limit=2),
+            await search_templates("нет такого"),
+        ]
+
+    results = run(monkeypatch, tmp_path, scenario)
+    assert [labels(rows) for rows in results] == [
+        ["Иван"],
+        ["Ёжик"],
+        ["Мятный вечер", "Иван", "Пётр"],
+        ["Пётр", "Мятный вечер", "Иван"],
+        ["Пётр", "Мятный вечер", "Ёжик", "Иван"],
+        ["Мятный вечер", "Ёжик"],
+        [],
+    ]
+    assert results[0][0] == (1, "Иван", "Мята", "Средний", "Фанел", None)
+
+
+def test_triggers_keep_index_in_sync(monkeypatch, tmp_path):
+    async def scenario():
+        first = await save_template("Иван", "Мята", None, None, None)
+        second = await save_template("Ёлка", "Арбуз", None, None, None)
+        steps = [(fts_match("иван"), fts_match("елка"))]
+        await db.execute("UPDATE templates SET label = ?, aroma = ? WHERE id = ?", ("Ёж", "Лайм", first))
+        steps.append((fts_match("иван"), fts_match("мята"), fts_match("еж"), fts_match("лайм")))
+        # Правка других полей индекс не трогает
+        await db.execute("UPDATE templates SET bowl = ? WHERE id = ?", ("Фанел", first))
+        steps.append(fts_match("лайм"))
+        await db.execute("DELETE FROM templates WHERE id = ?", (second,))
+        steps.append((fts_match("елка"), fts_match("арбуз")))
+        return first, second, steps
+
+    first, second, steps = run(monkeypatch, tmp_path, scenario)
+    assert steps == [
+        ([first], [second]),
+        ([], [], [first], [first]),
+        [first],
+        ([], []),
+    ]
+
+
+def test_index_built_for_existing_templates(monkeypatch, tmp_path):
+    # База до появления поиска: шаблоны есть, индекса нет
+    with sqlite3.connect(tmp_path / "templates.db") as conn:
+        conn.execute(
+            "CREATE TABLE templates (id INTEGER PRIMARY KEY AUTOINCREMENT, label TEXT NOT NULL, aroma TEXT, "
+            "strength TEXT, bowl TEXT, draft TEXT)"
+        )
+        conn.execute("INSERT INTO templates (label, aroma) VALUES ('Семён', 'Чёрный чай')")
+
+    async def scenario():
+        return await search_templates("семен черн")
+
+    assert labels(run(monkeypatch, tmp_path, scenario)) == ["Семён"]
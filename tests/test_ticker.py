@@ -0,0 +1,83 @@
+import asyncio
+
+import dispatch
+import ticker as ticker_module
+from dispatch import dispatcher
+from ticker import Ticker, TICKER_EDIT_BURST, TICKER_EDITS_PER_MIN
+
+T0 = 1_700_000_000
+
+
+class Bot:
+    def __init__(self):
+        self.edits = []
+
+    async def edit_message_reply_markup(self, chat_id, message_id, reply_markup=None):
+        self.edits.append((message_id, reply_markup))
+
+
+def make_ticker(monkeypatch, chat_id, orders, clock=None):
+    # orders — (order_id, message_id); все открыты с T0
+    rows = [(order_id, T0, message_id, None, "open", None) for order_id, message_id in orders]
+
+    async def get_active_orders():
+        return rows
+
+    if clock is not None:
+        monkeypatch.setattr(dispatch, "monotonic", lambda: clock[0])
+    monkeypatch.setattr(ticker_module, "get_active_orders", get_active_orders)
+    ticker = Ticker()
+    ticker.bot = Bot()
+    ticker.chat_id = chat_id
+    # Разметка меняется каждую секунду: кэш правок не гасит ни одну
+    ticker.build_markup = lambda items, now: f"{items[0][0]}@{now}"
+    return ticker
+
+
+def test_edits_stay_within_budget(monkeypatch):
+    clock = [0.0]
+    ticker = make_ticker(monkeypatch, -7001, [(order_id, 100 + order_id) for order_id in range(20)], clock)
+
+    async def main():
+        edited = []
+        # Двадцать сообщений хотят обновляться раз в минуту — втрое больше бюджета
+        for step in range(60):
+            clock[0] = step * 10.0
+            edited.append(await ticker.tick(now=T0 + 60 + step * 10))
+            await asyncio.sleep(0)
+        return edited
+
+    edited = asyncio.run(main())
+    assert edited[0] == TICKER_EDIT_BURST
+    # Запас на старте и дальше по TICKER_EDITS_PER_MIN за 590 секунд
+    assert sum(edited) == TICKER_EDIT_BURST + int(TICKER_EDITS_PER_MIN * 590 / 60)
+    for start in range(len(edited) - 6):
+        assert sum(edited[start + 1:start + 7]) <= TICKER_EDITS_PER_MIN
+    assert len(ticker.bot.edits) == sum(edited)
+    # Первыми обновляются самые просроченные: за 10 минут каждое сообщение — хотя бы раз
+    assert {message_id for message_id, _ in ticker.bot.edits} == set(range(100, 120))
+
+
+def test_close_drops_queued_edits(monkeypatch):
+    ticker = make_ticker(monkeypatch, -7002, [(1, 201), (2, 202)])
+
+    async def main():
+        await dispatcher.start()
+        try:
+            # Лимит группы выбран: правки тикера ждут в очереди диспетчера
+            dispatcher.bucket(-7002).block(0.2)
+            queued = await ticker.tick(now=T0 + 60)
+            await ticker.close(1)
+            await asyncio.sleep(0.4)
+            # Снимок из базы ещё видит заказ открытым: тик его не трогает
+            ticker._budget.tokens = TICKER_EDIT_BURST
+            again = await ticker.tick(now=T0 + 200)
+            await asyncio.sleep(0.1)
+            return queued, again, ticker._inflight
+        finally:
+            await dispatcher.stop()
+
+    queued, again, inflight = asyncio.run(main())
+    assert (queued, again) == (2, 1)
+    assert [message_id for message_id, _ in ticker.bot.edits] == [202, 202]
+    assert inflight == {}
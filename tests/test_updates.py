@@ -0,0 +1,141 @@
+import random
+import asyncio
+from time import time
+from types import SimpleNamespace
+
+from telegram import Update
+from telegram.ext import Application, ConversationHandler, MessageHandler, filters
+
+from benchmarks.fake_bot_api import FakeBotApi
+from updates import PerUserUpdateProcessor, serialization_key
+
+API_PORT = 18097
+USERS = 50
+STEPS = 20
+CONCURRENCY = 16
+
+FIRST, SECOND = range(2)
+
+
+def build(processor, base_url, rng, done):
+    builder = Application.builder().token("123:test").base_url(base_url).updater(None)
+    if processor is not None:
+        builder = builder.concurrent_updates(processor)
+    app = builder.build()
+
+    async def step(update, context, state, next_state):
+        data = context.user_data
+        count = data.get("count", 0)
+        visited = data.get("visited", ())
+        await asyncio.sleep(rng.uniform(0.001, 0.005))
+        # Чтение-изменение-запись через await: при гонке два шага увидят одно и то же значение
+        data["count"] = count + 1
+        data["visited"] = (*visited, state)
+        data.setdefault("seen", []).append(int(update.message.text))
+        done()
+        return next_state
+
+    async def first(update, context):
+        return await step(update, context, FIRST, SECOND)
+
+    async def second(update, context):
+        return await step(update, context, SECOND, FIRST)
+
+    text = filters.TEXT & ~filters.COMMAND
+    app.add_handler(ConversationHandler(
+        entry_points=[MessageHandler(text, first)],
+        states={FIRST: [MessageHandler(text, first)], SECOND: [MessageHandler(text, second)]},
+        fallbacks=[],
+    ))
+    return app
+
+
+def make_updates(bot, rng):
+    # Шаги каждого пользователя идут по порядку, но пользователи перемешаны между собой
+    cursors = {user: 0 for user in range(1, USERS + 1)}
+    updates = []
+    while cursors:
+        user = rng.choice(list(cursors))
+        seq = cursors[user]
+        cursors[user] += 1
+        if cursors[user] == STEPS:
+            del cursors[user]
+        updates.append(Update.de_json({
+            "update_id": len(updates) + 1,
+            "message": {
+                "message_id": len(updates) + 1,
+                "date": int(time()),
+                "chat": {"id": user, "type": "private"},
+                "from": {"id": user, "is_bot": False, "first_name": f"u{user}"},
+                "text": str(seq),
+            },
+        }, bot))
+    return updates
+
+
+async def run(processor, seed=7):
+    rng = random.Random(seed)
+    processed = 0
+    finished = asyncio.Event()
+
+    def done():
+        nonlocal processed
+        processed += 1
+        if processed == USERS * STEPS:
+            finished.set()
+
+    api = FakeBotApi()
+    app = build(processor, await api.start(port=API_PORT), rng, done)
+    try:
+        async with app:
+            await app.start()
+            for update in make_updates(app.bot, rng):
+                await app.update_queue.put(update)
+            await asyncio.wait_for(finished.wait(), 60)
+            await app.stop()
+    finally:
+        await api.stop()
+    return app.user_data
+
+
+def test_per_user_processor_keeps_conversations_consistent():
+    user_data = asyncio.run(run(PerUserUpdateProcessor(CONCURRENCY)))
+    expected_states = tuple(FIRST if i % 2 == 0 else SECOND for i in range(STEPS))
+    for user in range(1, USERS + 1):
+        data = user_data[user]
+        assert data["count"] == STEPS
+        assert data["visited"] == expected_states
+        assert data["seen"] == list(range(STEPS))
+
+
+def test_users_run_in_parallel_within_concurrency():
+    processor = PerUserUpdateProcessor(concurrency=3)
+    active = {"now": 0, "max": 0}
+    per_user = {}
+
+    async def handle(user_id):
+        active["now"] += 1
+        active["max"] = max(active["max"], active["now"])
+        per_user[user_id] = per_user.get(user_id, 0) + 1
+        # Свои апдейты пользователя не пересекаются
+        assert per_user[user_id] == 1
+        await asyncio.sleep(0.01)
+        per_user[user_id] -= 1
+        active["now"] -= 1
+
+    async def main():
+        updates = [SimpleNamespace(effective_user=SimpleNamespace(id=user_id % 5)) for user_id in range(40)]
+        await asyncio.gather(*(
+            processor.do_process_update(update, handle(update.effective_user.id)) for update in updates
+        ))
+
+    asyncio.run(main())
+    assert active["max"] == 3
+    assert processor._queues == {}
+
+
+def test_serialization_key():
+    assert serialization_key(SimpleNamespace(effective_user=SimpleNamespace(id=1))) == ("user", 1)
+    update = SimpleNamespace(effective_user=None, effective_chat=SimpleNamespace(id=-5))
+    assert serialization_key(update) == ("chat", -5)
+    assert serialization_key(SimpleNamespace(effective_user=None, effective_chat=None)) is None
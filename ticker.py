@@ -0,0 +1,177 @@
+import os
+import asyncio
+from time import time
+
+from apscheduler.jobstores.base import JobLookupError
+from telegram.error import BadRequest
+
+from db import get_active_orders
+from dispatch import dispatcher, TokenBucket, PRIORITY_BACKGROUND
+from render import render_cache, edit_reply_markup
+
+# Раз в TICKER_INTERVAL собираем сообщения, которым пора обновиться, и правим их в пределах бюджета
+TICKER_INTERVAL = float(os.getenv("TICKER_INTERVAL", "15"))
+TICKER_FRESH_REFRESH = float(os.getenv("TICKER_FRESH_REFRESH", "60"))
+# Заказ, который ждёт дольше этого, обновляется реже: минуты там уже мало что меняют
+TICKER_IDLE_AFTER = float(os.getenv("TICKER_IDLE_AFTER", "1200"))
+TICKER_IDLE_REFRESH = float(os.getenv("TICKER_IDLE_REFRESH", "300"))
+# Общий бюджет правок: лимит группы (~20 в минуту) делим с новыми заказами
+TICKER_EDITS_PER_MIN = float(os.getenv("TICKER_EDITS_PER_MIN", "6"))
+TICKER_EDIT_BURST = float(os.getenv("TICKER_EDIT_BURST", "3"))
+
+
+def refresh_interval(age):
+    return TICKER_FRESH_REFRESH if age < TICKER_IDLE_AFTER else TICKER_IDLE_REFRESH
+
+
+def format_wait(age):
+    mins = int(age // 60)
+    hours, mins = divmod(mins, 60)
+    if hours:
+        return f"{hours}ч {mins}м"
+    return f"{mins}м" if mins else "<1м"
+
+
+class Ticker:
+    def __init__(self):
+        self.bot = None
+        self.chat_id = None
+        self.build_markup = None
+        self._job = None
+        self._budget = TokenBucket(TICKER_EDITS_PER_MIN / 60, TICKER_EDIT_BURST)
+        # (chat_id, message_id) -> когда обновить; одно сообщение — одна запись, сколько бы тиков ни прошло
+        self._due = {}
+        # Сообщение может нести корзину: order_id -> его сообщения
+        self._keys = {}
+        self._closed = set()
+        self._inflight = {}
+        # Правки, чей запрос уже ушёл в Bot API: их не отменить, только дождаться
+        self._running = set()
+        self._ticking = False
+
+    def start(self, job_queue, bot, chat_id, build_markup):
+        # build_markup(items, now): items — (order_id, created_at, status, completed_at) кальянов сообщения
+        if self._job is not None or job_queue is None or not chat_id:
+            return
+        self.bot = bot
+        self.chat_id = chat_id
+        self.build_markup = build_markup
+        self._job = job_queue.run_repeating(
+            self._tick, interval=TICKER_INTERVAL, first=TICKER_INTERVAL, name="order_ticker",
+            job_kwargs={"coalesce": True, "max_instances": 1},
+        )
+
+    def stop(self):
+        if self._job is None:
+            return
+        try:
+            self._job.schedule_removal()
+        except JobLookupError:
+            # Приложение останавливает JobQueue раньше post_stop, задача уже снята
+            pass
+        self._job = None
+
+    async def _tick(self, context):
+        if self._ticking:
+            return
+        self._ticking = True
+        try:
+            await self.tick()
+        finally:
+            self._ticking = False
+
+    def _stale(self, items):
+        # Кальян выдали после снимка из базы: разметка по снимку перетёрла бы "Кальян отдан"
+        return any(order_id in self._closed for order_id, _, status, _ in items if status == "open")
+
+    async def tick(self, now=None):
+        now = time() if now is None else now
+        messages = {}
+        waiting = set()
+        rows = await get_active_orders()
+        for order_id, created_at, zone_message_id, general_message_id, status, completed_at in rows:
+            if status == "open":
+                waiting.add(order_id)
+            for message_id in (zone_message_id, general_message_id):
+                if message_id:
+                    messages.setdefault((self.chat_id, message_id), []).append(
+                        (order_id, created_at, status, completed_at)
+                    )
+        # Сообщения, где всё выдано, выпадают из расписания
+        for key in self._due.keys() - messages.keys():
+            del self._due[key]
+        self._closed &= waiting
+        self._keys = {}
+        for key, items in messages.items():
+            for order_id, *_ in items:
+                self._keys.setdefault(order_id, []).append(key)
+
+        due = []
+        for key, items in messages.items():
+            if self._stale(items):
+                continue
+            # Отсчёт — от самого давнего невыданного кальяна
+            created_at = min(created for _, created, status, _ in items if status == "open")
+            when = self._due.setdefault(key, created_at + TICKER_FRESH_REFRESH)
+            if when <= now:
+                due.append((when, key, created_at, items))
+
+        # Сначала самые просроченные; что не влезло в бюджет — останется due до следующего тика
+        due.sort(key=lambda entry: entry[:2])
+        edited = 0
+        for when, key, created_at, items in due:
+            age = now - created_at
+            markup = self.build_markup(items, now)
+            if render_cache.is_current(*key, None, markup):
+                self._due[key] = now + refresh_interval(age)
+                continue
+            if self._budget.delay():
+                break
+            self._due[key] = now + refresh_interval(age)
+            self._edit(key, items, markup)
+            edited += 1
+        return edited
+
+    def _edit(self, key, items, markup):
+        chat_id, message_id = key
+
+        async def call():
+            # Кальян могли выдать, пока правка стояла в очереди
+            if self._stale(items):
+                return False
+            self._running.add(future)
+            return await edit_reply_markup(self.bot, chat_id, message_id, markup)
+
+        future = dispatcher.submit(chat_id, call, priority=PRIORITY_BACKGROUND)
+        self._inflight.setdefault(key, set()).add(future)
+        future.add_done_callback(lambda f: self._edited(key, f))
+
+    def _edited(self, key, future):
+        self._running.discard(future)
+        pending = self._inflight.get(key)
+        if pending is not None:
+            pending.discard(future)
+            if not pending:
+                del self._inflight[key]
+        if not future.cancelled() and isinstance(future.exception(), BadRequest) and key in self._due:
+            # Сообщение удалили — больше его не трогаем
+            self._due[key] = float("inf")
+
+    async def close(self, order_id):
+        # Вызывается перед правкой "Кальян отдан (...)", чтобы запоздавший тик её не перетёр.
+        # Остальные кальяны корзины продолжают тикать: следующий тик увидит этот уже выданным
+        self._closed.add(order_id)
+        running = set()
+        for key in self._keys.get(order_id, ()):
+            for future in list(self._inflight.get(key, ())):
+                if future in self._running:
+                    running.add(future)
+                else:
+                    # Ещё в очереди диспетчера (или отложена лимитом группы): отменённую он выбросит,
+                    # не дожидаясь бюджета чата, и выдача не ждёт чужую правку
+                    future.cancel()
+        if running:
+            await asyncio.wait(running)
+
+
+ticker = Ticker()
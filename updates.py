@@ -0,0 +1,71 @@
+import os
+import asyncio
+from contextlib import asynccontextmanager
+
+from telegram.ext import BaseUpdateProcessor
+
+# Сколько апдейтов разных сотрудников обрабатывается одновременно; 1 — последовательно, как в PTB по умолчанию
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "16"))
+# Сколько апдейтов может висеть в обработке вместе с ждущими своей очереди
+UPDATE_BACKLOG = int(os.getenv("UPDATE_BACKLOG", "1024"))
+
+
+def serialization_key(update):
+    # Диалог и user_data привязаны к пользователю: его апдейты идут строго по одному
+    user = getattr(update, "effective_user", None)
+    if user is not None:
+        return "user", user.id
+    chat = getattr(update, "effective_chat", None)
+    if chat is not None:
+        return "chat", chat.id
+    return None
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    # Семафор базового класса ограничивает только число апдейтов в работе (backlog);
+    # реальная параллельность — свой семафор, который берётся уже после очереди пользователя,
+    # чтобы десяток нажатий одного сотрудника не занимал слоты остальных
+    def __init__(self, concurrency=UPDATE_CONCURRENCY, backlog=UPDATE_BACKLOG):
+        super().__init__(max(backlog, concurrency, 2))
+        self.concurrency = max(1, concurrency)
+        self._slots = asyncio.BoundedSemaphore(self.concurrency)
+        self._queues = {}
+
+    async def do_process_update(self, update, coroutine):
+        key = serialization_key(update)
+        if key is None:
+            async with self._slots:
+                await coroutine
+            return
+        async with self._user_queue(key):
+            async with self._slots:
+                await coroutine
+
+    async def process_sequence(self, key, updates, process):
+        # Накопленные за простой апдейты одного пользователя: его очередь занята до последнего из них,
+        # новые нажатия встают следом, а слот берётся на каждый апдейт и не мешает остальным
+        async with self._user_queue(key):
+            for update in updates:
+                async with self._slots:
+                    await process(update)
+
+    @asynccontextmanager
+    async def _user_queue(self, key):
+        # asyncio.Lock будит ждущих по порядку, а задачи апдейтов стартуют в порядке получения
+        entry = self._queues.get(key)
+        if entry is None:
+            entry = self._queues[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._queues[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
@@ -0,0 +1,97 @@
+import os
+import signal
+import asyncio
+from hmac import compare_digest
+from secrets import token_urlsafe
+from time import time
+
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+
+from metrics import metrics_view
+
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def build_web_app(application: Application, path=WEBHOOK_PATH, secret=WEBHOOK_SECRET):
+    started = time()
+
+    async def telegram_update(request: web.Request):
+        if not compare_digest(request.headers.get(SECRET_HEADER, ""), secret):
+            return web.Response(status=403)
+        try:
+            payload = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        # Апдейт уходит в ту же очередь, что и при polling: обработчики не меняются
+        await application.update_queue.put(Update.de_json(payload, application.bot))
+        return web.Response()
+
+    async def health(request: web.Request):
+        return web.json_response({
+            "status": "ok" if application.running else "starting",
+            "mode": "webhook",
+            "pending_updates": application.update_queue.qsize(),
+            "uptime": int(time() - started),
+        })
+
+    if not secret:
+        raise ValueError("webhook без секрета принимает апдейты от кого угодно")
+    web_app = web.Application()
+    web_app.router.add_post(path, telegram_update)
+    web_app.router.add_get("/healthz", health)
+    web_app.router.add_get("/metrics", metrics_view)
+    return web_app
+
+
+async def serve_webhook(application: Application, stop_event=None, listen=WEBHOOK_LISTEN, port=WEBHOOK_PORT,
+                        url=WEBHOOK_URL, path=WEBHOOK_PATH, secret=WEBHOOK_SECRET):
+    if stop_event is None:
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop_event.set)
+            except NotImplementedError:
+                pass
+    if not secret:
+        if not url:
+            # Webhook ставили снаружи: какой секрет знает Telegram, нам неизвестно
+            raise RuntimeError("BOT_MODE=webhook без WEBHOOK_URL требует WEBHOOK_SECRET")
+        # Ставим webhook сами: секрет на время жизни процесса, Telegram получит его в set_webhook
+        secret = token_urlsafe(32)
+
+    runner = web.AppRunner(build_web_app(application, path, secret))
+    await runner.setup()
+    site = web.TCPSite(runner, listen, port)
+
+    # post_init/post_stop/post_shutdown PTB вызывает только в run_polling/run_webhook, здесь — сами
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        if url:
+            await application.bot.set_webhook(
+                url=url.rstrip("/") + path,
+                secret_token=secret,
+                allowed_updates=Update.ALL_TYPES,
+            )
+        await application.start()
+        await site.start()
+        await stop_event.wait()
+    finally:
+        await runner.cleanup()
+        if application.running:
+            await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)